@@ -0,0 +1,173 @@
+"""
+This script is the client side of the bulk-transfer pair (see
+bulk_server.py). It downloads a file or a synthetic blob and reports the
+achieved throughput in GB/s.
+
+The receive path allocates nothing per read: every stream owns one
+preallocated bytearray, the socket fills it with recv_into() through a
+memoryview, and the CRC-32 is updated over the same memoryview slice as
+the data arrives (streaming verification, no second pass). With --output
+the slice is written straight to the file. Several parallel streams
+(threads; recv_into and crc32 release the GIL) can be used to saturate a
+fast NIC.
+
+Examples:
+    python3 bulk_client.py --port 7070 --size 1G
+    python3 bulk_client.py --host 10.0.0.2 --size 4G --streams 4 --no-verify
+    python3 bulk_client.py --port 7070 --file dataset.bin --output dataset.bin
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+import zlib
+
+from bulk_server import DEFAULT_PORT, parse_size
+from framing import HEADER, send_frame
+
+RECV_BUFFER = 4 * 1024 * 1024
+
+
+class TransferError(Exception):
+    """Raised when the server refuses a request or the data does not verify."""
+
+
+def _recv_exact(sock, view):
+    """Fills `view` completely from the socket."""
+    got = 0
+    while got < len(view):
+        n = sock.recv_into(view[got:])
+        if not n:
+            raise TransferError("connection closed during the header")
+        got += n
+
+
+def _recv_header(sock) -> dict:
+    # Read the header frame by hand so no body bytes end up in a decoder.
+    prefix = bytearray(HEADER.size)
+    _recv_exact(sock, memoryview(prefix))
+    (length,) = HEADER.unpack(prefix)
+    body = bytearray(length)
+    _recv_exact(sock, memoryview(body))
+    header = json.loads(body)
+    if "error" in header:
+        raise TransferError(header["error"])
+    return header
+
+
+def fetch(host, port, request, verify=True, output=None, bufsize=RECV_BUFFER, rcvbuf=0) -> dict:
+    """Runs one transfer ("GET <name>" / "GEN <size>") and returns its stats."""
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        if rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        sock.connect((host, port))
+        send_frame(sock, request.encode("utf-8"))
+        header = _recv_header(sock)
+        size = header["size"]
+        out = open(output, "wb") if output else None
+        crc = 0
+        received = 0
+        start = time.perf_counter()
+        try:
+            while received < size:
+                n = sock.recv_into(view, min(bufsize, size - received))
+                if not n:
+                    raise TransferError(f"connection closed after {received} of {size} bytes")
+                chunk = view[:n]
+                if verify:
+                    crc = zlib.crc32(chunk, crc)
+                if out:
+                    out.write(chunk)
+                received += n
+        finally:
+            if out:
+                out.close()
+        elapsed = time.perf_counter() - start
+    if verify and crc != header["crc32"]:
+        raise TransferError(f"checksum mismatch for {header['name']}: "
+                            f"got {crc:08x}, expected {header['crc32']:08x}")
+    return {"name": header["name"], "bytes": received, "seconds": elapsed,
+            "verified": verify, "crc32": f"{header['crc32']:08x}"}
+
+
+def run_transfer(host="127.0.0.1", port=DEFAULT_PORT, size=None, file=None, streams=1,
+                 verify=True, output=None, bufsize=RECV_BUFFER, rcvbuf=0) -> dict:
+    """Runs `streams` transfers in parallel and returns the aggregate throughput."""
+    request = f"GET {file}" if file else f"GEN {parse_size(size or '1G')}"
+    if output and streams > 1:
+        raise ValueError("--output needs a single stream")
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(fetch(host, port, request, verify, output, bufsize, rcvbuf))
+        except (OSError, TransferError, ValueError) as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(streams)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = sum(r["bytes"] for r in results)
+    return {
+        "request": request,
+        "streams": streams,
+        "completed": len(results),
+        "errors": errors,
+        "bytes": total,
+        "elapsed_sec": round(elapsed, 3),
+        "gb_per_sec": round(total / elapsed / 1e9, 3) if elapsed else 0.0,
+        "gbit_per_sec": round(total * 8 / elapsed / 1e9, 2) if elapsed else 0.0,
+        "verified": verify and not errors,
+    }
+
+
+def print_report(result: dict):
+    print("------------------------------------")
+    print(f"Request:     {result['request']} x {result['streams']} stream(s)")
+    print(f"Completed:   {result['completed']}/{result['streams']}")
+    print(f"Transferred: {result['bytes'] / 1e9:.3f} GB in {result['elapsed_sec']} s")
+    print(f"Throughput:  {result['gb_per_sec']} GB/s ({result['gbit_per_sec']} Gbit/s)")
+    print(f"Checksum:    {'verified' if result['verified'] else 'not verified'}")
+    for e in result["errors"]:
+        print(f"ERROR: {e}")
+    print("------------------------------------")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bulk-transfer client (recv_into, streaming CRC-32)")
+    ap.add_argument("--host", default="127.0.0.1", help="Server host")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT, help="Server port")
+    what = ap.add_mutually_exclusive_group()
+    what.add_argument("--size", default="1G", help="Synthetic transfer size (e.g. 512M, 4G)")
+    what.add_argument("--file", help="File name under the server's --root")
+    ap.add_argument("--streams", type=int, default=1, help="Parallel connections")
+    ap.add_argument("--bufsize", type=parse_size, default=RECV_BUFFER, help="Receive buffer per stream")
+    ap.add_argument("--rcvbuf", type=parse_size, default=0, help="SO_RCVBUF (0 = kernel default)")
+    ap.add_argument("--no-verify", action="store_true", help="Skip the CRC-32 check (raw ceiling)")
+    ap.add_argument("--output", help="Write the received data to this file")
+    args = ap.parse_args(argv)
+
+    result = run_transfer(
+        host=args.host,
+        port=args.port,
+        size=args.size,
+        file=args.file,
+        streams=args.streams,
+        verify=not args.no_verify,
+        output=args.output,
+        bufsize=args.bufsize,
+        rcvbuf=args.rcvbuf,
+    )
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
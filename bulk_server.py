@@ -0,0 +1,305 @@
+"""
+This module is the server side of the bulk-transfer pair. It moves large
+files (or synthetic test data) to clients as fast as the kernel allows,
+to measure the real loopback and NIC throughput ceilings.
+
+Protocol (one transfer per connection):
+    client -> server   frame "GET <name>" or "GEN <size>"
+    server -> client   frame with a JSON header {"name", "size", "crc32"}
+                       (or {"error": ...}), then exactly `size` raw bytes
+
+- "sendfile" method: socket.sendfile() / os.sendfile() hands the file's
+  page-cache pages straight to the socket; the data never enters Python.
+- "mmap" method: the file is memory-mapped and sent with send() on
+  memoryview slices of the mapping, without any intermediate bytes objects.
+- The CRC-32 sent in the header is computed once per file over the same
+  mapping and cached until the file changes. "GEN <size>" serves the first
+  `size` bytes of one cached synthetic file, so benchmarks need no real
+  files. The file is extended (never rewritten) when a larger size is
+  asked for, and sizes above --max-gen (default 2 GiB, 0 = GEN disabled)
+  are refused so a client cannot fill the disk.
+
+Each connection is served on its own thread (sendfile and send release
+the GIL); with workers > 1 the server is pre-forked over SO_REUSEPORT
+(see worker_pool.py). The transfer counters are exported through
+metrics.py (--metrics-port / --metrics-file).
+
+Example:
+    python3 bulk_server.py --port 7070 --root ./shared
+    python3 bulk_client.py --port 7070 --size 2G --streams 4
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import metrics
+from framing import FrameDecoder, FrameTooLarge, recv_frames, send_frame
+
+DEFAULT_PORT = 7070
+CHUNK_SIZE = 4 * 1024 * 1024
+CRC_CHUNK = 64 * 1024 * 1024
+MAX_REQUEST_SIZE = 4096
+MAX_SYNTHETIC_SIZE = 2 * 1024 ** 3
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(text) -> int:
+    """'512', '64K', '1.5G' -> bytes (binary units)."""
+    text = str(text).strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    unit = text[-1] if text and text[-1] in SIZE_UNITS else ""
+    value = float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit]
+    if not math.isfinite(value):
+        raise ValueError(f"size must be finite: {text!r}")
+    return int(value)
+
+
+def crc32_of(path, size=None) -> int:
+    """Streaming CRC-32 over a memory-mapped file, or its first `size` bytes (no read() copies)."""
+    crc = 0
+    with open(path, "rb") as f:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return crc
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for start in range(0, len(view), CRC_CHUNK):
+                    crc = zlib.crc32(view[start:start + CRC_CHUNK], crc)
+            finally:
+                view.release()
+    return crc
+
+
+class BulkServer:
+    """Serves files from `root` and synthetic files of any size."""
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_PORT, root=".", method="sendfile",
+                 reuse_port=False, stats_hook=None, max_synthetic=MAX_SYNTHETIC_SIZE):
+        if method not in ("sendfile", "mmap"):
+            raise ValueError(f"Unknown send method: {method!r}")
+        self.host = host
+        self.port = port
+        self.root = Path(root).resolve()
+        self.method = method
+        self.reuse_port = reuse_port
+        self.stats_hook = stats_hook
+        self.max_synthetic = max_synthetic
+        self.stats = {"accepted": 0, "active": 0, "transfers": 0, "errors": 0, "bytes_out": 0}
+        self._checksums = {}   # path -> (mtime_ns, size, crc32)
+        self._synthetic = None     # the one synthetic file, grown on demand
+        self._synthetic_size = 0   # bytes of it that are written and readable
+        self._synthetic_crc = {}   # size -> crc32 of that prefix
+        self._lock = threading.Lock()
+        self._gen_lock = threading.Lock()   # serialises growing the synthetic file only
+        for key in self.stats:
+            kind = "Open connections" if key == "active" else f"Total {key.replace('_', ' ')}"
+            metrics.gauge(f"bulk_{key}", kind, fn=lambda key=key: self.stats[key], port=port)
+        self._tmpdir = None
+        self._running = False
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    # -- files ---------------------------------------------------------------
+
+    def _checksum(self, path: Path) -> int:
+        st = path.stat()
+        with self._lock:
+            cached = self._checksums.get(path)
+        if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+        crc = crc32_of(path)
+        with self._lock:
+            self._checksums[path] = (st.st_mtime_ns, st.st_size, crc)
+        return crc
+
+    def _synthetic_file(self, size: int) -> Path:
+        """Returns the synthetic file, grown to hold at least `size` bytes.
+
+        The file repeats one random CHUNK_SIZE block and only ever grows by
+        whole blocks, so any prefix stays valid while another thread extends
+        it. Writing happens under _gen_lock, not the shared _lock, so
+        counters and checksums of other transfers never wait on the disk.
+        """
+        if not self.max_synthetic:
+            raise ValueError("synthetic transfers are disabled on this server")
+        if not 0 <= size <= self.max_synthetic:
+            raise ValueError(f"synthetic size must be between 0 and {self.max_synthetic}")
+        with self._lock:
+            if self._synthetic is not None and size <= self._synthetic_size:
+                return self._synthetic
+        with self._gen_lock:
+            if self._synthetic is None:
+                self._tmpdir = tempfile.TemporaryDirectory(prefix="bulk-")
+                self._synthetic = Path(self._tmpdir.name) / "synthetic"
+                self._block = os.urandom(CHUNK_SIZE)
+                self._synthetic.touch()
+            written = self._synthetic_size
+            if size > written:
+                target = -(-size // CHUNK_SIZE) * CHUNK_SIZE
+                with open(self._synthetic, "ab") as f:
+                    while written < target:
+                        written += f.write(self._block)
+                with self._lock:
+                    self._synthetic_size = written
+            return self._synthetic
+
+    def _synthetic_checksum(self, path: Path, size: int) -> int:
+        with self._lock:
+            crc = self._synthetic_crc.get(size)
+        if crc is None:
+            crc = crc32_of(path, size)
+            with self._lock:
+                if len(self._synthetic_crc) >= 256:
+                    self._synthetic_crc.clear()
+                self._synthetic_crc[size] = crc
+        return crc
+
+    def resolve(self, request: str) -> tuple:
+        """Maps a request to (path, bytes to send, crc32 of those bytes)."""
+        verb, _, arg = request.partition(" ")
+        if verb == "GEN":
+            size = parse_size(arg)
+            path = self._synthetic_file(size)
+            return path, size, self._synthetic_checksum(path, size)
+        if verb == "GET":
+            path = (self.root / arg).resolve()
+            if self.root not in path.parents or not path.is_file():
+                raise FileNotFoundError(f"no such file: {arg}")
+            return path, path.stat().st_size, self._checksum(path)
+        raise ValueError(f"bad request: {request!r}")
+
+    # -- transfer ------------------------------------------------------------
+
+    def _send_mmap(self, conn, f, size):
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                sent = 0
+                while sent < size:
+                    sent += conn.send(view[sent:sent + CHUNK_SIZE])
+            finally:
+                view.release()
+
+    def _send_body(self, conn, path, size):
+        with open(path, "rb") as f:
+            if size == 0:
+                return
+            if self.method == "mmap":
+                self._send_mmap(conn, f, size)
+            else:
+                # Falls back to plain send() where os.sendfile() is missing.
+                conn.sendfile(f, 0, size)
+
+    def handle(self, conn, addr):
+        with conn:
+            try:
+                frames = recv_frames(conn, FrameDecoder(max_frame_size=MAX_REQUEST_SIZE))
+                if not frames:
+                    return
+                request = bytes(frames[0]).decode("utf-8", errors="replace").strip()
+                try:
+                    path, size, crc = self.resolve(request)
+                except (OSError, ValueError) as e:
+                    send_frame(conn, json.dumps({"error": str(e)}).encode("utf-8"))
+                    self._count(errors=1)
+                    return
+                header = {"name": path.name, "size": size, "crc32": crc}
+                send_frame(conn, json.dumps(header).encode("utf-8"))
+                start = time.perf_counter()
+                self._send_body(conn, path, size)
+                elapsed = time.perf_counter() - start
+                self._count(transfers=1, bytes_out=size)
+                print(f"[Bulk Server] {addr[0]}:{addr[1]} <- {request} "
+                      f"({size / 1e9:.2f} GB in {elapsed:.2f}s via {self.method})")
+            except (OSError, FrameTooLarge) as e:
+                self._count(errors=1)
+                print(f"[Bulk Server] Transfer to {addr[0]}:{addr[1]} failed: {e}")
+            finally:
+                self._count(active=-1)
+                if self.stats_hook:
+                    self.stats_hook(dict(self.stats))
+
+    def serve_forever(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
+            srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            srv.bind((self.host, self.port))
+            srv.listen(128)
+            srv.settimeout(0.5)
+            self.port = srv.getsockname()[1]
+            print(f"[Bulk Server] Listening on {self.host}:{self.port} "
+                  f"(root={self.root}, method={self.method})")
+            self._running = True
+            try:
+                while self._running:
+                    try:
+                        conn, addr = srv.accept()
+                    except socket.timeout:
+                        continue
+                    conn.settimeout(None)
+                    self._count(accepted=1, active=1)
+                    threading.Thread(target=self.handle, args=(conn, addr), daemon=True).start()
+            finally:
+                if self._tmpdir is not None:
+                    self._tmpdir.cleanup()
+
+    def stop(self):
+        self._running = False
+
+
+def start_bulk_server(host="0.0.0.0", port=DEFAULT_PORT, root=".", method="sendfile",
+                      workers=1, reuse_port=False, stats_hook=None, max_synthetic=MAX_SYNTHETIC_SIZE):
+    """Runs the bulk-transfer server until Ctrl+C."""
+    if workers > 1:
+        from worker_pool import run_worker_pool
+        run_worker_pool(
+            start_bulk_server,
+            {"host": host, "port": port, "root": str(root), "method": method,
+             "max_synthetic": max_synthetic},
+            workers,
+            name="Bulk Pool",
+        )
+        return
+    server = BulkServer(host, port, root, method, reuse_port, stats_hook, max_synthetic)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[Bulk Server] Interrupted by user.")
+    finally:
+        print(f"[Bulk Server] Stats: {server.stats}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bulk-transfer server (sendfile / mmap)")
+    ap.add_argument("--host", default="0.0.0.0", help="Bind host")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT, help="Bind port")
+    ap.add_argument("--root", default=".", help="Directory served to GET requests")
+    ap.add_argument("--method", choices=("sendfile", "mmap"), default="sendfile", help="How file data is sent")
+    ap.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port (SO_REUSEPORT)")
+    ap.add_argument("--max-gen", type=parse_size, default=MAX_SYNTHETIC_SIZE,
+                    help="Largest GEN <size> served, e.g. 512M (0 = disable GEN)")
+    metrics.add_arguments(ap)
+    args = ap.parse_args(argv)
+    metrics.enable_from_args(args)
+    start_bulk_server(args.host, args.port, args.root, args.method, args.workers,
+                      max_synthetic=args.max_gen)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""
+This module is the asyncio chat client core, kept separate from any user
+interface. simple_chat_client.py puts a terminal on top of it, and the
+"load" command below runs hundreds of headless clients against the hub.
+
+- Outbound messages go through a bounded queue. The writer takes
+  everything that is pending (up to `max_batch` messages) and writes it
+  as one write() call, then waits for drain(), so a slow server
+  pushes back instead of memory growing. When the queue is full the
+  oldest message is dropped and counted.
+- When the connection drops the client reconnects with exponential
+  backoff and full jitter, so hundreds of clients do not reconnect in
+  lockstep. The nickname and room are restored, and messages still in
+  the queue are sent on the new connection. (Messages already written to
+  a connection that then died may be lost.)
+- With resume=True (the hub, see chat_hub.py) the client opts in to
+  sequence numbers. After a reconnect it asks for everything after the
+  last sequence number it saw, so no messages are missed or repeated.
+  If the hub could not replay everything ("@resume <n> truncated"), the
+  gap is reported through on_status and counted in stats["truncated"].
+- Load mode can spread its clients over several federated hubs
+  (--ports, see chat_relay.py) and then also reports the latency of
+  messages that crossed from one hub to another.
+- With `tls` (a context from tls.client_context()) the connection uses
+  TLS, and reconnects resume the previous TLS session.
+- With binary=True the client asks the hub for binary envelopes (see
+  chat_envelope.py) on every connect. Once the hub agrees, outgoing
+  batches are sent as one compressed batch envelope, and incoming
+  envelopes are handed to on_message as the same text a plain client
+  would see, with the message id as seq. Other servers keep plain text.
+
+Examples:
+    python3 chat_client.py load --port 6060 --clients 300 --rate 2 --duration 30
+    python3 simple_chat_client.py --port 6060 --hub
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import random
+import socket
+import ssl
+import time
+from collections import deque
+
+from chat_envelope import (COMPRESSIONS, FORMAT, MESSAGE, EnvelopeError, decode_frame, encode_message,
+                           format_line, is_envelope, pack_batches)
+from framing import MAX_FRAME_SIZE, FrameDecoder, FrameTooLarge, write_frames
+from histogram import LatencyHistogram
+from settings import apply_profile
+
+MAX_QUEUE = 1000
+MAX_BATCH = 64
+BACKOFF_MIN = 0.2
+BACKOFF_MAX = 10.0
+READ_SIZE = 64 * 1024
+
+
+def backoff_delay(attempt: int, low=BACKOFF_MIN, high=BACKOFF_MAX) -> float:
+    """Exponential backoff with full jitter: uniform(0, min(high, low * 2**attempt))."""
+    return random.uniform(0, min(high, low * (2 ** attempt)))
+
+
+class ChatClient:
+    """Reconnecting chat connection with a coalescing, bounded outbound queue.
+
+    on_message(text, seq) is called for every frame received; seq is the
+    hub's sequence number, or None for notices and untagged messages.
+    on_status(text) reports connects, disconnects and drops.
+    """
+
+    def __init__(self, host="127.0.0.1", port=6060, name=None, room=None, on_message=None,
+                 on_status=None, resume=False, max_queue=MAX_QUEUE, max_batch=MAX_BATCH,
+                 reconnect=True, backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX, profile=None,
+                 tls=None, binary=False, fail_fast=False):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.room = room
+        self.on_message = on_message or (lambda text, seq: None)
+        self.on_status = on_status or (lambda text: None)
+        self.resume = resume
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.reconnect = reconnect
+        self.fail_fast = fail_fast  # raise if the very first connect fails, even with reconnect
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.profile = profile
+        self.tls = tls
+        self.binary = binary
+        self.codec = None  # compression agreed with the hub once it sends binary envelopes
+        self.last_seq = None
+        self.stats = {"connects": 0, "sent": 0, "writes": 0, "received": 0, "dropped": 0,
+                      "duplicates": 0, "replayed": 0, "truncated": 0, "bytes_in": 0, "bytes_out": 0}
+        self._queue = deque()
+        self._pending = asyncio.Event()
+        self._connected = asyncio.Event()
+        self._closing = False
+        self._writer = None
+        self._replaying = False
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    async def wait_connected(self):
+        await self._connected.wait()
+
+    def send(self, text: str):
+        """Queues one message; never blocks. The oldest message is dropped when full."""
+        cmd, _, arg = text.partition(" ")
+        if cmd == "/nick" and arg.strip():
+            self.name = arg.strip()
+        elif cmd == "/join" and arg.strip():
+            self.room = arg.strip().lstrip("#")
+            self.last_seq = None  # sequence numbers are per hub, but replay is per room
+        self._queue.append(text.encode("utf-8"))
+        if len(self._queue) > self.max_queue:
+            self._queue.popleft()
+            self.stats["dropped"] += 1
+        self._pending.set()
+
+    async def close(self):
+        self._closing = True
+        self._pending.set()
+        if self._writer is not None:
+            self._writer.close()
+
+    # -- connection ----------------------------------------------------------
+
+    async def _open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if self.profile:
+                apply_profile(sock, self.profile)
+            sock.setblocking(False)
+            await asyncio.get_running_loop().sock_connect(sock, (self.host, self.port))
+        except BaseException:
+            sock.close()
+            raise
+        if self.tls is None:
+            return await asyncio.open_connection(sock=sock)
+        return await asyncio.open_connection(sock=sock, ssl=self.tls, server_hostname=self.host)
+
+    def _remember_session(self, writer):
+        # TLS 1.3 tickets arrive after the handshake, so this runs once data was read.
+        if self.tls is not None and hasattr(self.tls, "remember"):
+            self.tls.remember(writer.get_extra_info("ssl_object"))
+
+    def _hello(self) -> list:
+        """Control frames that restore the session on a new connection."""
+        frames = []
+        self.codec = None
+        if self.binary:
+            frames.append(f"/codec {FORMAT} {','.join(COMPRESSIONS)}")
+        if self.name:
+            frames.append(f"/nick {self.name}")
+        if self.room:
+            frames.append(f"/join {self.room}")
+        if self.resume:
+            frames.append("/resume" if self.last_seq is None else f"/resume {self.last_seq}")
+            # Until the hub acknowledges, untagged messages are ones the replay will resend.
+            self._replaying = self.last_seq is not None
+        return [f.encode("utf-8") for f in frames]
+
+    async def run(self):
+        """Connects and serves until close(); reconnects if enabled."""
+        attempt = 0
+        while not self._closing:
+            try:
+                reader, writer = await self._open()
+            except OSError as e:
+                if not self.reconnect or (self.fail_fast and not self.stats["connects"]):
+                    raise
+                delay = backoff_delay(attempt, self.backoff_min, self.backoff_max)
+                self.on_status(f"connect failed ({e}); retrying in {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            attempt = 0
+            self.stats["connects"] += 1
+            self._writer = writer
+            write_frames(writer, self._hello())
+            self._connected.set()
+            self.on_status(f"connected to {self.host}:{self.port}"
+                           + (f" ({writer.get_extra_info('ssl_object').version()})" if self.tls else ""))
+            await self._serve(reader, writer)
+            self._remember_session(writer)
+            self._connected.clear()
+            self._writer = None
+            if self._closing:
+                break
+            self.on_status("connection lost")
+            if not self.reconnect:
+                break
+            await asyncio.sleep(backoff_delay(0, self.backoff_min, self.backoff_max))
+
+    async def _serve(self, reader, writer):
+        tasks = [asyncio.ensure_future(self._read_loop(reader, writer)),
+                 asyncio.ensure_future(self._write_loop(writer))]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def _write_loop(self, writer):
+        while not self._closing:
+            if not self._queue:
+                self._pending.clear()
+                await self._pending.wait()
+                continue
+            if writer.is_closing():
+                return
+            n = min(len(self._queue), self.max_batch)
+            batch = [self._queue.popleft() for _ in range(n)]
+            if self.codec is not None:
+                batch = pack_batches([encode_message(MESSAGE, 0, "", "", text, compression=self.codec)
+                                      for text in batch], self.codec)
+            write_frames(writer, batch)
+            self.stats["bytes_out"] += sum(len(payload) for payload in batch)
+            self.stats["sent"] += n
+            self.stats["writes"] += 1
+            try:
+                await writer.drain()
+            except ConnectionError:
+                return
+
+    async def _read_loop(self, reader, writer):
+        decoder = FrameDecoder()
+        first = True
+        while True:
+            try:
+                data = await reader.read(READ_SIZE)
+            except (ConnectionError, ssl.SSLError):
+                return
+            if not data:
+                return
+            self.stats["bytes_in"] += len(data)
+            if first:
+                first = False
+                self._remember_session(writer)
+            try:
+                frames = decoder.feed(data)
+            except FrameTooLarge as e:
+                self.on_status(f"dropping connection: {e}")
+                return
+            for frame in frames:
+                if self.codec is None or not is_envelope(frame):
+                    self._dispatch(str(frame, "utf-8", "replace"))
+                    continue
+                try:
+                    messages = decode_frame(frame, MAX_FRAME_SIZE)
+                except EnvelopeError as e:
+                    self.on_status(f"dropping connection: {e}")
+                    return
+                for message in messages:
+                    self._dispatch(format_line(message), message.msg_id if message.kind == MESSAGE else None)
+
+    def _dispatch(self, text: str, seq=None):
+        self.stats["received"] += 1
+        if text.startswith("@codec "):
+            fmt, _, compression = text[7:].partition(" ")
+            if fmt == FORMAT:
+                self.codec = compression or "none"
+                self.on_status(f"using binary envelopes ({self.codec})")
+            return
+        if text.startswith("@resume "):
+            self._replaying = False
+            parts = text.split()
+            self.stats["replayed"] += int(parts[1])
+            if "truncated" in parts[2:]:
+                self.stats["truncated"] += 1
+                self.on_status("resume truncated: older missed messages were not replayed")
+            return
+        if seq is None and text.startswith("@"):
+            head, _, body = text.partition(" ")
+            if head[1:].isdigit():
+                seq, text = int(head[1:]), body
+        if seq is None:
+            if self._replaying and not text.startswith("*"):
+                return  # sent before the resume took effect; the replay covers it
+        elif self.last_seq is not None and seq <= self.last_seq:
+            self.stats["duplicates"] += 1
+            return
+        else:
+            self.last_seq = seq
+            if self.name and text.partition("] ")[2].startswith(f"{self.name}: "):
+                return  # our own message coming back in a replay
+        self.on_message(text, seq)
+
+
+# -- headless load mode ----------------------------------------------------------
+
+def _node_of(name: str, ports) -> int:
+    """Index of the hub port a load client connects to ("load7" -> 7 % len(ports))."""
+    return int(name[4:]) % len(ports) if name[4:].isdigit() else -1
+
+
+async def _load_client(i, args, hists, totals, deadline, tls):
+    tag = f"load{i}"
+    ports = args.ports or [args.port]
+    node = _node_of(tag, ports)
+
+    def on_message(text, seq):
+        if seq is None:
+            return  # notices and "(history)" replays of earlier runs
+        head, _, body = text.partition(": ")
+        parts = body.split(" ", 2)
+        if len(parts) >= 2 and parts[0] == "LOAD":
+            try:
+                latency = (time.time() - float(parts[1])) * 1_000_000
+            except ValueError:
+                return
+            hists["all"].record(latency)
+            if len(ports) > 1 and _node_of(head.rpartition("] ")[2], ports) != node:
+                hists["cross"].record(latency)  # relayed from another hub
+
+    client = ChatClient(args.host, ports[node], name=tag, room=args.room, on_message=on_message,
+                        resume=True, profile=args.profile, tls=tls, binary=args.binary)
+    runner = asyncio.ensure_future(client.run())
+    pad = "x" * max(0, args.size - 24)
+    # Spread the first sends so the clients do not fire in lockstep.
+    await asyncio.sleep(random.uniform(0, 1.0 / args.rate if args.rate else 0))
+    while time.monotonic() < deadline:
+        if client.connected:
+            client.send(f"LOAD {time.time():.6f} {pad}")
+        await asyncio.sleep(1.0 / args.rate if args.rate else deadline - time.monotonic())
+    await asyncio.sleep(args.drain)
+    await client.close()
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    for key, value in client.stats.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+async def _run_load(args, first, count):
+    hists = {"all": LatencyHistogram(), "cross": LatencyHistogram()}
+    totals = {}
+    deadline = time.monotonic() + args.duration
+    tls = None
+    if args.tls or args.cafile or args.insecure:
+        # One context per process, so the clients share resumable sessions.
+        from tls import client_from_args
+        tls = client_from_args(args)
+    await asyncio.gather(*(_load_client(first + i, args, hists, totals, deadline, tls)
+                           for i in range(count)))
+    return hists, totals
+
+
+def _load_process(args, first, count, results):
+    results.put(asyncio.run(_run_load(args, first, count)))
+
+
+def run_load(args) -> dict:
+    """Runs args.clients headless clients (over args.processes processes) and merges the results."""
+    shares = [args.clients // args.processes + (i < args.clients % args.processes)
+              for i in range(args.processes)]
+    start = time.perf_counter()
+    if args.processes == 1:
+        outcomes = [asyncio.run(_run_load(args, 0, args.clients))]
+    else:
+        results = mp.Queue()
+        procs = [mp.Process(target=_load_process, args=(args, sum(shares[:i]), n, results))
+                 for i, n in enumerate(shares)]
+        for p in procs:
+            p.start()
+        outcomes = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+    elapsed = time.perf_counter() - start
+    hist, cross = LatencyHistogram(), LatencyHistogram()
+    totals = {}
+    for h, t in outcomes:
+        hist.merge(h["all"])
+        cross.merge(h["cross"])
+        for key, value in t.items():
+            totals[key] = totals.get(key, 0) + value
+    result = {
+        "clients": args.clients,
+        "elapsed_sec": round(elapsed, 3),
+        "sent_per_sec": round(totals.get("sent", 0) / elapsed, 1),
+        "delivered_per_sec": round(hist.count / elapsed, 1),
+        "messages_per_write": round(totals.get("sent", 0) / max(1, totals.get("writes", 0)), 2),
+        **totals,
+        "latency_us": hist.summary(),
+    }
+    if args.ports and len(args.ports) > 1:
+        result["cross_node_latency_us"] = cross.summary()
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Asyncio chat client core and headless load generator")
+    sub = ap.add_subparsers(dest="command", required=True)
+    load = sub.add_parser("load", help="Run many headless clients against the chat hub")
+    load.add_argument("--host", default="127.0.0.1", help="Hub host")
+    load.add_argument("--port", type=int, default=6060, help="Hub port")
+    load.add_argument("--ports", type=lambda text: [int(p) for p in text.split(",") if p.strip()],
+                      help="Comma-separated ports of federated hubs; clients are spread over them")
+    load.add_argument("--clients", type=int, default=100, help="Number of clients")
+    load.add_argument("--processes", type=int, default=1, help="Processes to spread the clients over")
+    load.add_argument("--rate", type=float, default=1.0, help="Messages per second per client")
+    load.add_argument("--size", type=int, default=64, help="Approximate message size in bytes")
+    load.add_argument("--duration", type=float, default=10.0, help="Sending time in seconds")
+    load.add_argument("--drain", type=float, default=1.0, help="Seconds to keep receiving after sending stops")
+    load.add_argument("--room", help="Room to join (default: the hub's lobby)")
+    load.add_argument("--profile", help="Saved socket profile to apply (see tuning.py)")
+    load.add_argument("--binary", action="store_true", help="Use binary envelopes (see chat_envelope.py)")
+    from tls import add_client_arguments
+    add_client_arguments(load)
+    args = ap.parse_args(argv)
+
+    result = run_load(args)
+    for key, value in result.items():
+        print(f"{key:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,498 @@
+"""
+This module implements the broadcast chat hub used by
+simple_chat_server in "hub" mode.
+
+One asyncio event loop serves every client; there is no thread per
+connection. Each message a client sends is fanned out as one shared,
+already-framed payload to every other member of the sender's room.
+
+Slow clients never block the others: when a client's socket buffer is
+full, its messages wait in a bounded per-client outbound queue. When that
+queue overflows, the oldest queued messages are dropped (or the client is
+disconnected, depending on the policy) and the event is counted.
+
+Clients speak the normal framed chat protocol (see framing.py). Lines
+starting with "/" are commands:
+    /nick <name>    change the display name
+    /join <room>    switch to another room (default room: "lobby")
+    /rooms          list rooms and member counts
+    /who            list members of the current room
+    /history [n]    replay the last n messages from the history store
+    /resume [seq]   opt in to sequence numbers and replay what was missed
+    /codec bin1 <compressions>   switch to binary envelopes (see chat_envelope.py)
+
+Sequence numbers are opt-in so plain clients see no change. After
+"/resume" a member receives chat messages as "@<seq> <text>", where seq
+is the message's record number in the history store (so it survives hub
+restarts). "/resume <seq>" first answers "@resume <count>" and then
+replays, tagged, up to REPLAY_LIMIT stored messages of the member's room
+that are newer than seq; a reconnecting client uses it to pick up where
+it left off without gaps or duplicates. If the room had more missed
+messages than that, only the newest are replayed and the answer is
+"@resume <count> truncated", so the client knows it has a gap.
+
+A member that negotiated the binary envelope format with /codec receives
+every message as an envelope carrying its id, timestamp, sender and room
+(chat messages always carry their seq), and messages that pile up in its
+queue are flushed as batch envelopes, compressed with the negotiated
+compression. Text and binary members share a room; each payload is still
+encoded once per format.
+
+Every chat message is also appended to the indexed history store
+(chat_store.py), and newly connected clients are sent the most recent
+messages from it. A socket profile saved by tuning.py, if given, is
+applied to every client socket, and `tls` serves TLS (see tls.py).
+
+With a relay port (and optionally peers) the hub joins a federation of
+hubs that relay chat messages to each other (see chat_relay.py).
+
+A server policy (see server_policy.py) can cap connections (queued
+members join their room once admitted), rate-limit each client address
+and reap idle and slowloris connections.
+
+Accepts, messages, deliveries, drops, backpressure events, queue depths
+and fan-out latency are kept in metrics.py, labelled with the hub's port.
+"""
+
+import asyncio
+import signal
+import socket
+import time
+from collections import deque
+
+import metrics
+from chat_envelope import (FORMAT, MESSAGE, NOTICE, EnvelopeError, choose_compression, decode_frame,
+                           encode_message, is_envelope, pack_batches, split_line)
+from framing import FrameDecoder, FrameTooLarge, write_frames
+from server_policy import ServerPolicy
+from settings import apply_profile, load_profile
+from simple_chat_server import HISTORY_DIR, chat_log_writer, log_message, open_history
+
+DEFAULT_ROOM = "lobby"
+MAX_QUEUE = 1000
+WRITE_HIGH_WATER = 256 * 1024
+STATS_INTERVAL = 10.0
+REPLAY_COUNT = 20
+REPLAY_LIMIT = 1000
+
+
+class Member(asyncio.Protocol):
+    """One connected client and its bounded outbound queue."""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.transport = None
+        self.addr = None
+        self.name = None
+        self.room = None
+        self.decoder = FrameDecoder(max_frame_size=hub.max_message_size)
+        self.queue = deque()
+        self.paused = False
+        self.tagged = False  # receives "@<seq> " prefixes (see /resume)
+        self.codec = None  # negotiated compression once the member speaks binary (see /codec)
+        self.slot = None  # server policy state (see server_policy.py)
+
+    # -- asyncio callbacks -------------------------------------------------
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info("peername")
+        self.name = f"{self.addr[0]}:{self.addr[1]}"
+        transport.set_write_buffer_limits(high=self.hub.write_high_water)
+        sock = transport.get_extra_info("socket")
+        if self.hub.profile and sock is not None:
+            apply_profile(sock, self.hub.profile)
+        if self.hub.policy is None:
+            self.admitted()
+        else:
+            self.slot = self.hub.policy.open(self.addr[0], transport, on_admit=self.admitted)
+
+    def admitted(self):
+        self.hub.join(self, DEFAULT_ROOM)
+        self.hub.replay(self, self.hub.replay_count)
+
+    def data_received(self, data):
+        try:
+            frames = self.decoder.feed(data)
+        except FrameTooLarge as e:
+            log_message(f"[Hub] Dropping {self.name}: {e}")
+            self.transport.close()
+            return
+        if self.slot is not None:
+            delay = self.slot.on_data(len(data), len(frames), self.decoder.buffered > 0)
+            if delay:
+                self.slot.throttle(delay)
+        for frame in frames:
+            if self.codec is None or not is_envelope(frame):
+                self.hub.on_message(self, str(frame, "utf-8", "replace"))
+                continue
+            try:
+                messages = decode_frame(frame, self.hub.max_message_size)
+            except EnvelopeError as e:
+                log_message(f"[Hub] Dropping {self.name}: bad envelope ({e})")
+                self.transport.close()
+                return
+            for message in messages:
+                self.hub.on_message(self, message.body)
+
+    def pause_writing(self):
+        self.paused = True
+        self.hub.counters["backpressured"].inc()
+
+    def resume_writing(self):
+        self.paused = False
+        self.flush()
+
+    def connection_lost(self, exc):
+        self.hub.leave(self)
+        if self.hub.policy is not None:
+            self.hub.policy.close(self.slot)
+
+    # -- outbound path -----------------------------------------------------
+
+    def send(self, payload: bytes, received_at: float):
+        """Delivers now if the socket can take it, else queues (bounded)."""
+        if self.transport.is_closing():
+            return
+        if not self.paused and not self.queue:
+            write_frames(self.transport, (payload,))
+            self.hub.record_delivery(received_at)
+            return
+        self.queue.append((received_at, payload))
+        if len(self.queue) > self.hub.max_queue:
+            if self.hub.overflow == "disconnect":
+                log_message(f"[Hub] Disconnecting slow client {self.name}")
+                self.hub.counters["dropped"].inc(len(self.queue))
+                self.queue.clear()
+                self.transport.abort()
+            else:
+                self.queue.popleft()
+                self.hub.counters["dropped"].inc()
+
+    def flush(self):
+        if not self.queue or self.transport.is_closing():
+            return
+        batch = list(self.queue)
+        self.queue.clear()
+        payloads = [payload for _, payload in batch]
+        if self.codec is not None and len(payloads) > 1:
+            payloads = pack_batches(payloads, self.codec)
+        write_frames(self.transport, payloads)
+        for received_at, _ in batch:
+            self.hub.record_delivery(received_at)
+
+    def encode_line(self, line: str, seq=None) -> bytes:
+        """The payload for one hub line in this member's format."""
+        if self.codec is not None:
+            if seq is None:
+                return encode_message(NOTICE, 0, "", "", line, compression=self.codec)
+            room, sender, body = split_line(line)
+            return encode_message(MESSAGE, seq, sender, room, body, compression=self.codec)
+        if seq is not None and self.tagged:
+            return f"@{seq} {line}".encode("utf-8")
+        return line.encode("utf-8")
+
+    def reply(self, text: str):
+        self.send(self.encode_line(text), time.perf_counter())
+
+
+class ChatHub:
+    """Many-client chat server with rooms and bounded fan-out."""
+
+    def __init__(self, host="0.0.0.0", port=6060, max_queue=MAX_QUEUE, overflow="drop",
+                 write_high_water=WRITE_HIGH_WATER, max_message_size=64 * 1024,
+                 reuse_port=False, stats_hook=None, stats_interval=STATS_INTERVAL,
+                 history_dir=HISTORY_DIR, replay=REPLAY_COUNT, profile=None, tls=None,
+                 node_id=None, relay_port=None, peers=(), policy=None):
+        if overflow not in ("drop", "disconnect"):
+            raise ValueError(f"Unknown overflow policy: {overflow!r}")
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.write_high_water = write_high_water
+        self.max_message_size = max_message_size
+        self.reuse_port = reuse_port
+        self.stats_hook = stats_hook
+        self.stats_interval = stats_interval
+        self.history_dir = history_dir
+        self.replay_count = replay
+        self.profile = load_profile(profile) if isinstance(profile, str) else profile
+        self.tls = tls
+        self.policy = ServerPolicy.from_spec(policy, "chat_hub", port)
+        self.node_id = node_id
+        self.relay_port = relay_port
+        self.peers = list(peers)
+        self.relay = None
+        self.store = None
+        self.rooms = {}
+        self.last_seq = -1
+        labels = {"port": port}
+        self.counters = {
+            key: metrics.counter(f"chat_hub_{key}_total", help_text, **labels)
+            for key, help_text in (
+                ("accepted", "Accepted hub connections"),
+                ("messages_in", "Chat messages received"),
+                ("deliveries", "Messages delivered to members"),
+                ("dropped", "Messages dropped from full member queues"),
+                ("backpressured", "Times a member's socket buffer hit high water"),
+            )
+        }
+        self.fanout_latency = metrics.histogram(
+            "chat_hub_fanout_latency_us", "Time from receiving a message to delivering it (us)", **labels
+        ).hist
+        metrics.gauge("chat_hub_active_members", "Connected members", fn=lambda: len(self.members), **labels)
+        metrics.gauge("chat_hub_rooms", "Rooms with members", fn=lambda: len(self.rooms), **labels)
+        metrics.gauge("chat_hub_queued_messages", "Messages waiting in member queues",
+                      fn=lambda: sum(len(m.queue) for m in self.members), **labels)
+        self._server = None
+        self._stopping = None
+
+    # -- membership --------------------------------------------------------
+
+    @property
+    def members(self):
+        return [m for room in self.rooms.values() for m in room]
+
+    def join(self, member: Member, room: str):
+        if member.room is not None:
+            self._remove_from_room(member)
+        else:
+            self.counters["accepted"].inc()
+            log_message(f"[Hub] {member.name} connected.")
+        member.room = room
+        self.rooms.setdefault(room, set()).add(member)
+        self.broadcast(member, f"* {member.name} joined #{room}", time.perf_counter())
+
+    def leave(self, member: Member):
+        if member.room is None:
+            return
+        self.broadcast(member, f"* {member.name} left #{member.room}", time.perf_counter())
+        self._remove_from_room(member)
+        member.room = None
+        log_message(f"[Hub] {member.name} disconnected.")
+
+    def _remove_from_room(self, member: Member):
+        room = self.rooms.get(member.room)
+        if room is not None:
+            room.discard(member)
+            if not room:
+                del self.rooms[member.room]
+
+    # -- messages ----------------------------------------------------------
+
+    def on_message(self, member: Member, text: str):
+        received_at = time.perf_counter()
+        self.counters["messages_in"].inc()
+        if text.startswith("/"):
+            self.on_command(member, text)
+            return
+        line = f"[#{member.room}] {member.name}: {text}"
+        log_message(line)
+        if self.store is not None:
+            self.last_seq = self.store.append(f"{member.addr[0]}:{member.addr[1]}", line)
+        else:
+            self.last_seq += 1
+        self.broadcast(member, line, received_at, self.last_seq)
+        if self.relay is not None:
+            self.relay.publish(member.room, line)
+
+    def deliver_remote(self, room: str, line: str):
+        """Stores and fans out a message relayed from another hub."""
+        received_at = time.perf_counter()
+        log_message(line)
+        if self.store is not None:
+            self.last_seq = self.store.append("relay", line)
+        else:
+            self.last_seq += 1
+        self.broadcast(None, line, received_at, self.last_seq, room)
+
+    def replay(self, member: Member, n: int):
+        """Sends the last `n` stored messages of the member's room to it."""
+        if self.store is None or n <= 0:
+            return
+        now = time.perf_counter()
+        for record in self.store.last(min(n, REPLAY_LIMIT), room=member.room):
+            member.send(member.encode_line(f"(history) {record.text}"), now)
+
+    def on_command(self, member: Member, text: str):
+        cmd, _, arg = text.partition(" ")
+        arg = arg.strip()
+        if cmd == "/nick" and arg:
+            old, member.name = member.name, arg
+            self.broadcast(member, f"* {old} is now known as {arg}", time.perf_counter())
+        elif cmd == "/join" and arg:
+            self.join(member, arg.lstrip("#"))
+        elif cmd == "/rooms":
+            member.reply("Rooms: " + ", ".join(f"#{r} ({len(m)})" for r, m in sorted(self.rooms.items())))
+        elif cmd == "/who":
+            member.reply(f"#{member.room}: " + ", ".join(sorted(m.name for m in self.rooms[member.room])))
+        elif cmd == "/history":
+            self.replay(member, int(arg) if arg.isdigit() else self.replay_count)
+        elif cmd == "/resume":
+            self.resume(member, int(arg) if arg.lstrip("-").isdigit() else None)
+        elif cmd == "/codec":
+            self.negotiate(member, arg)
+        else:
+            member.reply("Commands: /nick <name>, /join <room>, /rooms, /who, /history [n], /resume [seq], "
+                         "/codec bin1 <compressions>")
+
+    def negotiate(self, member: Member, arg: str):
+        """Answers "@codec bin1 <compression>" (or "@codec text") and switches the member over."""
+        fmt, _, offered = arg.partition(" ")
+        if fmt != FORMAT:
+            member.reply("@codec text")
+            return
+        compression = choose_compression(offered.split(","))
+        member.reply(f"@codec {FORMAT} {compression}")
+        member.codec = compression
+
+    def resume(self, member: Member, seq):
+        """Switches the member to tagged messages and replays its room's messages after `seq`."""
+        member.tagged = True
+        if seq is None:
+            return
+        missed = []
+        if self.store is not None:
+            # One extra record tells whether older missed messages were cut off.
+            missed = self.store.after(seq, REPLAY_LIMIT + 1, room=member.room)
+        truncated = len(missed) > REPLAY_LIMIT
+        if truncated:
+            missed = missed[1:]
+        member.reply(f"@resume {len(missed)}" + (" truncated" if truncated else ""))
+        now = time.perf_counter()
+        for n, record in missed:
+            member.send(member.encode_line(record.text, n), now)
+
+    def broadcast(self, sender, text: str, received_at: float, seq=None, room=None):
+        """Encodes once per member format (plain, tagged, binary per compression) and fans out
+        to every other member of the room."""
+        payloads = {}
+        for member in self.rooms.get(sender.room if room is None else room, ()):
+            if member is sender:
+                continue
+            key = member.codec if member.codec is not None else (seq is not None and member.tagged)
+            payload = payloads.get(key)
+            if payload is None:
+                payload = payloads[key] = member.encode_line(text, seq)
+            member.send(payload, received_at)
+
+    def record_delivery(self, received_at: float):
+        self.counters["deliveries"].inc()
+        self.fanout_latency.record((time.perf_counter() - received_at) * 1_000_000)
+
+    # -- lifecycle ---------------------------------------------------------
+
+    @property
+    def stats(self) -> dict:
+        return {key: c.value for key, c in self.counters.items()}
+
+    def snapshot(self) -> dict:
+        lat = self.fanout_latency.summary()
+        log = chat_log_writer().metrics()
+        relay = {}
+        if self.relay is not None:
+            snap = self.relay.snapshot()
+            relay = {"relay_in": snap["delivered"], "relay_out": snap["published"],
+                     "relay_duplicates": snap["duplicates"], "relay_links": len(snap["links"])}
+            for node, link in snap["links"].items():
+                relay[f"lag_p99_us[{node}]"] = link["lag_p99_us"]
+                relay[f"rtt_p99_us[{node}]"] = link["rtt_p99_us"]
+        return dict(
+            self.stats,
+            log_queue_depth=log["queue_depth"],
+            log_dropped=log["dropped"],
+            active=len(self.members),
+            rooms=len(self.rooms),
+            queued=sum(len(m.queue) for m in self.members),
+            fanout_p50_us=lat["p50"],
+            fanout_p99_us=lat["p99"],
+            **relay,
+            **(self.policy.snapshot() if self.policy is not None else {}),
+        )
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            if self.store is not None:
+                self.store.flush()
+            snap = self.snapshot()
+            if self.stats_hook:
+                self.stats_hook(snap)
+            else:
+                log_message("[Hub] " + ", ".join(f"{k}={v}" for k, v in snap.items()))
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self.store = open_history(self.history_dir)
+        ssl_context = None
+        if self.tls:
+            from tls import server_context
+            ssl_context = server_context(self.tls)
+        self._server = await loop.create_server(
+            lambda: Member(self),
+            self.host,
+            self.port,
+            backlog=1024,
+            reuse_address=True,
+            reuse_port=self.reuse_port or None,
+            ssl=ssl_context,
+            ssl_handshake_timeout=(self.policy.frame_timeout or None) if ssl_context and self.policy else None,
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.policy is not None:
+            self.policy.start()
+        log_message(f"[Hub] Listening on {self.host}:{self.port} "
+                    f"(max_queue={self.max_queue}, overflow={self.overflow}"
+                    + (", tls" if self.tls else "")
+                    + (f", policy: {self.policy.describe()})" if self.policy else ")"))
+        if self.relay_port is not None or self.peers:
+            from chat_relay import Relay
+            self.relay = Relay(self, self.node_id or f"{socket.gethostname()}:{self.port}",
+                               self.relay_port or 0, self.peers, self.host)
+            await self.relay.start()
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        reporter = asyncio.ensure_future(self._report_stats())
+        try:
+            await self._stopping.wait()
+        finally:
+            reporter.cancel()
+            if self.policy is not None:
+                self.policy.stop()
+            if self.relay is not None:
+                await self.relay.stop()
+            self._server.close()
+            for member in self.members:
+                member.transport.close()
+            await self._server.wait_closed()
+            if self.store is not None:
+                self.store.close()
+            log_message("[Hub] Final stats: " + ", ".join(f"{k}={v}" for k, v in self.snapshot().items()))
+
+
+async def _run_hub(**kwargs):
+    hub = ChatHub(**kwargs)
+    await hub.start()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, hub.stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await hub.serve_forever()
+
+
+def run_hub(host="0.0.0.0", port=6060, **kwargs):
+    """Runs the chat hub until Ctrl+C / SIGTERM."""
+    try:
+        asyncio.run(_run_hub(host=host, port=port, **kwargs))
+    except KeyboardInterrupt:
+        log_message("[Hub] Interrupted by user.")
@@ -0,0 +1,375 @@
+"""
+This module federates chat hubs: several hub instances (on one machine or
+many) relay their chat messages to each other, so users spread over the
+instances still see one chat world.
+
+- Each hub has a node id and a relay port. Links are plain TCP with the
+  usual length-prefixed frames (see framing.py); every frame is one JSON
+  envelope. A hub dials the peers it is configured with and accepts links
+  from the others, and a link carries traffic both ways.
+- Links are persistent and pipelined: messages are never acknowledged
+  one by one. Each link has a bounded outbound queue whose pending
+  envelopes are written with one write() call, like the chat client.
+  Dropped links are redialled with jittered backoff.
+- Every message gets an id "<origin node>/<counter>". A node delivers an
+  id once; repeats (from a mesh, or two links to the same peer) are
+  counted and dropped. For loop prevention, each envelope carries the
+  path of nodes it has visited. A node never forwards to a node on that
+  path or back over the link it came from, and stops after MAX_HOPS.
+  Envelopes also list the nodes already sent a copy ("covered"), so in a
+  full mesh nothing is forwarded twice and duplicates stay rare.
+- Lag per link: pings travel through the same outbound queue and are
+  answered by the peer, so the round trip includes any queueing
+  (chat_relay_link_rtt_us). Messages also carry their origin wall-clock
+  time, which gives the one-way delivery lag (chat_relay_link_lag_us;
+  meaningful when the clocks agree, e.g. on one machine).
+
+Only chat messages are relayed; joins, nick changes and the other
+notices stay local to each hub.
+
+Example (three nodes on localhost, each with its own history dir):
+    python3 simple_chat_server.py --mode hub --port 6060 --relay-port 7060 --history-dir h0
+    python3 simple_chat_server.py --mode hub --port 6061 --relay-port 7061 --history-dir h1 --peer 127.0.0.1:7060
+    python3 simple_chat_server.py --mode hub --port 6062 --relay-port 7062 --history-dir h2 --peer 127.0.0.1:7060 --peer 127.0.0.1:7061
+    python3 chat_client.py load --ports 6060,6061,6062 --clients 90 --rate 2
+"""
+
+import asyncio
+import json
+import socket
+import time
+from collections import deque
+
+import metrics
+from chat_client import backoff_delay
+from framing import FrameDecoder, FrameTooLarge, write_frames
+from simple_chat_server import log_message
+
+MAX_HOPS = 8
+MAX_QUEUE = 10000
+MAX_BATCH = 256
+SEEN_IDS = 100_000
+PING_INTERVAL = 1.0
+READ_SIZE = 64 * 1024
+
+
+def parse_peer(text: str):
+    """'host:port' -> (host, port)."""
+    host, sep, port = text.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError(f"peer must be host:port, got {text!r}")
+    return host or "127.0.0.1", int(port)
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+class SeenIds:
+    """Bounded set of message ids; the oldest ids are forgotten first."""
+
+    def __init__(self, size=SEEN_IDS):
+        self.ids = set()
+        self.order = deque()
+        self.size = size
+
+    def add(self, msg_id) -> bool:
+        """Adds an id; False if it was already there."""
+        if msg_id in self.ids:
+            return False
+        self.ids.add(msg_id)
+        self.order.append(msg_id)
+        if len(self.order) > self.size:
+            self.ids.discard(self.order.popleft())
+        return True
+
+
+class PeerLink:
+    """One relay connection to another node, in either direction."""
+
+    def __init__(self, relay, reader, writer, dialled=None):
+        self.relay = relay
+        self.reader = reader
+        self.writer = writer
+        self.dialled = dialled  # (host, port) for links this node opened
+        self.node = None        # the peer's node id, known after its hello
+        self.queue = deque()
+        self.pending = asyncio.Event()
+        self.m = None
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, payload: bytes):
+        """Queues one encoded envelope; drops the oldest when the queue is full."""
+        self.queue.append(payload)
+        if len(self.queue) > self.relay.max_queue:
+            self.queue.popleft()
+            if self.m:
+                self.m["dropped"].inc()
+        self.pending.set()
+
+    def _metrics(self):
+        labels = {"port": self.relay.hub.port, "peer": self.node}
+        m = {key: metrics.counter(f"chat_relay_{key}_total", help_text, **labels)
+             for key, help_text in (("sent", "Envelopes written to the peer"),
+                                    ("received", "Envelopes read from the peer"),
+                                    ("batches", "Writes to the peer (envelopes are batched)"),
+                                    ("dropped", "Envelopes dropped from a full link queue"))}
+        m["rtt"] = metrics.histogram("chat_relay_link_rtt_us", "Ping round trip through the link queue (us)",
+                                     **labels).hist
+        m["lag"] = metrics.histogram("chat_relay_link_lag_us", "Origin to arrival time of relayed messages (us)",
+                                     **labels).hist
+        metrics.gauge("chat_relay_link_queue", "Envelopes waiting to be written to the peer",
+                      fn=lambda: len(self.queue), **labels)
+        return m
+
+    async def run(self):
+        """Exchanges hellos, then reads and writes until the link drops."""
+        try:
+            await self._run()
+        finally:
+            self.close()
+
+    async def _run(self):
+        write_frames(self.writer, [self.relay.encode({"t": "hello", "node": self.relay.node_id})])
+        decoder = FrameDecoder(max_frame_size=self.relay.hub.max_message_size * 2)
+        frames = await self._read(decoder)
+        try:
+            hello = json.loads(bytes(frames.popleft())) if frames else {}
+        except ValueError:
+            return
+        if not isinstance(hello, dict) or hello.get("t") != "hello" or not hello.get("node"):
+            return
+        self.node = hello["node"]
+        if self.node == self.relay.node_id:
+            log_message(f"[Relay] Refusing a link to myself ({self.node})")
+            return
+        self.m = self._metrics()
+        self.relay.attach(self)
+        tasks = [asyncio.ensure_future(self._read_loop(decoder, frames)),
+                 asyncio.ensure_future(self._write_loop()),
+                 asyncio.ensure_future(self._ping_loop())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.relay.detach(self)
+
+    async def _read(self, decoder):
+        """Reads until at least one frame arrives; an empty deque means the link closed."""
+        frames = deque()
+        while not frames:
+            try:
+                data = await self.reader.read(READ_SIZE)
+            except ConnectionError:
+                return frames
+            if not data:
+                return frames
+            try:
+                frames.extend(decoder.feed(data))
+            except FrameTooLarge as e:
+                log_message(f"[Relay] Dropping link: {e}")
+                return deque()
+        return frames
+
+    async def _read_loop(self, decoder, frames):
+        while True:
+            while frames:
+                self.m["received"].inc()
+                try:
+                    envelope = json.loads(bytes(frames.popleft()))
+                except ValueError:
+                    continue
+                if isinstance(envelope, dict):
+                    self.relay.on_envelope(self, envelope)
+            frames = await self._read(decoder)
+            if not frames:
+                return
+
+    async def _write_loop(self):
+        while True:
+            if not self.queue:
+                self.pending.clear()
+                await self.pending.wait()
+                continue
+            if self.writer.is_closing():
+                return
+            n = min(len(self.queue), MAX_BATCH)
+            write_frames(self.writer, [self.queue.popleft() for _ in range(n)])
+            self.m["sent"].inc(n)
+            self.m["batches"].inc()
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                return
+
+    async def _ping_loop(self):
+        while True:
+            self.send(self.relay.encode({"t": "ping", "ts": time.perf_counter()}))
+            await asyncio.sleep(self.relay.ping_interval)
+
+    def close(self):
+        self.writer.close()
+
+
+class Relay:
+    """Relays one hub's chat messages to its peers and delivers theirs."""
+
+    def __init__(self, hub, node_id, port, peers=(), host="0.0.0.0", max_queue=MAX_QUEUE,
+                 ping_interval=PING_INTERVAL):
+        self.hub = hub
+        self.node_id = node_id
+        self.host = host
+        self.port = port
+        self.peers = [parse_peer(p) if isinstance(p, str) else tuple(p) for p in peers]
+        self.max_queue = max_queue
+        self.ping_interval = ping_interval
+        self.seen = SeenIds()
+        self.links = {}     # peer node id -> the link used to send to it
+        self.all_links = set()
+        self.counter = 0
+        self._server = None
+        self._tasks = []
+        self._inbound = set()
+        labels = {"port": hub.port}
+        self.counters = {
+            key: metrics.counter(f"chat_relay_{key}_total", help_text, **labels)
+            for key, help_text in (("published", "Local messages relayed"),
+                                   ("delivered", "Remote messages delivered locally"),
+                                   ("duplicates", "Remote messages already seen"),
+                                   ("loops", "Messages that came back around a loop"),
+                                   ("hop_limit", "Messages not forwarded because of MAX_HOPS"),
+                                   ("malformed", "Remote messages dropped for bad field types"))
+        }
+        metrics.gauge("chat_relay_links", "Connected peer nodes", fn=lambda: len(self.links), **labels)
+
+    @staticmethod
+    def encode(envelope) -> bytes:
+        return json.dumps(envelope, separators=(",", ":")).encode("utf-8")
+
+    # -- links -------------------------------------------------------------
+
+    def attach(self, link: PeerLink):
+        self.all_links.add(link)
+        if link.node not in self.links:
+            self.links[link.node] = link
+            log_message(f"[Relay] Linked to {link.node}")
+        # Otherwise a second link to the same node (both dialled each other):
+        # it still delivers, but only the first one is used for sending.
+
+    def detach(self, link: PeerLink):
+        self.all_links.discard(link)
+        if self.links.get(link.node) is link:
+            del self.links[link.node]
+            replacement = next((l for l in self.all_links if l.node == link.node), None)
+            if replacement is not None:
+                self.links[link.node] = replacement
+            else:
+                log_message(f"[Relay] Lost link to {link.node}")
+        link.close()
+
+    async def _accept(self, reader, writer):
+        task = asyncio.current_task()
+        self._inbound.add(task)
+        try:
+            await PeerLink(self, reader, writer).run()
+        except asyncio.CancelledError:
+            pass  # the relay is stopping; asyncio would report the cancelled handler
+        finally:
+            self._inbound.discard(task)
+
+    async def _dial(self, host, port):
+        attempt = 0
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+            except OSError:
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            attempt = 0
+            await PeerLink(self, reader, writer, dialled=(host, port)).run()
+            await asyncio.sleep(backoff_delay(0))
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port, reuse_address=True)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._tasks = [asyncio.ensure_future(self._dial(host, port)) for host, port in self.peers]
+        log_message(f"[Relay] Node {self.node_id} relaying on {self.host}:{self.port}"
+                    + (f", peers: {', '.join(f'{h}:{p}' for h, p in self.peers)}" if self.peers else ""))
+
+    async def stop(self):
+        tasks = self._tasks + list(self._inbound)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._server.close()
+        for link in list(self.all_links):
+            link.close()
+        await self._server.wait_closed()
+
+    # -- messages ----------------------------------------------------------
+
+    def publish(self, room: str, line: str):
+        """Relays a message that a local member sent."""
+        self.counter += 1
+        msg_id = f"{self.node_id}/{self.counter}"
+        self.seen.add(msg_id)
+        self.counters["published"].inc()
+        payload = self.encode({"t": "msg", "id": msg_id, "room": room, "line": line,
+                               "ts": time.time(), "path": [self.node_id],
+                               "covered": [self.node_id, *self.links]})
+        for link in self.links.values():
+            link.send(payload)
+
+    def on_envelope(self, link: PeerLink, envelope: dict):
+        kind = envelope.get("t")
+        if kind == "msg":
+            self._on_message(link, envelope)
+        elif kind == "ping":
+            link.send(self.encode({"t": "pong", "ts": envelope.get("ts")}))
+        elif kind == "pong" and isinstance(envelope.get("ts"), float):
+            link.m["rtt"].record((time.perf_counter() - envelope["ts"]) * 1_000_000)
+
+    def _on_message(self, link: PeerLink, envelope: dict):
+        path = envelope.get("path") or []
+        ts = envelope.get("ts", 0)
+        if (not isinstance(envelope.get("room"), str) or not isinstance(envelope.get("line"), str)
+                or not isinstance(envelope.get("id"), str) or not _is_str_list(path)
+                or not _is_str_list(envelope.get("covered") or [])
+                or isinstance(ts, bool) or not isinstance(ts, (int, float))):
+            self.counters["malformed"].inc()
+            return
+        if not self.seen.add(envelope.get("id")):
+            self.counters["duplicates"].inc()
+            return
+        if self.node_id in path:
+            self.counters["loops"].inc()  # seen once but forgotten since
+            return
+        link.m["lag"].record(max(0.0, time.time() - ts) * 1_000_000)
+        self.counters["delivered"].inc()
+        self.hub.deliver_remote(envelope["room"], envelope["line"])
+
+        if len(path) + 1 >= MAX_HOPS:
+            self.counters["hop_limit"].inc()
+            return
+        covered = set(path).union(envelope.get("covered") or ())
+        targets = {node: l for node, l in self.links.items() if node not in covered and l is not link}
+        if targets:
+            payload = self.encode(dict(envelope, path=path + [self.node_id],
+                                       covered=sorted(covered.union(targets))))
+            for target in targets.values():
+                target.send(payload)
+
+    def snapshot(self) -> dict:
+        """Counters plus per-link queue depth, RTT and lag (p50/p99, us)."""
+        links = {}
+        for node, link in self.links.items():
+            rtt, lag = link.m["rtt"].summary(), link.m["lag"].summary()
+            links[node] = {"queued": len(link.queue), "sent": link.m["sent"].value,
+                           "received": link.m["received"].value, "rtt_p50_us": rtt["p50"],
+                           "rtt_p99_us": rtt["p99"], "lag_p50_us": lag["p50"], "lag_p99_us": lag["p99"]}
+        return dict({key: c.value for key, c in self.counters.items()}, links=links)
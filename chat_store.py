@@ -0,0 +1,405 @@
+"""
+This module implements the indexed chat history store used by the chat
+server, alongside the plain-text chat_history.log.
+
+Messages are appended to segment files (00000000.seg, 00000001.seg, ...)
+inside a history directory. Each record is a fixed-size header followed
+by the UTF-8 message text:
+
+    +-------------+--------------+-------------+-----------------+
+    | ts (f64 LE) | peer id (u32)| length (u32)| text (length)   |
+    +-------------+--------------+-------------+-----------------+
+
+Peer addresses are stored once in peers.tbl and referenced by id.
+Segments are read through mmap. The active segment's mapping is only
+renewed once its unmapped tail has grown as large as the mapped part
+(geometric growth); records in the tail are read with pread() until then.
+Only one process may write a history directory at a time (it is
+flock()ed); readers such as the CLI open it read-only.
+
+Timestamps are clamped to be non-decreasing on append, so a wall-clock
+step backwards cannot break the time ordering the indexes rely on;
+records written during such a step carry the last earlier timestamp.
+
+On open the headers are scanned (the texts are skipped) to build two
+in-memory indexes:
+- a sparse time index: every Nth record's timestamp and position, used to
+  binary-search time windows and to seek to the last N records;
+- a per-peer index: the positions of every record from each peer;
+- a per-room index: record numbers and positions of every line in the
+  chat hub's "[#room] name: text" format, so a room's history can be
+  read without scanning the other rooms' messages.
+
+The module can also be run as a CLI:
+    python3 chat_store.py last 20
+    python3 chat_store.py last 20 --room lobby
+    python3 chat_store.py query --peer 127.0.0.1 --since "2025-10-24 21:00" --until "2025-10-24 22:00"
+"""
+
+import argparse
+import bisect
+import fcntl
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+RECORD_HEADER = struct.Struct("<dII")
+HEADER_SIZE = RECORD_HEADER.size
+SEGMENT_SIZE = 64 * 1024 * 1024
+SPARSE_EVERY = 256
+OFFSET_BITS = 40
+REMAP_MIN = 1024 * 1024
+ROOM_NAME_MAX = 256
+
+Record = namedtuple("Record", "ts peer text")
+
+
+class StoreLocked(OSError):
+    """Another process already has this history directory open."""
+
+
+def _pos(segment: int, offset: int) -> int:
+    return (segment << OFFSET_BITS) | offset
+
+
+def _split(pos: int):
+    return pos >> OFFSET_BITS, pos & ((1 << OFFSET_BITS) - 1)
+
+
+def _room_of(buf, start: int, length: int):
+    """The room of a "[#room] ..." line starting at `start`, or None."""
+    if buf[start:start + 2] != b"[#":
+        return None
+    end = buf.find(b"] ", start + 2, start + min(length, ROOM_NAME_MAX + 4))
+    if end < 0:
+        return None
+    return bytes(buf[start + 2:end]).decode("utf-8", errors="replace")
+
+
+class _Segment:
+    def __init__(self, path: Path):
+        self.path = path
+        self.size = path.stat().st_size if path.exists() else 0
+        self._map = None
+        self._mapped = 0
+        self._file = None
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._mapped = 0
+        if self.size:
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+            self._mapped = self.size
+
+    def view(self):
+        """Read-only mmap covering everything written so far."""
+        if self._mapped != self.size:
+            self._remap()
+        return self._map
+
+    def read(self, offset: int, length: int) -> bytes:
+        """`length` bytes at `offset`, from the mapping or (for the unmapped tail) pread()."""
+        if offset + length > self._mapped and self.size - self._mapped >= max(self._mapped, REMAP_MIN):
+            self._remap()
+        if offset + length <= self._mapped:
+            return self._map[offset:offset + length]
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        return os.pread(self._file.fileno(), length, offset)
+
+    def header(self, offset: int):
+        """(ts, peer id, length) of the record at `offset`."""
+        if offset + HEADER_SIZE <= self._mapped:
+            return RECORD_HEADER.unpack_from(self._map, offset)
+        return RECORD_HEADER.unpack(self.read(offset, HEADER_SIZE))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._mapped = 0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ChatStore:
+    """Append-only, segmented chat history with time and peer indexes."""
+
+    def __init__(self, directory="chat_history", segment_size=SEGMENT_SIZE, sparse_every=SPARSE_EVERY,
+                 readonly=False):
+        self.dir = Path(directory)
+        self.segment_size = segment_size
+        self.sparse_every = sparse_every
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._lockfile = None
+        self._peers_file = None
+        self._out = None
+        if not readonly:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            self._lockfile = open(self.dir / "LOCK", "w")
+            try:
+                fcntl.flock(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lockfile.close()
+                raise StoreLocked(f"History directory {self.dir} is in use by another process")
+            self._peers_file = open(self.dir / "peers.tbl", "a", encoding="utf-8")
+
+        self.peers = []
+        self.peer_ids = {}
+        peers_path = self.dir / "peers.tbl"
+        if peers_path.exists():
+            for line in peers_path.read_text(encoding="utf-8").splitlines():
+                self.peer_ids[line] = len(self.peers)
+                self.peers.append(line)
+
+        self.count = 0
+        self.last_ts = float("-inf")
+        self.sparse_ts = []
+        self.sparse_pos = array("Q")
+        self.by_peer = {}
+        self.by_room = {}  # room -> (record numbers, positions)
+        self.segments = [_Segment(p) for p in sorted(self.dir.glob("*.seg"))]
+        for number, segment in enumerate(self.segments):
+            self._scan(number, segment)
+        if readonly:
+            return
+        if not self.segments:
+            self.segments.append(_Segment(self.dir / f"{0:08d}.seg"))
+        self._out = open(self.segments[-1].path, "ab", buffering=1024 * 1024)
+
+    # -- indexing ------------------------------------------------------------
+
+    def _index(self, ts: float, peer_id: int, pos: int, room=None):
+        if self.count % self.sparse_every == 0:
+            self.sparse_ts.append(ts)
+            self.sparse_pos.append(pos)
+        self.by_peer.setdefault(peer_id, array("Q")).append(pos)
+        if room is not None:
+            numbers, positions = self.by_room.setdefault(room, (array("Q"), array("Q")))
+            numbers.append(self.count)
+            positions.append(pos)
+        self.count += 1
+        if ts > self.last_ts:
+            self.last_ts = ts
+
+    def _scan(self, number: int, segment: _Segment):
+        buf = segment.view()
+        offset = 0
+        while buf is not None and offset + HEADER_SIZE <= segment.size:
+            ts, peer_id, length = RECORD_HEADER.unpack_from(buf, offset)
+            if offset + HEADER_SIZE + length > segment.size:
+                break
+            self._index(ts, peer_id, _pos(number, offset), _room_of(buf, offset + HEADER_SIZE, length))
+            offset += HEADER_SIZE + length
+        if offset != segment.size and not self.readonly:
+            # Torn write from a crash: cut the segment back to the last whole record.
+            segment.close()
+            os.truncate(segment.path, offset)
+            segment.size = offset
+
+    # -- writing -------------------------------------------------------------
+
+    def _peer_id(self, peer: str) -> int:
+        peer_id = self.peer_ids.get(peer)
+        if peer_id is None:
+            peer_id = self.peer_ids[peer] = len(self.peers)
+            self.peers.append(peer)
+            self._peers_file.write(peer + "\n")
+            self._peers_file.flush()
+        return peer_id
+
+    def append(self, peer: str, text: str, ts: float = None) -> int:
+        """Appends one message; returns its record number."""
+        if self.readonly:
+            raise OSError("History store was opened read-only")
+        data = text.encode("utf-8")
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            ts = max(ts, self.last_ts)
+            segment = self.segments[-1]
+            if segment.size and segment.size + HEADER_SIZE + len(data) > self.segment_size:
+                self._out.close()
+                segment = _Segment(self.dir / f"{len(self.segments):08d}.seg")
+                self.segments.append(segment)
+                self._out = open(segment.path, "ab", buffering=1024 * 1024)
+            peer_id = self._peer_id(peer)
+            self._out.write(RECORD_HEADER.pack(ts, peer_id, len(data)))
+            self._out.write(data)
+            self._index(ts, peer_id, _pos(len(self.segments) - 1, segment.size), _room_of(data, 0, len(data)))
+            segment.size += HEADER_SIZE + len(data)
+            return self.count - 1
+
+    def flush(self):
+        with self._lock:
+            if self._out is not None:
+                self._out.flush()
+
+    def close(self):
+        with self._lock:
+            for f in (self._out, self._peers_file, self._lockfile):
+                if f is not None:
+                    f.close()
+            for segment in self.segments:
+                segment.close()
+
+    # -- reading -------------------------------------------------------------
+
+    def _read(self, pos: int):
+        number, offset = _split(pos)
+        segment = self.segments[number]
+        ts, peer_id, length = segment.header(offset)
+        return ts, peer_id, offset + HEADER_SIZE, length, segment
+
+    def _record(self, pos: int) -> Record:
+        ts, peer_id, start, length, segment = self._read(pos)
+        return Record(ts, self.peers[peer_id], segment.read(start, length).decode("utf-8", errors="replace"))
+
+    def _scan_from(self, pos: int):
+        """Yields (pos, ts, peer_id) for every record from `pos` to the end."""
+        number, offset = _split(pos)
+        while number < len(self.segments):
+            segment = self.segments[number]
+            while offset < segment.size:
+                ts, peer_id, length = segment.header(offset)
+                yield _pos(number, offset), ts, peer_id
+                offset += HEADER_SIZE + length
+            number, offset = number + 1, 0
+
+    def _matching_peers(self, peer: str):
+        """Ids of peers equal to `peer`, or of any port on that host if no port is given."""
+        return [i for p, i in self.peer_ids.items() if p == peer or p.rsplit(":", 1)[0] == peer]
+
+    def _peer_positions(self, peer: str, since: float):
+        """Per-peer position lists, each trimmed to records at or after `since`."""
+        lists = []
+        for peer_id in self._matching_peers(peer):
+            positions = self.by_peer.get(peer_id)
+            if positions:
+                # Records are appended in time order, so each list is sorted by ts.
+                lo = bisect.bisect_left(range(len(positions)), since,
+                                        key=lambda k: self._read(positions[k])[0])
+                lists.append(positions[lo:])
+        return lists
+
+    def query(self, peer: str = None, since: float = None, until: float = None, limit: int = None):
+        """Messages (oldest first) from `peer` between `since` and `until` (epoch seconds)."""
+        self.flush()
+        since = float("-inf") if since is None else since
+        until = float("inf") if until is None else until
+        results = []
+        with self._lock:
+            if peer is not None:
+                for pos in heapq.merge(*self._peer_positions(peer, since)):
+                    record = self._record(pos)
+                    if record.ts > until or (limit and len(results) >= limit):
+                        break
+                    results.append(record)
+                return results
+
+            k = max(0, bisect.bisect_left(self.sparse_ts, since) - 1)
+            if k >= len(self.sparse_pos):
+                return results
+            for pos, ts, _ in self._scan_from(self.sparse_pos[k]):
+                if ts < since:
+                    continue
+                if ts > until or (limit and len(results) >= limit):
+                    break
+                results.append(self._record(pos))
+        return results
+
+    def last(self, n: int, peer: str = None, room: str = None):
+        """The most recent `n` messages (oldest first), optionally from one peer or one room."""
+        self.flush()
+        with self._lock:
+            if room is not None:
+                positions = self.by_room.get(room, (array("Q"), array("Q")))[1]
+                return [self._record(pos) for pos in positions[-n:]]
+            if peer is not None:
+                lists = [self.by_peer.get(i, array("Q"))[-n:] for i in self._matching_peers(peer)]
+                return [self._record(pos) for pos in list(heapq.merge(*lists))[-n:]]
+
+            first = max(0, self.count - n)
+            k = first // self.sparse_every
+            if k >= len(self.sparse_pos):
+                return []
+            skip = first - k * self.sparse_every
+            results = []
+            for i, (pos, _, _) in enumerate(self._scan_from(self.sparse_pos[k])):
+                if i >= skip:
+                    results.append(self._record(pos))
+            return results
+
+    def after(self, seq: int, limit: int = None, room: str = None):
+        """(record number, Record) pairs newer than record number `seq` (at most the last `limit`),
+        optionally only the lines of one room."""
+        self.flush()
+        with self._lock:
+            if room is not None:
+                numbers, positions = self.by_room.get(room, (array("Q"), array("Q")))
+                lo = bisect.bisect_right(numbers, seq)
+                if limit is not None:
+                    lo = max(lo, len(numbers) - limit)
+                return [(numbers[i], self._record(positions[i])) for i in range(lo, len(numbers))]
+            first = max(0, seq + 1)
+            if limit is not None:
+                first = max(first, self.count - limit)
+            if first >= self.count:
+                return []
+            k = first // self.sparse_every
+            skip = first - k * self.sparse_every
+            return [(k * self.sparse_every + i, self._record(pos))
+                    for i, (pos, _, _) in enumerate(self._scan_from(self.sparse_pos[k])) if i >= skip]
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _print_records(records):
+    for r in records:
+        print(f"[{datetime.fromtimestamp(r.ts):%Y-%m-%d %H:%M:%S}] ({r.peer}) {r.text}")
+    print(f"-- {len(records)} message(s)")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Query the indexed chat history store")
+    ap.add_argument("--dir", default="chat_history", help="History directory")
+    sub = ap.add_subparsers(dest="command", required=True)
+    q = sub.add_parser("query", help="Messages from a peer and/or time window")
+    q.add_argument("--peer", help="Peer address: 'ip' or 'ip:port'")
+    q.add_argument("--since", type=_parse_time, help="Start time (epoch or ISO, e.g. '2025-10-24 21:00')")
+    q.add_argument("--until", type=_parse_time, help="End time (epoch or ISO)")
+    q.add_argument("--limit", type=int, help="Maximum number of messages")
+    last = sub.add_parser("last", help="The last N messages")
+    last.add_argument("n", type=int)
+    last.add_argument("--peer", help="Only messages from this peer")
+    last.add_argument("--room", help="Only messages from this hub room")
+    args = ap.parse_args(argv)
+
+    store = ChatStore(args.dir, readonly=True)
+    try:
+        if args.command == "query":
+            _print_records(store.query(args.peer, args.since, args.until, args.limit))
+        else:
+            _print_records(store.last(args.n, args.peer, args.room))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+"""
+This module is a reusable client library for the echo and chat servers
+that keeps TCP connections open between requests, so short exchanges do
+not pay for DNS resolution and a TCP handshake every time.
+
+- Resolver caches getaddrinfo() results for `ttl` seconds (sync and
+  asyncio lookups share the cache).
+- ConnectionPool / AsyncConnectionPool keep at most `max_size`
+  connections to one (host, port). Idle connections are reused most
+  recently used first, so the extra ones age out and are closed after
+  `idle_timeout` seconds. When the pool is full, acquire() waits.
+- A connection that sat idle longer than `check_after` seconds is
+  health-checked before reuse: a non-blocking MSG_PEEK shows whether the
+  peer closed it (or left unread data behind). Broken connections are
+  dropped, and a request that fails on a reused connection is retried
+  once on a fresh one.
+- Client / AsyncClient hold one pool per (host, port).
+- With `tls` (a tls.client_context()) every connection is TLS, and the
+  session of a returned connection is remembered so the next new
+  connection resumes it instead of doing a full handshake.
+
+Requests are length-prefixed frames (see framing.py): request() sends
+one frame and returns the reply frame (echo), send() only sends (chat).
+
+    with Client(max_size=4) as client:
+        reply = client.request("127.0.0.1", 5050, b"ping")
+
+    async with AsyncClient() as client:
+        reply = await client.request("127.0.0.1", 5050, b"ping")
+"""
+
+import asyncio
+import select
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from framing import HEADER, MAX_FRAME_SIZE, FrameDecoder, FrameTooLarge, recv_frames, send_frame, write_frames
+from settings import apply_profile
+
+DNS_TTL = 60.0
+POOL_SIZE = 8
+IDLE_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 5.0
+CHECK_AFTER = 1.0
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the acquire timeout."""
+
+
+class Resolver:
+    """getaddrinfo() cache with a fixed TTL."""
+
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self._cache = {}  # (host, port) -> (expires, addrinfo list)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            hit = self._cache.get(key)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        return None
+
+    def _put(self, key, infos):
+        infos = [(family, type_, proto, addr) for family, type_, proto, _, addr in infos]
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, infos)
+        return infos
+
+    def resolve(self, host, port) -> list:
+        """[(family, type, proto, sockaddr), ...] for a TCP connection."""
+        key = (host, port)
+        return self._get(key) or self._put(key, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+
+    async def resolve_async(self, host, port) -> list:
+        key = (host, port)
+        cached = self._get(key)
+        if cached:
+            return cached
+        loop = asyncio.get_running_loop()
+        return self._put(key, await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+RESOLVER = Resolver()
+
+
+# -- blocking ------------------------------------------------------------------
+
+class PooledConnection:
+    """One keep-alive connection; always returned to its pool after use."""
+
+    def __init__(self, sock, tls=False):
+        self.sock = sock
+        self.tls = tls
+        self.decoder = FrameDecoder()
+        self.last_used = time.monotonic()
+        self.uses = 0
+
+    def request(self, payload) -> bytes:
+        self.uses += 1
+        send_frame(self.sock, payload)
+        frames = recv_frames(self.sock, self.decoder)
+        if len(frames) != 1:
+            # EOF, or replies we did not ask for: either way the stream is unusable.
+            raise ConnectionError("connection closed by peer" if not frames else "unexpected extra reply")
+        return bytes(frames[0])
+
+    def send(self, payload):
+        self.uses += 1
+        send_frame(self.sock, payload)
+
+    def is_healthy(self) -> bool:
+        if self.decoder.buffered:
+            return False
+        if self.tls:
+            # SSLSocket.recv() takes no flags: any readable bytes (close_notify,
+            # EOF or stray data) mean the connection is not reusable.
+            return not (self.sock.pending() or select.select([self.sock], [], [], 0)[0])
+        try:
+            self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return True   # nothing to read: still open
+        except OSError:
+            return False
+        return False      # b"" = peer closed; data = stray bytes
+
+    def close(self):
+        self.sock.close()
+
+
+class ConnectionPool:
+    """Bounded pool of keep-alive connections to one (host, port)."""
+
+    def __init__(self, host, port, max_size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, check_after=CHECK_AFTER,
+                 profile=None, resolver=RESOLVER, tls=None):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.check_after = check_after
+        self.profile = profile
+        self.tls = tls
+        self.resolver = resolver
+        self.stats = {"created": 0, "reused": 0, "evicted": 0, "discarded": 0, "waits": 0}
+        self._idle = deque()   # oldest on the left, most recently used on the right
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _connect(self) -> PooledConnection:
+        error = None
+        for family, type_, proto, address in self.resolver.resolve(self.host, self.port):
+            sock = socket.socket(family, type_, proto)
+            try:
+                if self.profile:
+                    apply_profile(sock, self.profile)
+                sock.settimeout(self.connect_timeout)
+                sock.connect(address)
+                if self.tls:
+                    sock = self.tls.wrap_socket(sock, server_hostname=self.host)
+                sock.settimeout(None)
+                return PooledConnection(sock, bool(self.tls))
+            except OSError as e:
+                sock.close()
+                error = e
+        raise error or OSError(f"no addresses for {self.host}:{self.port}")
+
+    def _drop(self, conn, key):
+        conn.close()
+        self._open -= 1
+        self.stats[key] += 1
+        self._cond.notify()
+
+    def _evict_idle(self, now):
+        while self._idle and now - self._idle[0].last_used > self.idle_timeout:
+            self._drop(self._idle.popleft(), "evicted")
+
+    def evict_idle(self):
+        """Closes connections idle for longer than idle_timeout."""
+        with self._cond:
+            self._evict_idle(time.monotonic())
+
+    def acquire(self, timeout=None) -> PooledConnection:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("pool is closed")
+                now = time.monotonic()
+                self._evict_idle(now)
+                while self._idle:
+                    conn = self._idle.pop()
+                    if now - conn.last_used < self.check_after or conn.is_healthy():
+                        self.stats["reused"] += 1
+                        return conn
+                    self._drop(conn, "discarded")
+                if self._open < self.max_size:
+                    self._open += 1
+                    break
+                self.stats["waits"] += 1
+                remaining = None if deadline is None else deadline - now
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeout(f"no free connection to {self.host}:{self.port} within {timeout}s")
+                self._cond.wait(remaining)
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.stats["created"] += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            if broken or self._closed:
+                self._drop(conn, "discarded")
+                return
+            if self.tls:
+                self.tls.remember(conn.sock)
+            conn.last_used = time.monotonic()
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+
+    def request(self, payload, timeout=None, retries=1) -> bytes:
+        """One round trip. Only failures on reused connections are retried."""
+        for attempt in range(retries + 1):
+            conn = self.acquire(timeout)
+            reused = conn.uses > 0
+            try:
+                reply = conn.request(payload)
+            except (OSError, FrameTooLarge):
+                self.release(conn, broken=True)
+                if reused and attempt < retries:
+                    continue
+                raise
+            self.release(conn)
+            return reply
+
+    def send(self, payload, timeout=None):
+        with self.connection(timeout) as conn:
+            conn.send(payload)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._drop(self._idle.pop(), "evicted")
+
+
+class Client:
+    """One ConnectionPool per (host, port); options are passed to each pool."""
+
+    def __init__(self, **pool_options):
+        self.pool_options = pool_options
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def pool(self, host, port) -> ConnectionPool:
+        with self._lock:
+            pool = self._pools.get((host, port))
+            if pool is None:
+                pool = self._pools[(host, port)] = ConnectionPool(host, port, **self.pool_options)
+            return pool
+
+    def request(self, host, port, payload, timeout=None) -> bytes:
+        return self.pool(host, port).request(payload, timeout)
+
+    def send(self, host, port, payload, timeout=None):
+        self.pool(host, port).send(payload, timeout)
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -- asyncio -------------------------------------------------------------------
+
+class AsyncConnection:
+    """asyncio counterpart of PooledConnection."""
+
+    def __init__(self, reader, writer, max_frame_size=MAX_FRAME_SIZE):
+        self.reader = reader
+        self.writer = writer
+        self.max_frame_size = max_frame_size
+        self.last_used = time.monotonic()
+        self.uses = 0
+
+    async def request(self, payload) -> bytes:
+        self.uses += 1
+        write_frames(self.writer, (payload,))
+        await self.writer.drain()
+        (length,) = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+        if length > self.max_frame_size:
+            raise FrameTooLarge(f"Frame of {length} bytes exceeds {self.max_frame_size}")
+        return await self.reader.readexactly(length)
+
+    async def send(self, payload):
+        self.uses += 1
+        write_frames(self.writer, (payload,))
+        await self.writer.drain()
+
+    def is_healthy(self) -> bool:
+        # The event loop has already processed any FIN from the peer.
+        return not (self.writer.is_closing() or self.reader.at_eof())
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+    """Bounded pool of keep-alive asyncio connections to one (host, port)."""
+
+    def __init__(self, host, port, max_size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, profile=None, resolver=RESOLVER, tls=None):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.profile = profile
+        self.tls = tls
+        self.resolver = resolver
+        self.stats = {"created": 0, "reused": 0, "evicted": 0, "discarded": 0, "waits": 0}
+        self._idle = deque()
+        self._open = 0
+        self._closed = False
+        self._cond = None  # created on first use, inside the running loop
+
+    async def _connect(self) -> AsyncConnection:
+        error = None
+        for family, type_, proto, address in await self.resolver.resolve_async(self.host, self.port):
+            sock = socket.socket(family, type_, proto)
+            try:
+                if self.profile:
+                    apply_profile(sock, self.profile)
+                sock.setblocking(False)
+                await asyncio.wait_for(asyncio.get_running_loop().sock_connect(sock, address),
+                                       self.connect_timeout)
+                if self.tls:
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(sock=sock, ssl=self.tls, server_hostname=self.host),
+                        self.connect_timeout)
+                else:
+                    reader, writer = await asyncio.open_connection(sock=sock)
+                return AsyncConnection(reader, writer)
+            except (OSError, asyncio.TimeoutError) as e:
+                sock.close()
+                error = e
+        raise error or OSError(f"no addresses for {self.host}:{self.port}")
+
+    def _drop(self, conn, key):
+        conn.close()
+        self._open -= 1
+        self.stats[key] += 1
+        self._cond.notify()
+
+    def _evict_idle(self, now):
+        while self._idle and now - self._idle[0].last_used > self.idle_timeout:
+            self._drop(self._idle.popleft(), "evicted")
+
+    async def acquire(self, timeout=None) -> AsyncConnection:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("pool is closed")
+                self._evict_idle(time.monotonic())
+                while self._idle:
+                    conn = self._idle.pop()
+                    if conn.is_healthy():
+                        self.stats["reused"] += 1
+                        return conn
+                    self._drop(conn, "discarded")
+                if self._open < self.max_size:
+                    self._open += 1
+                    break
+                self.stats["waits"] += 1
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout)
+                except asyncio.TimeoutError:
+                    raise PoolTimeout(f"no free connection to {self.host}:{self.port} within {timeout}s") from None
+        try:
+            conn = await self._connect()
+        except BaseException:
+            async with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        self.stats["created"] += 1
+        return conn
+
+    async def release(self, conn, broken=False):
+        async with self._cond:
+            if broken or self._closed:
+                self._drop(conn, "discarded")
+                return
+            if self.tls:
+                self.tls.remember(conn.writer.get_extra_info("ssl_object"))
+            conn.last_used = time.monotonic()
+            self._idle.append(conn)
+            self._cond.notify()
+
+    async def request(self, payload, timeout=None, retries=1) -> bytes:
+        """One round trip. Only failures on reused connections are retried."""
+        for attempt in range(retries + 1):
+            conn = await self.acquire(timeout)
+            reused = conn.uses > 0
+            try:
+                reply = await conn.request(payload)
+            except (OSError, asyncio.IncompleteReadError, FrameTooLarge):
+                await self.release(conn, broken=True)
+                if reused and attempt < retries:
+                    continue
+                raise
+            except BaseException:
+                await self.release(conn, broken=True)
+                raise
+            await self.release(conn)
+            return reply
+
+    async def send(self, payload, timeout=None):
+        conn = await self.acquire(timeout)
+        try:
+            await conn.send(payload)
+        except BaseException:
+            await self.release(conn, broken=True)
+            raise
+        await self.release(conn)
+
+    async def close(self):
+        self._closed = True
+        if self._cond is None:
+            return
+        async with self._cond:
+            while self._idle:
+                self._drop(self._idle.pop(), "evicted")
+
+
+class AsyncClient:
+    """One AsyncConnectionPool per (host, port)."""
+
+    def __init__(self, **pool_options):
+        self.pool_options = pool_options
+        self._pools = {}
+
+    def pool(self, host, port) -> AsyncConnectionPool:
+        pool = self._pools.get((host, port))
+        if pool is None:
+            pool = self._pools[(host, port)] = AsyncConnectionPool(host, port, **self.pool_options)
+        return pool
+
+    async def request(self, host, port, payload, timeout=None) -> bytes:
+        return await self.pool(host, port).request(payload, timeout)
+
+    async def send(self, host, port, payload, timeout=None):
+        await self.pool(host, port).send(payload, timeout)
+
+    async def close(self):
+        pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            await pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,307 @@
+"""
+This script is a load generator and benchmark for the echo server.
+
+It opens many concurrent connections with asyncio, and on each connection
+keeps a configurable number of framed payloads in flight (pipelining).
+The echo server returns frames in order, so every response is read back
+with readexactly(frame size) and matched to the oldest outstanding
+request, which gives a round-trip latency per message.
+
+The run stops after a fixed duration or a fixed total message count and
+reports msgs/sec, MB/sec and an HDR-style latency histogram
+(p50/p90/p99/p999), optionally as JSON so results can be stored and
+compared against a baseline over time.
+
+With --tls the load runs over TLS. --handshakes N first times N full and
+N resumed TLS handshakes (next to the plain TCP connect), and with
+--spawn-server the same load is also run against a plaintext server so
+the report shows the throughput cost of encryption.
+
+Example:
+    python3 echo_bench.py --port 5050 --connections 200 --size 64 --duration 10
+    python3 echo_bench.py --spawn-server async --json results.json
+    python3 echo_bench.py --spawn-server async --tls --handshakes 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import deque
+
+from framing import encode_frame
+from histogram import LatencyHistogram
+
+
+async def _connection_worker(host, port, payload, depth, deadline, budget, hist, totals, tls):
+    try:
+        if tls is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, ssl=tls, server_hostname=host)
+    except OSError as e:
+        totals["errors"] += 1
+        print(f"[Bench] Connect error: {e}")
+        return
+    size = len(payload)
+    frame = encode_frame(payload)
+    inflight = deque()
+    try:
+        while True:
+            while len(inflight) < depth and time.perf_counter() < deadline and budget.take():
+                inflight.append(time.perf_counter())
+                writer.write(frame)
+            if not inflight:
+                break
+            await writer.drain()
+            await reader.readexactly(len(frame))
+            now = time.perf_counter()
+            hist.record((now - inflight.popleft()) * 1_000_000)
+            totals["messages"] += 1
+            totals["bytes"] += size
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        totals["errors"] += 1
+        print(f"[Bench] Connection error: {e}")
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class _Budget:
+    """Shared message budget for count-limited runs (None means unlimited)."""
+
+    def __init__(self, total):
+        self.remaining = total
+
+    def take(self) -> bool:
+        if self.remaining is None:
+            return True
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+async def run_benchmark(host="127.0.0.1", port=5050, connections=50, size=64,
+                        depth=1, duration=5.0, messages=None, tls=None) -> dict:
+    """Runs the load and returns the results as a dict."""
+    payload = os.urandom(size)
+    hist = LatencyHistogram()
+    totals = {"messages": 0, "bytes": 0, "errors": 0}
+    budget = _Budget(messages)
+    deadline = float("inf") if messages else time.perf_counter() + duration
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _connection_worker(host, port, payload, depth, deadline, budget, hist, totals, tls)
+        for _ in range(connections)
+    ))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "host": host, "port": port, "connections": connections,
+            "size": size, "depth": depth, "duration": duration, "messages": messages,
+            "tls": tls is not None,
+        },
+        "elapsed_sec": round(elapsed, 3),
+        "messages": totals["messages"],
+        "errors": totals["errors"],
+        "msgs_per_sec": round(totals["messages"] / elapsed, 1) if elapsed else 0.0,
+        "mb_per_sec": round(totals["bytes"] / elapsed / 1e6, 3) if elapsed else 0.0,
+        "latency_us": hist.to_dict(),
+    }
+
+
+def print_report(result: dict):
+    lat = result["latency_us"]["summary"]
+    cfg = result["config"]
+    print("------------------------------------")
+    print(f"Target:        {cfg['host']}:{cfg['port']}{' (TLS)' if cfg.get('tls') else ''}")
+    print(f"Connections:   {cfg['connections']}  payload={cfg['size']}B  depth={cfg['depth']}")
+    print(f"Elapsed:       {result['elapsed_sec']} s")
+    print(f"Messages:      {result['messages']} (errors: {result['errors']})")
+    print(f"Throughput:    {result['msgs_per_sec']} msgs/sec, {result['mb_per_sec']} MB/sec")
+    print(f"Latency (us):  p50={lat['p50']} p90={lat['p90']} p99={lat['p99']} "
+          f"p999={lat['p999']} max={lat['max']}")
+    print("------------------------------------")
+
+
+def measure_handshakes(host, port, tls, count=100) -> dict:
+    """Times `count` TCP connects, full TLS handshakes and resumed TLS handshakes.
+
+    `tls` is a tls.ResumingContext. A full handshake starts with the
+    session forgotten; a resumed one offers the session of the previous
+    connection. One frame is echoed on every connection so TLS 1.3 tickets
+    arrive before the session is remembered.
+    """
+    frame = encode_frame(b"x")
+    results = {"connect": LatencyHistogram(), "full": LatencyHistogram(), "resumed": LatencyHistogram()}
+    reused = 0
+    for resumed in (False, True):
+        for _ in range(count):
+            if not resumed:
+                tls.forget(host)
+            start = time.perf_counter()
+            sock = socket.create_connection((host, port))
+            connected = time.perf_counter()
+            try:
+                conn = tls.wrap_socket(sock, server_hostname=host)
+            except BaseException:
+                sock.close()
+                raise
+            done = time.perf_counter()
+            with conn:
+                conn.sendall(frame)
+                received = 0
+                while received < len(frame):
+                    chunk = conn.recv(len(frame) - received)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                tls.remember(conn)
+                reused += resumed and conn.session_reused
+            results["connect"].record((connected - start) * 1_000_000)
+            results["full" if not resumed else "resumed"].record((done - connected) * 1_000_000)
+    summary = {name: hist.summary() for name, hist in results.items()}
+    summary["resumed_reused"] = reused
+    summary["count"] = count
+    return summary
+
+
+def print_handshakes(result: dict):
+    print("[Bench] Connection setup (us):")
+    for name in ("connect", "full", "resumed"):
+        lat = result[name]
+        label = {"connect": "TCP connect", "full": "TLS full", "resumed": "TLS resumed"}[name]
+        print(f"  {label:<12} p50={lat['p50']} p99={lat['p99']} max={lat['max']}")
+    print(f"  sessions actually resumed: {result['resumed_reused']}/{result['count']}")
+
+
+def print_overhead(tls_result: dict, plain_result: dict):
+    """Prints the throughput cost of TLS against a plaintext run with the same load."""
+    def cost(key):
+        plain, enc = plain_result[key], tls_result[key]
+        return f"{(plain - enc) / plain * 100:.1f}%" if plain else "n/a"
+
+    print(f"[Bench] Plaintext:     {plain_result['msgs_per_sec']} msgs/sec, {plain_result['mb_per_sec']} MB/sec")
+    print(f"[Bench] TLS overhead:  {cost('msgs_per_sec')} msgs/sec, {cost('mb_per_sec')} MB/sec "
+          f"(p50 {plain_result['latency_us']['summary']['p50']} -> "
+          f"{tls_result['latency_us']['summary']['p50']} us)")
+
+
+def compare(result: dict, baseline: dict):
+    """Prints the relative change of the headline numbers against a baseline run."""
+    def delta(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print("[Bench] Compared to baseline:")
+    print(f"  msgs/sec: {delta(result['msgs_per_sec'], baseline['msgs_per_sec'])}")
+    for key in ("p50", "p99", "p999"):
+        new = result["latency_us"]["summary"][key]
+        old = baseline["latency_us"]["summary"][key]
+        print(f"  {key}: {delta(new, old)}")
+
+
+def spawn_server(mode: str, port: int, tls=False):
+    """Starts a local echo_server subprocess and waits until it accepts connections."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "echo_server.py")
+    proc = subprocess.Popen(
+        [sys.executable, script, "--host", "127.0.0.1", "--port", str(port), "--mode", mode]
+        + (["--tls"] if tls else []),
+        stdout=subprocess.DEVNULL,
+    )
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"Echo server did not start on port {port}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Echo server load generator and benchmark")
+    ap.add_argument("--host", default="127.0.0.1", help="Echo server host")
+    ap.add_argument("--port", type=int, default=5050, help="Echo server port")
+    ap.add_argument("--connections", type=int, default=50, help="Concurrent connections")
+    ap.add_argument("--size", type=int, default=64, help="Payload size in bytes")
+    ap.add_argument("--depth", type=int, default=1, help="Pipelined messages in flight per connection")
+    ap.add_argument("--duration", type=float, default=5.0, help="Run time in seconds")
+    ap.add_argument("--messages", type=int, help="Stop after this many messages instead of a duration")
+    ap.add_argument("--json", help="Write the JSON result to this file ('-' for stdout)")
+    ap.add_argument("--baseline", help="JSON result of an earlier run to compare against")
+    ap.add_argument("--histogram", action="store_true", help="Print the full latency distribution")
+    ap.add_argument("--spawn-server", choices=("async",), help="Start a local echo_server for the run")
+    ap.add_argument("--handshakes", type=int, default=0, help="With --tls: time this many full and resumed handshakes")
+    ap.add_argument("--plain-port", type=int, help="With --tls: plaintext server to compare throughput against "
+                                                   "(default with --spawn-server: --port + 1)")
+    from tls import add_client_arguments, client_from_args
+    add_client_arguments(ap)
+    args = ap.parse_args(argv)
+    tls = client_from_args(args)
+    plain_port = args.plain_port
+    if tls and args.spawn_server and plain_port is None:
+        plain_port = args.port + 1
+
+    def load(port, context):
+        return asyncio.run(run_benchmark(
+            host=args.host,
+            port=port,
+            connections=args.connections,
+            size=args.size,
+            depth=args.depth,
+            duration=args.duration,
+            messages=args.messages,
+            tls=context,
+        ))
+
+    servers = []
+    try:
+        if args.spawn_server:
+            servers.append(spawn_server(args.spawn_server, args.port, tls=tls is not None))
+            if tls and plain_port:
+                servers.append(spawn_server(args.spawn_server, plain_port))
+        handshakes = measure_handshakes(args.host, args.port, tls, args.handshakes) if tls and args.handshakes else None
+        result = load(args.port, tls)
+        plain = load(plain_port, None) if tls and plain_port else None
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    if handshakes:
+        result["handshakes_us"] = handshakes
+        print_handshakes(handshakes)
+    print_report(result)
+    if plain:
+        result["plaintext"] = {k: plain[k] for k in ("msgs_per_sec", "mb_per_sec", "latency_us")}
+        print_overhead(result, plain)
+    if args.histogram:
+        hist = LatencyHistogram()
+        for low, high, c in result["latency_us"]["buckets"]:
+            hist.record(high, c)
+        print(hist.format_distribution())
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(result, json.load(f))
+    if args.json == "-":
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"[Bench] Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
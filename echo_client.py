@@ -4,20 +4,49 @@
     echo message we want to this server. The sent 
     and received messages are compared to determine 
     whether the connection is successful or unsuccessful.
+    Messages are sent as length-prefixed frames (see framing.py).
+    A socket profile saved by tuning.py can be applied before
+    connecting.
+
+    With --count the message is sent many times over a pool of
+    keep-alive connections (see client_pool.py) and the request
+    rate and round-trip latency are reported. --tls connects
+    over TLS (see tls.py); pooled connections resume the TLS
+    session instead of doing a full handshake each time.
+
+    With --udp the client instead sends numbered datagrams to a
+    udp-mode server at a paced rate and reports packets per
+    second, loss, reordering and latency (see udp_echo.py).
       
 """
 
+import argparse
 import socket
+import threading
+import time
+
+from client_pool import Client
+from framing import FrameDecoder, recv_frames, send_frame
+from histogram import LatencyHistogram
+from settings import apply_profile
 
-def start_echo_client(host="127.0.0.1", port=5050, message="Hello World"):
+def start_echo_client(host="127.0.0.1", port=5050, message="Hello World", profile=None, tls=None):
     
-    with socket.create_connection((host, port)) as client:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
+        if profile:
+            apply_profile(client, profile)
+        client.connect((host, port))
+        if tls:
+            client = tls.wrap_socket(client, server_hostname=host)
+            print(f"[Echo Client] TLS: {client.version()} {client.cipher()[0]}")
         print(f"[Echo Client] Connected to {host}:{port}")
-        client.sendall(message.encode("utf-8"))
+        send_frame(client, message.encode("utf-8"))
         print(f"[Echo Client] Sent: {message}")
 
-        data = client.recv(1024)
-        received = data.decode("utf-8")
+        # The frame header tells us exactly how much to wait for, however
+        # TCP splits the echo.
+        frames = recv_frames(client, FrameDecoder())
+        received = bytes(frames[0]).decode("utf-8", errors="replace") if frames else ""
         print(f"[Echo Client] Received: {received}")
 
         if received == message:
@@ -26,5 +55,86 @@ def start_echo_client(host="127.0.0.1", port=5050, message="Hello World"):
             print("Connection failed, data mismatch")
 
 
+def run_round_trips(host="127.0.0.1", port=5050, message="Hello World", count=1000,
+                    concurrency=1, profile=None, tls=None) -> dict:
+    """Sends `count` echo requests from `concurrency` threads sharing one connection pool."""
+    payload = message.encode("utf-8")
+    hist = LatencyHistogram()
+    errors = []
+    lock = threading.Lock()
+    shares = [count // concurrency + (i < count % concurrency) for i in range(concurrency)]
+
+    with Client(max_size=concurrency, profile=profile, tls=tls) as client:
+        def worker(n):
+            local = LatencyHistogram()
+            try:
+                for _ in range(n):
+                    start = time.perf_counter()
+                    if client.request(host, port, payload) != payload:
+                        raise ValueError("echo mismatch")
+                    local.record((time.perf_counter() - start) * 1_000_000)
+            except (OSError, ValueError) as e:
+                errors.append(str(e))
+            with lock:
+                hist.merge(local)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in shares]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        pool_stats = dict(client.pool(host, port).stats)
+
+    return {
+        "requests": hist.count,
+        "errors": errors,
+        "elapsed_sec": round(elapsed, 3),
+        "requests_per_sec": round(hist.count / elapsed, 1) if elapsed else 0.0,
+        "latency_us": hist.summary(),
+        "pool": pool_stats,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="B. Echo Client")
+    ap.add_argument("--host", default="127.0.0.1", help="Server host")
+    ap.add_argument("--port", type=int, default=5050, help="Server port")
+    ap.add_argument("--message", default="Hello World", help="Message to echo")
+    ap.add_argument("--profile", help="Saved socket profile to apply before connecting (see tuning.py)")
+    ap.add_argument("--count", type=int, default=1, help="Send the message this many times over pooled connections")
+    ap.add_argument("--concurrency", type=int, default=1, help="Parallel requesters (pool size) with --count")
+    ap.add_argument("--udp", action="store_true", help="Packet-rate test against a udp-mode server")
+    ap.add_argument("--rate", type=float, default=10000, help="UDP: target datagrams/sec in total (0 = flood)")
+    ap.add_argument("--size", type=int, default=64, help="UDP: datagram size in bytes")
+    ap.add_argument("--duration", type=float, default=5.0, help="UDP: sending time in seconds")
+    ap.add_argument("--senders", type=int, default=1, help="UDP: sending processes")
+    ap.add_argument("--batch", type=int, default=32, help="UDP: datagrams per send call (GSO) when behind schedule")
+    ap.add_argument("--no-gso", action="store_true", help="UDP: one send call per datagram")
+    from tls import add_client_arguments, client_from_args
+    add_client_arguments(ap)
+    args = ap.parse_args(argv)
+    tls = client_from_args(args)
+    if args.udp:
+        from udp_echo import run_udp_client
+        result = run_udp_client(args.host, args.port, args.rate, args.duration, args.size,
+                                args.senders, args.batch, not args.no_gso)
+        for key, value in result.items():
+            print(f"{key:>15}: {value}")
+        return
+    if args.count <= 1:
+        start_echo_client(args.host, args.port, args.message, args.profile, tls)
+        return
+    result = run_round_trips(args.host, args.port, args.message, args.count, args.concurrency,
+                             args.profile, tls)
+    print(f"[Echo Client] {result['requests']} requests in {result['elapsed_sec']}s "
+          f"({result['requests_per_sec']} req/s), pool {result['pool']}")
+    lat = result["latency_us"]
+    print(f"[Echo Client] Latency us: p50={lat['p50']} p99={lat['p99']} max={lat['max']}")
+    for e in result["errors"][:5]:
+        print(f"[Echo Client] ERROR: {e}")
+
+
 if __name__ == "__main__":
-    start_echo_client()
\ No newline at end of file
+    main()
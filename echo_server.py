@@ -1,36 +1,410 @@
-""" 
-    This code starts an echo server on the specified host 
-    IP and port. It uses a TCP connection to do this. It 
+"""
+    This code starts an echo server on the specified host
+    IP and port. It uses a TCP connection to do this. It
     ensures that the port becomes available again after
-    the server is shut down. Once the TCP connection is 
+    the server is shut down. Once the TCP connection is
     established with the client, we can test it by sending an
-    echo message.
+    echo message. Messages are length-prefixed frames
+    (see framing.py), so large messages survive TCP
+    splitting and coalescing.
+
+    Three engines are available:
+    - "simple": accepts a single client and serves it with
+      blocking recv/sendall calls (the original demo). As a
+      worker of a --workers pool it serves clients one after
+      another instead of exiting after the first.
+    - "async": an asyncio engine that serves many concurrent
+      connections from one process, with a configurable
+      backlog, per-connection read buffer size and a
+      graceful shutdown on Ctrl+C / SIGTERM.
+    - "udp": echoes datagrams instead, for packet-rate and
+      small-datagram latency tests (see udp_echo.py).
+
+    A socket profile saved by tuning.py can be applied to
+    every client connection with --profile, and both engines
+    can serve TLS with --tls (see tls.py).
+
+    Both TCP engines take a server policy (see
+    server_policy.py): max connections, per-client byte and
+    message rate limits, and idle/slowloris timeouts.
+
+    Both engines count accepts, active connections, bytes,
+    frames, recv/send calls and per-read echo latency in
+    metrics.py (--metrics-port / --metrics-file export them).
 
 """
 
+import argparse
+import asyncio
+import signal
 import socket
+import time
+
+import metrics
+from framing import FrameDecoder, FrameTooLarge, recv_frames, send_frames, write_frames
+from server_policy import Reaped, ServerPolicy, guarded_recv_frames
+from settings import apply_profile, load_profile
+
+DEFAULT_BACKLOG = 1024
+DEFAULT_BUFSIZE = 64 * 1024
+STATS_INTERVAL = 1.0
+
+
+class EchoMetrics:
+    """The echo server's metrics, labelled with its port."""
+
+    def __init__(self, port):
+        labels = {"port": port}
+        self.accepted = metrics.counter("echo_accepted_total", "Accepted connections", **labels)
+        self.bytes_in = metrics.counter("echo_bytes_in_total", "Bytes received", **labels)
+        self.bytes_out = metrics.counter("echo_bytes_out_total", "Bytes echoed back", **labels)
+        self.frames = metrics.counter("echo_frames_total", "Frames echoed", **labels)
+        self.recv_calls = metrics.counter("echo_recv_calls_total", "Socket reads", **labels)
+        self.send_calls = metrics.counter("echo_send_calls_total", "Socket writes (sendmsg/write)", **labels)
+        self.paused = metrics.counter("echo_write_paused_total", "Times a peer's write buffer hit high water", **labels)
+        self.latency = metrics.histogram("echo_read_to_write_us", "Time from a read to its echo write (us)", **labels)
+        self.active = metrics.gauge("echo_active_connections", "Open client connections", **labels)
+
 
-def start_echo_server(host="0.0.0.0", port=5050):
-    
+def _serve_simple(host, port, reuse_port=False, stats_hook=None, profile=None, tls=None, policy=None):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
         server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server.bind((host, port))
         server.listen(1)
         print(f"[Echo Server] Listening on {host}:{port} ...")
 
-        conn, addr = server.accept()
-        print(f"[Echo Server] Connected by {addr}")
+        m = EchoMetrics(port)
+        policy = ServerPolicy.from_spec(policy, "echo", port)
+        stats = {"accepted": 0, "active": 0, "bytes_in": 0, "bytes_out": 0}
+        # The interactive demo serves one client; pool workers (reuse_port) keep accepting.
+        while True:
+            conn, addr = server.accept()
+            _serve_simple_client(conn, addr, m, stats, stats_hook, profile, tls, policy)
+            if not reuse_port:
+                break
+
+
+def _serve_simple_client(conn, addr, m, stats, stats_hook, profile, tls, policy):
+    """Echoes one client's frames with blocking recv/sendmsg until it leaves."""
+    print(f"[Echo Server] Connected by {addr}")
+    slot = None
+    if policy is not None:
+        slot = policy.open(addr[0])
+        if slot is None:
+            print("[Echo Server] Refused by the server policy.")
+            conn.close()
+            return
+        conn.settimeout(policy.socket_timeout)
+    try:
+        if profile:
+            apply_profile(conn, profile)
+        if tls:
+            from tls import server_context
+            conn = server_context(tls).wrap_socket(conn, server_side=True)
+            print(f"[Echo Server] TLS: {conn.version()} {conn.cipher()[0]}")
+        m.accepted.inc()
+        m.active.inc()
+        stats["accepted"] += 1
+        stats["active"] = 1
+        decoder = FrameDecoder()
+        reads = 0
 
         with conn:
             while True:
-                data = conn.recv(1024)
-                if not data:
+                try:
+                    if slot is None:
+                        frames = recv_frames(conn, decoder)
+                    else:
+                        frames = guarded_recv_frames(conn, decoder, slot)
+                except FrameTooLarge as e:
+                    print(f"[Echo Server] Dropping client: {e}")
+                    break
+                except Reaped as e:
+                    print(f"[Echo Server] Closing client: {e}.")
+                    break
+                m.recv_calls.inc(decoder.recv_calls - reads)
+                reads = decoder.recv_calls
+                if not frames:
                     print("[Echo Server] Client disconnected.")
                     break
-                print(f"[Echo Server] Received: {data.decode('utf-8')}")
-                conn.sendall(data) 
+                start = time.perf_counter()
+                for frame in frames:
+                    print(f"[Echo Server] Received: {bytes(frame).decode('utf-8', errors='replace')}")
+                m.send_calls.inc(send_frames(conn, frames))
+                m.latency.observe_since(start)
                 print("[Echo Server] Echoed the message back.")
+                size = sum(len(f) for f in frames)
+                m.frames.inc(len(frames))
+                m.bytes_in.inc(size)
+                m.bytes_out.inc(size)
+                stats["bytes_in"] += size
+                stats["bytes_out"] += size
+                if stats_hook:
+                    stats_hook(stats)
+
+        m.active.dec()
+        stats["active"] = 0
+        if stats_hook:
+            stats_hook(stats)
+    finally:
+        if policy is not None:
+            policy.close(slot)
+
+
+class EchoProtocol(asyncio.Protocol):
+    """Echoes every complete frame straight back to the peer.
+
+    Uses the Protocol API instead of streams so that each read is a single
+    callback with no extra task per connection. All frames parsed from one
+    read are written back with a single write() call. Reading is
+    paused while the transport's write buffer is above its high-water mark.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.decoder = FrameDecoder()
+        self.slot = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.server.policy is not None:
+            self.slot = self.server.policy.open(transport.get_extra_info("peername")[0], transport)
+            if self.slot is None:
+                return
+        self.server.connections.add(transport)
+        self.server.metrics.accepted.inc()
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.server.bufsize)
+            if self.server.profile:
+                apply_profile(sock, self.server.profile)
+
+    def data_received(self, data):
+        start = time.perf_counter()
+        m = self.server.metrics
+        m.recv_calls.inc()
+        m.bytes_in.inc(len(data))
+        try:
+            frames = self.decoder.feed(data)
+        except FrameTooLarge:
+            self.transport.close()
+            return
+        if frames:
+            write_frames(self.transport, frames)
+            m.send_calls.inc()
+            m.frames.inc(len(frames))
+            m.bytes_out.inc(sum(len(f) for f in frames))
+            m.latency.observe_since(start)
+        if self.slot is not None:
+            delay = self.slot.on_data(len(data), len(frames), self.decoder.buffered > 0)
+            if delay:
+                self.slot.throttle(delay)
+
+    def pause_writing(self):
+        self.server.metrics.paused.inc()
+        if self.slot is not None:
+            self.slot.pause_reading("write")
+        else:
+            self.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.slot is not None:
+            self.slot.resume_reading("write")
+        else:
+            self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        self.server.connections.discard(self.transport)
+        if self.server.policy is not None:
+            self.server.policy.close(self.slot)
+
+
+class AsyncEchoServer:
+    """Multi-client echo server built on asyncio."""
+
+    def __init__(self, host="0.0.0.0", port=5050, backlog=DEFAULT_BACKLOG,
+                 bufsize=DEFAULT_BUFSIZE, reuse_port=False, stats_hook=None, profile=None, tls=None,
+                 policy=None):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.bufsize = bufsize
+        self.reuse_port = reuse_port
+        self.stats_hook = stats_hook
+        # Resolved once here, not per connection.
+        self.profile_name = profile if isinstance(profile, str) else "custom"
+        self.profile = load_profile(profile) if isinstance(profile, str) else profile
+        self.tls = tls
+        self.policy = ServerPolicy.from_spec(policy, "echo", port)
+        self.connections = set()
+        self.metrics = EchoMetrics(port)
+        self.metrics.active.fn = lambda: len(self.connections)
+        metrics.gauge("echo_write_buffer_bytes", "Bytes queued in transport write buffers",
+                      fn=lambda: sum(t.get_write_buffer_size() for t in list(self.connections)),
+                      port=port)
+        self._server = None
+        self._stopping = None
+        self._stats_task = None
+
+    def stats(self) -> dict:
+        m = self.metrics
+        stats = {
+            "accepted": m.accepted.value,
+            "active": len(self.connections),
+            "bytes_in": m.bytes_in.value,
+            "bytes_out": m.bytes_out.value,
+        }
+        if self.policy is not None:
+            stats.update(self.policy.snapshot())
+        return stats
+
+    async def _publish_stats(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            self.stats_hook(self.stats())
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        ssl_context = None
+        if self.tls:
+            from tls import server_context
+            ssl_context = server_context(self.tls)
+        self._server = await loop.create_server(
+            lambda: EchoProtocol(self),
+            self.host,
+            self.port,
+            backlog=self.backlog,
+            reuse_address=True,
+            reuse_port=self.reuse_port or None,
+            ssl=ssl_context,
+            ssl_handshake_timeout=(self.policy.frame_timeout or None) if ssl_context and self.policy else None,
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.policy is not None:
+            self.policy.start()
+        if self.stats_hook:
+            self._stats_task = asyncio.ensure_future(self._publish_stats())
+        print(f"[Echo Server] (async) Listening on {self.host}:{self.port} "
+              f"backlog={self.backlog} bufsize={self.bufsize}"
+              + (f" profile={self.profile_name}" if self.profile else "")
+              + (" tls" if self.tls else "")
+              + (f" policy: {self.policy.describe()}" if self.policy else ""))
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._stopping.wait()
+        await self._shutdown()
+
+    def stop(self):
+        """Requests a graceful shutdown; safe to call from signal handlers."""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _shutdown(self, grace=2.0):
+        if self.policy is not None:
+            self.policy.stop()
+        if self._stats_task:
+            self._stats_task.cancel()
+            self.stats_hook(self.stats())
+        self._server.close()
+        await self._server.wait_closed()
+        # Let in-flight echoes drain before closing the remaining peers.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + grace
+        while loop.time() < deadline and any(
+            t.get_write_buffer_size() for t in self.connections
+        ):
+            await asyncio.sleep(0.05)
+        open_transports = list(self.connections)
+        for transport in open_transports:
+            transport.close()
+        print(f"[Echo Server] Shut down, closed {len(open_transports)} connection(s).")
+
+
+async def _run_async(host, port, backlog, bufsize, reuse_port=False, stats_hook=None, profile=None, tls=None,
+                     policy=None):
+    server = AsyncEchoServer(host, port, backlog, bufsize, reuse_port, stats_hook, profile, tls, policy)
+    await server.start()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, server.stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # e.g. Windows, or not running in the main thread
+    await server.serve_forever()
+
+
+def start_echo_server(host="0.0.0.0", port=5050, mode="simple",
+                      backlog=DEFAULT_BACKLOG, bufsize=DEFAULT_BUFSIZE,
+                      workers=1, reuse_port=False, stats_hook=None, profile=None, tls=None, policy=None):
+    """Starts the echo server using the selected engine ("simple" or "async").
+
+    With workers > 1 the server is pre-forked into that many processes
+    sharing the port via SO_REUSEPORT (see worker_pool.py). `profile` is
+    the name of a saved socket profile (see tuning.py) or an options dict.
+    `tls` is None, True (local self-signed cert) or a (certfile, keyfile) pair.
+    `policy` is a dict of server_policy options (limits and timeouts).
+    """
+    if workers > 1:
+        from worker_pool import run_worker_pool
+        run_worker_pool(
+            start_echo_server,
+            {"host": host, "port": port, "mode": mode, "backlog": backlog, "bufsize": bufsize,
+             "profile": profile, "tls": tls, "policy": policy},
+            workers,
+            name="Echo Pool",
+        )
+    elif mode == "simple":
+        _serve_simple(host, port, reuse_port, stats_hook, profile, tls, policy)
+    elif mode == "async":
+        try:
+            asyncio.run(_run_async(host, port, backlog, bufsize, reuse_port, stats_hook, profile, tls, policy))
+        except KeyboardInterrupt:
+            print("[Echo Server] Interrupted by user.")
+    elif mode == "udp":
+        if tls or policy:
+            raise ValueError("TLS and server policies are not available in udp mode")
+        from udp_echo import start_udp_echo_server
+        start_udp_echo_server(host, port, reuse_port=reuse_port, stats_hook=stats_hook)
+    else:
+        raise ValueError(f"Unknown echo server mode: {mode!r}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="B. Echo Server")
+    ap.add_argument("--host", default="0.0.0.0", help="Bind host")
+    ap.add_argument("--port", type=int, default=5050, help="Bind port")
+    ap.add_argument("--mode", choices=("simple", "async", "udp"), default="simple", help="Server engine")
+    ap.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG, help="listen() backlog (async)")
+    ap.add_argument("--bufsize", type=int, default=DEFAULT_BUFSIZE, help="Per-connection SO_RCVBUF (async)")
+    ap.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port (SO_REUSEPORT)")
+    ap.add_argument("--profile", help="Saved socket profile to apply to client connections (see tuning.py)")
+    from tls import add_server_arguments, server_spec
+    add_server_arguments(ap)
+    import server_policy
+    server_policy.add_arguments(ap)
+    metrics.add_arguments(ap)
+    args = ap.parse_args(argv)
+    metrics.enable_from_args(args)
+
+    start_echo_server(
+        host=args.host,
+        port=args.port,
+        mode=args.mode,
+        backlog=args.backlog,
+        bufsize=args.bufsize,
+        workers=args.workers,
+        profile=args.profile,
+        tls=server_spec(args),
+        policy=server_policy.from_args(args),
+    )
 
 
 if __name__ == "__main__":
-    start_echo_server()
\ No newline at end of file
+    main()
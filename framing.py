@@ -0,0 +1,170 @@
+"""
+This module implements the length-prefixed framing shared by the echo
+and chat modules.
+
+TCP is a byte stream: one send() on the sender can arrive as several
+recv() calls, and several sends can arrive in one recv(). Every message
+is therefore sent as a frame:
+
+    +----------------------+------------------+
+    | length (4 bytes, BE) | payload (length) |
+    +----------------------+------------------+
+
+FrameDecoder parses frames incrementally out of a single reusable
+bytearray. It can be filled straight from a socket with recv_into(), and
+complete frames are handed out as memoryview slices of that buffer, so no
+per-message copies are made. A frame is only valid until the next call
+that adds data to the decoder.
+
+send_frames() / write_frames() send many frames at once with a single
+sendmsg() / write() call. write_frames() joins the batch into one bytes
+object first: asyncio transports may keep the buffers they are given
+(3.12+ no longer copies in writelines()), and a frame view must not
+outlive the decoder data it points into.
+"""
+
+import socket
+import struct
+
+HEADER = struct.Struct("!I")
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+INITIAL_BUFFER_SIZE = 64 * 1024
+# Stay well below IOV_MAX (1024 on Linux) per sendmsg() call.
+MAX_IOV = 512
+
+
+class FrameTooLarge(ValueError):
+    """Raised when a frame exceeds the configured maximum size."""
+
+
+def encode_frame(payload) -> bytes:
+    """Returns header + payload as one bytes object (convenience for small messages)."""
+    return HEADER.pack(len(payload)) + bytes(payload)
+
+
+def frame_buffers(payloads, max_frame_size=MAX_FRAME_SIZE):
+    """Flattens payloads into [header, payload, header, payload, ...] without copying."""
+    buffers = []
+    for payload in payloads:
+        if len(payload) > max_frame_size:
+            raise FrameTooLarge(f"Frame of {len(payload)} bytes exceeds {max_frame_size}")
+        buffers.append(HEADER.pack(len(payload)))
+        buffers.append(payload)
+    return buffers
+
+
+def send_frames(sock: socket.socket, payloads, max_frame_size=MAX_FRAME_SIZE) -> int:
+    """Sends all payloads as frames using scatter/gather sendmsg() calls.
+
+    Works on blocking sockets; partial writes are resumed from where the
+    kernel stopped. Returns the number of send calls made.
+    """
+    buffers = [memoryview(b).cast("B") for b in frame_buffers(payloads, max_frame_size)]
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(buffers))
+        return 1
+    i = calls = 0
+    while i < len(buffers):
+        try:
+            sent = sock.sendmsg(buffers[i:i + MAX_IOV])
+        except NotImplementedError:
+            # ssl.SSLSocket has sendmsg() but does not support it.
+            sock.sendall(b"".join(buffers[i:]))
+            return calls + 1
+        calls += 1
+        while i < len(buffers) and sent >= len(buffers[i]):
+            sent -= len(buffers[i])
+            i += 1
+        if sent:
+            buffers[i] = buffers[i][sent:]
+    return calls
+
+
+def send_frame(sock: socket.socket, payload, max_frame_size=MAX_FRAME_SIZE) -> int:
+    return send_frames(sock, (payload,), max_frame_size)
+
+
+def write_frames(writer, payloads, max_frame_size=MAX_FRAME_SIZE):
+    """Queues frames on an asyncio StreamWriter or Transport with one write() call.
+
+    The frames are copied (once, into one bytes object), so payloads may be
+    FrameDecoder views that the next feed() overwrites.
+    """
+    writer.write(b"".join(frame_buffers(payloads, max_frame_size)))
+
+
+class FrameDecoder:
+    """Incremental frame parser over one reusable buffer."""
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, initial_size=INITIAL_BUFFER_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buf = bytearray(initial_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.recv_calls = 0  # recv_into() syscalls, for metrics
+
+    @property
+    def buffered(self) -> int:
+        return self._end - self._start
+
+    def _reserve(self, needed: int):
+        """Makes room for `needed` more bytes after the buffered data."""
+        if self._end + needed <= len(self._buf):
+            return
+        pending = self._end - self._start
+        if pending + needed <= len(self._buf):
+            # Move the partial frame to the front; the buffer keeps its size.
+            self._view[:pending] = self._view[self._start:self._end]
+        else:
+            # Grow into a new buffer so views handed out earlier stay intact.
+            size = len(self._buf)
+            while size < pending + needed:
+                size *= 2
+            buf = bytearray(size)
+            buf[:pending] = self._view[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        self._start, self._end = 0, pending
+
+    def feed(self, data):
+        """Appends received bytes and returns the complete frames."""
+        self._reserve(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+        return list(self.frames())
+
+    def recv_into(self, sock: socket.socket, bufsize=INITIAL_BUFFER_SIZE) -> int:
+        """Reads from the socket directly into the buffer; returns the byte count (0 = EOF)."""
+        self._reserve(bufsize)
+        n = sock.recv_into(self._view[self._end:], bufsize)
+        self.recv_calls += 1
+        self._end += n
+        return n
+
+    def frames(self):
+        """Yields complete frames as memoryviews and consumes them from the buffer."""
+        while self._end - self._start >= HEADER_SIZE:
+            (length,) = HEADER.unpack_from(self._buf, self._start)
+            if length > self.max_frame_size:
+                raise FrameTooLarge(f"Frame of {length} bytes exceeds {self.max_frame_size}")
+            begin = self._start + HEADER_SIZE
+            if self._end - begin < length:
+                # Incomplete; compaction waits for the next feed()/recv_into()
+                # so frames already yielded from this buffer are not moved.
+                return
+            self._start = begin + length
+            yield self._view[begin:begin + length]
+        if self._start == self._end:
+            self._start = self._end = 0
+
+
+def recv_frames(sock: socket.socket, decoder: FrameDecoder):
+    """Blocks until at least one frame is available; returns [] when the peer closed."""
+    while True:
+        frames = list(decoder.frames())
+        if frames:
+            return frames
+        if not decoder.recv_into(sock):
+            return []
@@ -0,0 +1,122 @@
+"""
+This module provides a small HDR-style latency histogram used by the
+benchmark and metrics code.
+
+Values are recorded as integers (microseconds by convention) into
+log-linear buckets: each power of two is split into a fixed number of
+linear sub-buckets, so the relative error of any reported percentile is
+bounded (below 1% with the default 7 significant bits) while memory stays
+small and recording is O(1).
+"""
+
+import math
+
+SUB_BUCKET_BITS = 7
+
+
+class LatencyHistogram:
+    """Log-linear histogram of non-negative integer values."""
+
+    def __init__(self, sub_bucket_bits: int = SUB_BUCKET_BITS):
+        self.sub_bits = sub_bucket_bits
+        self.sub_count = 1 << sub_bucket_bits
+        self.half = self.sub_count >> 1
+        self.counts = [0] * self.sub_count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value: int) -> int:
+        bucket = max(0, value.bit_length() - self.sub_bits)
+        return bucket * self.half + (value >> bucket)
+
+    def _bounds(self, index: int):
+        """Lowest and highest value that map to `index`."""
+        if index < self.sub_count:
+            return index, index
+        bucket = (index - self.sub_count) // self.half + 1
+        sub = index - bucket * self.half
+        return sub << bucket, ((sub + 1) << bucket) - 1
+
+    def record(self, value, count: int = 1):
+        value = max(0, int(value))
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        if other.sub_bits != self.sub_bits:
+            raise ValueError("Cannot merge histograms with different precision")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def reset(self):
+        self.counts = [0] * self.sub_count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> int:
+        """Value at percentile p (0-100), reported as the bucket's upper bound."""
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(self.count * p / 100.0))
+        seen = 0
+        for index, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self._bounds(index)[1], self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "min": self.min or 0,
+            "mean": round(self.mean, 2),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max or 0,
+        }
+
+    def buckets(self):
+        """Non-empty buckets as (low, high, count) tuples, for HDR-style output."""
+        return [(*self._bounds(i), c) for i, c in enumerate(self.counts) if c]
+
+    def to_dict(self) -> dict:
+        return {
+            "summary": self.summary(),
+            "buckets": [[low, high, c] for low, high, c in self.buckets()],
+        }
+
+    def format_distribution(self, unit="us") -> str:
+        """Percentile distribution table in the spirit of HdrHistogram's output."""
+        lines = [f"{'Value (' + unit + ')':>14} {'Percentile':>12} {'TotalCount':>12}"]
+        seen = 0
+        for low, high, c in self.buckets():
+            seen += c
+            lines.append(f"{high:>14} {seen / self.count:>12.6f} {seen:>12}")
+        s = self.summary()
+        lines.append(f"#[Mean = {s['mean']}, Max = {s['max']}, Total count = {s['count']}]")
+        return "\n".join(lines)
@@ -0,0 +1,185 @@
+"""
+This module implements the shared background log writer used by
+main.log_line and simple_chat_server.log_message.
+
+Callers only put a line on a bounded queue, so a slow disk never stalls a
+socket loop. A single background thread per log file keeps the file open,
+and writes lines in batches, flushing when either the batch size or the
+flush interval is reached. Optional features:
+- fsync policy: "never" (default) or "batch" (after every flushed batch);
+- size-based rotation: file -> file.1 -> file.2 ... up to backup_count.
+
+If the queue is full the line is dropped and counted instead of blocking
+the caller. metrics() reports queue depth, written/dropped lines, batches
+and rotations; writers from get_writer() also export queue depth and
+dropped lines through metrics.py.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+import metrics
+
+MAX_QUEUE = 10000
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 0.5
+FSYNC_POLICIES = ("never", "batch")
+
+_STOP = object()
+
+
+class LogWriter:
+    """Asynchronous, batched, append-only line writer for one file."""
+
+    def __init__(self, path, max_queue=MAX_QUEUE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, fsync="never", max_bytes=0, backup_count=3):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync!r}")
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = None
+        self._stats = {"written": 0, "dropped": 0, "batches": 0, "rotations": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name=f"log-writer:{self.path.name}", daemon=True)
+        self._thread.start()
+
+    def write(self, line: str) -> bool:
+        """Queues one line (without trailing newline); returns False if it was dropped."""
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self._stats["dropped"] += 1
+            return False
+
+    def metrics(self) -> dict:
+        return dict(self._stats, queue_depth=self._queue.qsize(), queue_max=self._queue.maxsize)
+
+    def close(self, timeout=5.0):
+        """Flushes everything still queued and stops the writer thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # -- writer thread -----------------------------------------------------
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink(missing_ok=True)
+        self._stats["rotations"] += 1
+        self._open()
+
+    def _flush(self, batch):
+        data = "\n".join(batch) + "\n"
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync == "batch":
+                os.fsync(self._file.fileno())
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self._stats["errors"] += 1
+            self._stats["dropped"] += len(batch)
+            print(f"!!! CRITICAL: Failed to write to log file {self.path}: {e} !!!")
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass  # the buffered data is already counted as dropped
+            self._file = None
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+        # Drain whatever was queued before close().
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            self._flush(batch)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path, **options) -> LogWriter:
+    """Returns the process-wide writer for `path`, creating it on first use."""
+    key = str(Path(path).resolve())
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = LogWriter(path, **options)
+            metrics.gauge("log_queue_depth", "Lines waiting in the background log writer queue",
+                          fn=lambda: writer.metrics()["queue_depth"], path=str(path))
+            metrics.gauge("log_dropped_lines", "Log lines dropped because the writer queue was full",
+                          fn=lambda: writer.metrics()["dropped"], path=str(path))
+        return writer
+
+
+def close_all():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+def _reset_after_fork():
+    # Writer threads do not survive fork(); children start their own.
+    global _writers_lock
+    _writers.clear()
+    _writers_lock = threading.Lock()
+
+
+atexit.register(close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,34 +1,284 @@
 """
+This module reports the machine's hostname, addresses and network
+interfaces, and keeps a cached, incremental inventory of them that the
+servers and operators can query cheaply.
 
+Inventory:
+- Everything is cached for `ttl` seconds; repeated calls inside the TTL
+  do not touch psutil or the resolver again.
+- The host name is resolved on a background thread with a timeout, so a
+  slow or broken DNS setup never blocks the caller for long. prefetch()
+  starts the lookup early; addresses() waits at most `dns_timeout` and
+  returns [] if the lookup has not finished (a later call picks it up).
+- sample() reads psutil.net_io_counters(pernic=True) and computes each
+  interface's byte/packet/error rates against the previous sample.
+- changes() compares the interfaces with the last call and returns
+  events: interfaces added/removed, going up/down, addresses added/removed.
+- bind_addresses() lists usable local addresses straight from the
+  interface table (no DNS), e.g. for choosing a server's bind address.
+
+Example:
+    python3 machine_info.py
+    python3 machine_info.py --watch 2      # per-NIC throughput + change events
 """
 
-import os 
+import argparse
+import json
 import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
 import psutil
 
-def print_machine_info():
+DEFAULT_TTL = 30.0
+DNS_TIMEOUT = 2.0
+FAMILIES = {socket.AF_INET: "ipv4", socket.AF_INET6: "ipv6"}
+if hasattr(psutil, "AF_LINK"):
+    FAMILIES[psutil.AF_LINK] = "mac"
+
+Address = namedtuple("Address", "family address netmask")
+Interface = namedtuple("Interface", "name addresses is_up speed_mbps mtu")
+Rates = namedtuple(
+    "Rates", "name bytes_sent bytes_recv sent_per_sec recv_per_sec "
+             "packets_sent_per_sec packets_recv_per_sec errors drops"
+)
+Change = namedtuple("Change", "kind interface detail")
+
+
+def _delta(new, old) -> int:
+    # Counters can wrap or be reset (driver reload); count that as zero.
+    return new - old if new >= old else 0
+
+
+class Inventory:
+    """TTL-cached view of the host name, addresses, interfaces and NIC rates."""
+
+    def __init__(self, ttl=DEFAULT_TTL, dns_timeout=DNS_TIMEOUT):
+        self.ttl = ttl
+        self.dns_timeout = dns_timeout
+        self._cache = {}            # key -> (expires, value)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inventory-dns")
+        self._dns = None            # pending/finished future for the host lookup
+        self._dns_expires = 0.0
+        self._last_counters = None  # (monotonic time, pernic counters)
+        self._known = None          # interfaces seen by the last changes() call
+
+    def _cached(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit and hit[0] > now:
+                return hit[1]
+        value = compute()
+        with self._lock:
+            self._cache[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+            self._dns = None
+
+    # -- names ---------------------------------------------------------------
+
+    def hostname(self) -> str:
+        return self._cached("hostname", socket.gethostname)
+
+    def _lookup(self):
+        # Runs on the DNS thread, so a gethostname() failure ends up in the future too.
+        infos = socket.getaddrinfo(self.hostname(), None, type=socket.SOCK_STREAM)
+        return sorted({info[4][0] for info in infos})
+
+    def prefetch(self):
+        """Starts resolving the host name in the background (returns immediately, never raises)."""
+        with self._lock:
+            if self._dns is None or (self._dns.done() and self._dns_expires <= time.monotonic()):
+                self._dns = self._pool.submit(self._lookup)
+                self._dns_expires = time.monotonic() + self.ttl
+            return self._dns
+
+    def addresses(self, timeout=None) -> list:
+        """Addresses the host name resolves to; [] if DNS fails or is slower than `timeout`."""
+        future = self.prefetch()
+        try:
+            return future.result(self.dns_timeout if timeout is None else timeout)
+        except (FutureTimeout, OSError):
+            return []
+
+    # -- interfaces ----------------------------------------------------------
+
+    def _read_interfaces(self) -> dict:
+        stats = psutil.net_if_stats()
+        result = {}
+        for name, addrs in psutil.net_if_addrs().items():
+            st = stats.get(name)
+            result[name] = Interface(
+                name=name,
+                addresses=tuple(Address(FAMILIES.get(a.family, str(a.family)), a.address, a.netmask)
+                                for a in addrs),
+                is_up=bool(st and st.isup),
+                speed_mbps=st.speed if st else 0,
+                mtu=st.mtu if st else 0,
+            )
+        return result
+
+    def interfaces(self) -> dict:
+        """{name: Interface}, refreshed at most once per TTL."""
+        return self._cached("interfaces", self._read_interfaces)
+
+    def bind_addresses(self, family="ipv4", include_loopback=False) -> list:
+        """Local addresses of interfaces that are up, without any DNS lookup."""
+        result = []
+        for iface in self.interfaces().values():
+            if not iface.is_up:
+                continue
+            for addr in iface.addresses:
+                if addr.family != family:
+                    continue
+                ip = addr.address.split("%", 1)[0]  # drop the IPv6 scope id
+                if not include_loopback and (ip.startswith("127.") or ip == "::1"):
+                    continue
+                result.append(ip)
+        return result
+
+    def changes(self) -> list:
+        """Interface and address changes since the previous call (first call: none)."""
+        current = self._read_interfaces()
+        with self._lock:
+            self._cache["interfaces"] = (time.monotonic() + self.ttl, current)
+            previous, self._known = self._known, current
+        if previous is None:
+            return []
+        events = []
+        for name in sorted(current.keys() - previous.keys()):
+            events.append(Change("added", name, ", ".join(a.address for a in current[name].addresses)))
+        for name in sorted(previous.keys() - current.keys()):
+            events.append(Change("removed", name, ""))
+        for name in sorted(current.keys() & previous.keys()):
+            old, new = previous[name], current[name]
+            if old.is_up != new.is_up:
+                events.append(Change("up" if new.is_up else "down", name, ""))
+            old_addrs = {(a.family, a.address) for a in old.addresses}
+            new_addrs = {(a.family, a.address) for a in new.addresses}
+            for family, address in sorted(new_addrs - old_addrs):
+                events.append(Change("address_added", name, f"{family} {address}"))
+            for family, address in sorted(old_addrs - new_addrs):
+                events.append(Change("address_removed", name, f"{family} {address}"))
+        return events
+
+    # -- counters ------------------------------------------------------------
+
+    def sample(self) -> dict:
+        """{name: Rates} since the previous sample (rates are 0.0 on the first call)."""
+        now = time.monotonic()
+        counters = psutil.net_io_counters(pernic=True)
+        with self._lock:
+            previous, self._last_counters = self._last_counters, (now, counters)
+        elapsed = now - previous[0] if previous else 0.0
+        result = {}
+        for name, c in counters.items():
+            old = previous[1].get(name) if previous else None
+            if old is not None and elapsed > 0:
+                sent = _delta(c.bytes_sent, old.bytes_sent) / elapsed
+                recv = _delta(c.bytes_recv, old.bytes_recv) / elapsed
+                psent = _delta(c.packets_sent, old.packets_sent) / elapsed
+                precv = _delta(c.packets_recv, old.packets_recv) / elapsed
+            else:
+                sent = recv = psent = precv = 0.0
+            result[name] = Rates(name, c.bytes_sent, c.bytes_recv, sent, recv, psent, precv,
+                                 c.errin + c.errout, c.dropin + c.dropout)
+        return result
+
+    def snapshot(self) -> dict:
+        """JSON-friendly inventory (uses the caches; DNS is waited on for dns_timeout at most)."""
+        return {
+            "hostname": self.hostname(),
+            "addresses": self.addresses(),
+            "interfaces": {name: {"up": i.is_up, "speed_mbps": i.speed_mbps, "mtu": i.mtu,
+                                  "addresses": [a._asdict() for a in i.addresses]}
+                           for name, i in self.interfaces().items()},
+        }
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+
+_INVENTORY = None
+
+
+def get_inventory() -> Inventory:
+    """Process-wide shared Inventory."""
+    global _INVENTORY
+    if _INVENTORY is None:
+        _INVENTORY = Inventory()
+    return _INVENTORY
+
+
+def print_machine_info(inventory=None):
+    inv = inventory or get_inventory()
+    inv.prefetch()  # DNS runs while the interfaces are read
 
     try:
-        hostname = socket.gethostname()
-        print(f"Hostname: {hostname}")
-    except socket.error as e:
+        print(f"Hostname: {inv.hostname()}")
+    except OSError as e:
         print(f"Error: Could not get hostname: {e}")
-        hostname = "Unknown"
 
-    try:
-        ip_address = socket.gethostbyname(hostname)
-        print(f"IP address: {ip_address}")
-    except socket.error as e:
-        print("Error!")
-        hostname = "Unknown"
+    addresses = inv.addresses()
+    print(f"IP address: {', '.join(addresses) if addresses else 'Unknown (DNS failed or timed out)'}")
 
     try:
-        network_interface = psutil.net_if_addrs()
-        print(f"Network Interface: {network_interface}")
+        interfaces = inv.interfaces()
     except psutil.Error as e:
-        print("Error!")
-        network_interface = "Unknown"
+        print(f"Error: Could not read network interfaces: {e}")
+        return
+    print("Network Interfaces:")
+    for iface in interfaces.values():
+        state = "up" if iface.is_up else "down"
+        speed = f", {iface.speed_mbps} Mbit/s" if iface.speed_mbps else ""
+        print(f"  {iface.name} ({state}, mtu {iface.mtu}{speed})")
+        for addr in iface.addresses:
+            mask = f" / {addr.netmask}" if addr.netmask else ""
+            print(f"    {addr.family:<4} {addr.address}{mask}")
+
+
+def watch(interval=2.0, inventory=None):
+    """Prints per-NIC throughput and interface changes every `interval` seconds."""
+    inv = inventory or get_inventory()
+    inv.sample()
+    inv.changes()
+    while True:
+        time.sleep(interval)
+        for change in inv.changes():
+            print(f"[Inventory] {change.interface}: {change.kind} {change.detail}".rstrip())
+        for r in inv.sample().values():
+            if r.sent_per_sec or r.recv_per_sec:
+                print(f"{r.name:>12}: rx {r.recv_per_sec * 8 / 1e6:9.3f} Mbit/s "
+                      f"({r.packets_recv_per_sec:8.0f} pkt/s)  tx {r.sent_per_sec * 8 / 1e6:9.3f} Mbit/s "
+                      f"({r.packets_sent_per_sec:8.0f} pkt/s)  err {r.errors} drop {r.drops}")
 
-if __name__ == "__main__":
-    print_machine_info()
 
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="A. Machine Information")
+    ap.add_argument("--json", action="store_true", help="Print the inventory as JSON")
+    ap.add_argument("--watch", type=float, metavar="SECONDS", help="Report per-NIC rates and changes periodically")
+    ap.add_argument("--dns-timeout", type=float, default=DNS_TIMEOUT, help="Seconds to wait for the host lookup")
+    args = ap.parse_args(argv)
+
+    inv = Inventory(dns_timeout=args.dns_timeout)
+    if args.json:
+        print(json.dumps(inv.snapshot(), indent=2))
+    else:
+        print_machine_info(inv)
+    if args.watch:
+        try:
+            watch(args.watch, inv)
+        except KeyboardInterrupt:
+            pass
+    inv.close()
+
+
+if __name__ == "__main__":
+    main()
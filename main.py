@@ -7,22 +7,64 @@ C. SNTP Time Check
 D. Simple Chat
 E. Settings & Error Management
 
-It presents an interactive command-line menu to the user, allowing
-them to select and run any of the implemented modules. It also
-handles basic logging for key actions to a 'logs/main.log' file.
+Without arguments it presents an interactive command-line menu to
+the user, allowing them to select and run any of the implemented
+modules. With arguments it is a subcommand CLI that forwards the
+remaining options to the module's own command line:
+
+    python3 main.py echo serve --mode async --port 5050
+    python3 main.py echo bench --connections 100
+    python3 main.py chat serve --mode hub
+    python3 main.py sntp query --server pool.ntp.org
+    python3 main.py probe example.com:80 --concurrency 50
+    python3 main.py run services.toml
+
+"run" starts several servers in one process from a TOML/JSON config
+(see runner.py). Modules are imported only when they are used, so
+startup stays fast. Key actions are logged to a 'logs/main.log' file
+through the shared background writer in log_writer.py.
 """
 
+import argparse
+import importlib
+import sys
 from datetime import datetime
 from pathlib import Path
 
-# Module Imports
-from machine_info import print_machine_info
-from echo_server import start_echo_server
-from echo_client import start_echo_client
-from sntp_client import get_sntp_time
-from settings import demo_socket_settings
-from simple_chat_server import start_server as start_chat_server
-from simple_chat_client import start_client as start_chat_client
+from log_writer import get_writer
+
+# group -> action -> (module, argv prefix, help); None = the group takes no action
+COMMANDS = {
+    "echo": {
+        "serve": ("echo_server", [], "Run the echo server"),
+        "client": ("echo_client", [], "Send messages (pooled with --count) and check the echo"),
+        "bench": ("echo_bench", [], "Load-test an echo server"),
+    },
+    "chat": {
+        "serve": ("simple_chat_server", [], "Run the chat server (simple or hub)"),
+        "client": ("simple_chat_client", [], "Interactive chat client"),
+        "history": ("chat_store", [], "Query the chat history store"),
+        "load": ("chat_client", ["load"], "Run many headless clients against the hub"),
+    },
+    "sntp": {
+        "query": ("sntp_client", [], "Check the local clock against SNTP servers"),
+        "serve": ("sntp_server", ["serve"], "Run a local SNTP server"),
+        "bench": ("sntp_server", ["bench"], "Flood an SNTP server"),
+    },
+    "bulk": {
+        "serve": ("bulk_server", [], "Serve files / synthetic data with sendfile"),
+        "fetch": ("bulk_client", [], "Download and report GB/s"),
+    },
+    "trace": {
+        "record": ("trace_replay", ["record"], "Record echo/chat traffic through a proxy"),
+        "replay": ("trace_replay", ["replay"], "Replay a trace and check p99 against a baseline"),
+        "show": ("trace_replay", ["show"], "Summarise a trace file"),
+    },
+    "probe": {None: ("probe", [], "Probe many host:port targets in parallel")},
+    "tune": {None: ("tuning", [], "Socket option tuning sweep")},
+    "settings": {None: ("settings", [], "Socket settings / error handling demo")},
+    "info": {None: ("machine_info", [], "Machine and network interface inventory")},
+}
 
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
@@ -31,8 +73,7 @@ def log_line(msg: str):
     """Logs a message to both the console and the main.log file."""
     line = f"{datetime.now():%Y-%m-%d %H:%M:%S} {msg}"
     print(line)
-    with open(LOG_DIR / "main.log", "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+    get_writer(LOG_DIR / "main.log").write(line)
 
 def menu():
     """Displays the main menu and returns the user's choice."""
@@ -51,6 +92,8 @@ def menu():
 
 def run_machine_info():
     """Executes Module A: Machine Information."""
+    from machine_info import print_machine_info
+
     print("\n--- 1. Machine Information ---")
     print_machine_info()
     log_line("[OK] Machine Information executed.")
@@ -58,29 +101,130 @@ def run_machine_info():
 def run_echo():
     """Executes Module B: Echo Test (Server or Client)."""
     print("\n--- 2. Echo Test ---")
-    mode = input("Run as server or client? (s/c): ").strip().lower()
+    mode = input("Run as server, client, benchmark, (u)dp packet test or bulk (t)ransfer? (s/c/b/u/t): ").strip().lower()
+    if mode == "t":
+        run_bulk()
+        return
     port = int(input("Port [5050]: ") or 5050)
 
     if mode == "s":
         host = input("Bind Host [0.0.0.0]: ").strip() or "0.0.0.0"
-        log_line(f"[Echo] Server starting on {host}:{port}")
+        engine = input("Engine - (s)imple, (a)sync multi-client or (u)dp? [s]: ").strip().lower()
+        engine = {"a": "async", "u": "udp"}.get(engine, "simple")
+        workers = int(input("Worker processes (SO_REUSEPORT) [1]: ").strip() or 1)
+        profile = tls = None
+        if engine != "udp":
+            profile = input("Socket profile (empty = none): ").strip() or None
+            tls = _ask_server_tls()
+        from echo_server import start_echo_server
+
+        log_line(f"[Echo] Server ({engine}, workers={workers}, tls={bool(tls)}) starting on {host}:{port}")
         print("Server starting... (You can stop it with Ctrl+C)\n")
-        start_echo_server(host, port)
+        start_echo_server(host, port, mode=engine, workers=workers, profile=profile, tls=tls)
+    elif mode == "b":
+        host = input("Server IP [127.0.0.1]: ").strip() or "127.0.0.1"
+        connections = int(input("Connections [50]: ").strip() or 50)
+        size = int(input("Payload size (bytes) [64]: ").strip() or 64)
+        duration = float(input("Duration (sec) [5]: ").strip() or 5)
+        import asyncio
+        from echo_bench import run_benchmark as run_echo_benchmark, print_report as print_bench_report
+
+        log_line(f"[Echo] Benchmark -> {host}:{port}, conns={connections}, size={size}")
+        result = asyncio.run(run_echo_benchmark(
+            host=host, port=port, connections=connections, size=size, duration=duration,
+        ))
+        print_bench_report(result)
+    elif mode == "u":
+        host = input("Server IP [127.0.0.1]: ").strip() or "127.0.0.1"
+        rate = float(input("Datagrams/sec (0 = flood) [10000]: ").strip() or 10000)
+        size = int(input("Datagram size (bytes) [64]: ").strip() or 64)
+        duration = float(input("Duration (sec) [5]: ").strip() or 5)
+        from udp_echo import run_udp_client
+
+        result = run_udp_client(host, port, rate, duration, size)
+        for key, value in result.items():
+            print(f"{key:>15}: {value}")
+        log_line(f"[Echo] UDP test -> {host}:{port}: {result['recv_pps']} pps, loss {result['loss_pct']}%")
     else:
         host = input("Server IP [127.0.0.1]: ").strip() or "127.0.0.1"
         message = input("Message [Hello World]: ").strip() or "Hello World"
+        tls = _ask_client_tls()
+        from echo_client import start_echo_client
+
         log_line(f"[Echo] Client -> {host}:{port}, msg='{message}'")
-        start_echo_client(host, port, message)
+        start_echo_client(host, port, message, tls=tls)
+
+def _ask_server_tls():
+    """Asks whether to serve TLS; returns the servers' `tls` argument."""
+    if input("Use TLS with the self-signed test certificate? (y/N): ").strip().lower() != "y":
+        return None
+    from tls import ensure_self_signed
+    return ensure_self_signed()
+
+def _ask_client_tls():
+    """Asks whether to connect with TLS; returns a client context or None."""
+    if input("Connect with TLS (trusting the local test certificate)? (y/N): ").strip().lower() != "y":
+        return None
+    from tls import client_context
+    return client_context()
+
+def run_bulk():
+    """Bulk transfer: sendfile server or recv_into client with GB/s report."""
+    role = input("Run as (s)erver or (c)lient? (s/c): ").strip().lower()
+    port = int(input("Port [7070]: ").strip() or 7070)
+    if role == "s":
+        host = input("Bind Host [0.0.0.0]: ").strip() or "0.0.0.0"
+        root = input("Directory to serve [.]: ").strip() or "."
+        from bulk_server import start_bulk_server
+
+        log_line(f"[Bulk] Server on {host}:{port}, root={root}")
+        start_bulk_server(host, port, root)
+        return
+    host = input("Server IP [127.0.0.1]: ").strip() or "127.0.0.1"
+    size = input("Synthetic size [1G]: ").strip() or "1G"
+    streams = int(input("Parallel streams [1]: ").strip() or 1)
+    from bulk_client import run_transfer as run_bulk_transfer, print_report as print_bulk_report
+
+    result = run_bulk_transfer(host, port, size=size, streams=streams)
+    print_bulk_report(result)
+    log_line(f"[Bulk] {result['request']} x {streams} from {host}:{port}: {result['gb_per_sec']} GB/s")
 
 def run_sntp():
     """Executes Module C: SNTP Time Check."""
     print("\n--- 3. SNTP Time Check (Turkey UTC+3) ---")
-    get_sntp_time()
-    log_line(f"[SNTP] Checked time from pool.ntp.org")
+    mode = input("(q)uery time, run a local (s)erver or (b)enchmark a server? [q]: ").strip().lower()
+    if mode == "s":
+        port = int(input("UDP Port [123]: ").strip() or 123)
+        raw = input("Upstream servers, comma separated (empty = local clock) [pool.ntp.org]: ").strip()
+        upstream = [s.strip() for s in (raw or "pool.ntp.org").split(",") if s.strip()]
+        from sntp_server import start_sntp_server
+
+        log_line(f"[SNTP] Server on udp/{port}, upstream={upstream}")
+        start_sntp_server(port=port, upstream=upstream)
+        return
+    if mode == "b":
+        host = input("Server IP [127.0.0.1]: ").strip() or "127.0.0.1"
+        port = int(input("UDP Port [123]: ").strip() or 123)
+        from sntp_server import run_flood as run_sntp_flood
+
+        result = run_sntp_flood(host=host, port=port)
+        for key, value in result.items():
+            print(f"{key:>18}: {value}")
+        log_line(f"[SNTP] Flood benchmark -> {host}:{port}: {result['requests_per_sec']} req/s")
+        return
+    raw = input("Servers, comma separated [pool.ntp.org]: ").strip() or "pool.ntp.org"
+    servers = [s.strip() for s in raw.split(",") if s.strip()]
+    from sntp_client import get_sntp_time
+
+    get_sntp_time(servers=servers)
+    log_line(f"[SNTP] Checked time from {', '.join(servers)}")
 
 def run_settings():
     """Executes Module E: Socket Settings & Error Management Demo."""
     print("\n--- 4. Socket Settings & Error Management ---")
+    if input("Run the (d)emo or a (t)uning sweep? [d]: ").strip().lower() == "t":
+        run_tuning()
+        return
     host = input("Host [google.com]: ").strip() or "google.com"
     port = int(input("Port [80]: ").strip() or 80)
     timeout = float(input("Timeout (sec) [2.0]: ").strip() or 2.0)
@@ -88,6 +232,7 @@ def run_settings():
     sendbuf = int(input("Send Buffer (bytes) [8192]: ").strip() or 8192)
     nonblocking = input("Use Non-blocking mode? (y/N): ").strip().lower() == "y"
     log_path = str(LOG_DIR / "settings_demo.log")
+    from settings import demo_socket_settings
 
     demo_socket_settings(
         host=host,
@@ -100,6 +245,22 @@ def run_settings():
     )
     log_line("[Settings] Demo completed.")
 
+def run_tuning():
+    """Sweeps socket options against a running echo server and saves the winner."""
+    host = input("Echo server IP [127.0.0.1]: ").strip() or "127.0.0.1"
+    port = int(input("Echo server port [5050]: ").strip() or 5050)
+    raw = input("Payload sizes, comma separated [64,16384]: ").strip() or "64,16384"
+    payloads = [int(x) for x in raw.split(",") if x.strip()]
+    from tuning import sweep as run_tuning_sweep, print_report as print_tuning_report, save_best
+
+    log_line(f"[Settings] Tuning sweep -> {host}:{port}, payloads={payloads}")
+    results = run_tuning_sweep(host, port, payloads=payloads)
+    print_tuning_report(results)
+    name = input("Save best configuration as profile (empty = don't save): ").strip()
+    if name:
+        saved = save_best(results, name)
+        log_line(f"[Settings] Saved socket profile(s): {', '.join(saved)}")
+
 def run_chat_simple():
     """Executes Module D: Simple Chat (Server or Client)."""
     print("\n--- 5. Simple Chat ---")
@@ -108,12 +269,80 @@ def run_chat_simple():
 
     if role == "s":
         host = input("Bind Host [0.0.0.0]: ").strip() or "0.0.0.0"
-        log_line(f"[ChatSimple] Server on {host}:{port}")
-        start_chat_server(host=host, port=port)
+        hub = input("Mode - (s)imple 1:1 or (h)ub for many clients? [s]: ").strip().lower() == "h"
+        mode = "hub" if hub else "simple"
+        workers = int(input("Worker processes (SO_REUSEPORT, headless) [1]: ").strip() or 1)
+        profile = input("Socket profile (empty = none): ").strip() or None
+        tls = _ask_server_tls()
+        hub_options = {}
+        if hub and workers == 1:
+            relay_port = input("Federation relay port (empty = standalone hub): ").strip()
+            if relay_port:
+                peers = input("Peer relay addresses host:port, comma separated (empty = none): ").strip()
+                hub_options = {
+                    "relay_port": int(relay_port),
+                    "peers": [p.strip() for p in peers.split(",") if p.strip()],
+                    "history_dir": f"chat_history_{port}",
+                }
+        from simple_chat_server import start_server as start_chat_server
+
+        log_line(f"[ChatSimple] Server ({mode}) on {host}:{port} (workers={workers}, tls={bool(tls)})")
+        start_chat_server(host=host, port=port, workers=workers, mode=mode, profile=profile, tls=tls,
+                          **hub_options)
     else:
         host = input("Server IP [127.0.0.1]: ").strip() or "127.0.0.1"
+        hub = input("Is the server a hub (resume after reconnects)? (y/N): ").strip().lower() == "y"
+        binary = hub and input("Use binary envelopes? (y/N): ").strip().lower() == "y"
+        tls = _ask_client_tls()
+        from simple_chat_client import start_client as start_chat_client
+
         log_line(f"[ChatSimple] Client -> {host}:{port}")
-        start_chat_client(host=host, port=port)
+        start_chat_client(host=host, port=port, hub=hub, tls=tls, binary=binary)
+
+def build_parser():
+    """Top-level parser; each subcommand's own options are parsed by its module."""
+    ap = argparse.ArgumentParser(
+        description="Network Programming - Project 01 (no arguments = interactive menu)",
+        epilog="Options after a command go to that module, e.g. 'echo serve --help'.",
+    )
+    groups = ap.add_subparsers(dest="group", metavar="COMMAND")
+    for group, actions in COMMANDS.items():
+        if None in actions:
+            groups.add_parser(group, help=actions[None][2], add_help=False)
+            continue
+        gp = groups.add_parser(group, help=f"{group} commands")
+        sub = gp.add_subparsers(dest="action", metavar="ACTION", required=True)
+        for action, (_, _, help_text) in actions.items():
+            sub.add_parser(action, help=help_text, add_help=False)
+    run = groups.add_parser("run", help="Run several servers from a TOML/JSON config (see runner.py)")
+    run.add_argument("config", help="Path to the config file")
+    groups.add_parser("menu", help="Interactive menu (the default)")
+    return ap
+
+
+def run_command(argv) -> int:
+    """Dispatches a subcommand, importing only the module it needs."""
+    args, rest = build_parser().parse_known_args(argv)
+    if args.group == "run":
+        if rest:
+            print(f"Unexpected arguments: {' '.join(rest)}", file=sys.stderr)
+            return 2
+        from runner import run_config
+
+        log_line(f"[Runner] Starting services from {args.config}")
+        try:
+            run_config(args.config)
+        except (OSError, ValueError) as e:
+            print(f"[Runner] ERROR: {e}", file=sys.stderr)
+            return 1
+        return 0
+    if args.group in (None, "menu"):
+        main()
+        return 0
+    module, prefix, _ = COMMANDS[args.group][getattr(args, "action", None)]
+    importlib.import_module(module).main(prefix + rest)
+    return 0
+
 
 def main():
     """Main program loop. Displays the menu and executes choices."""
@@ -137,6 +366,8 @@ def main():
 
 if __name__ == "__main__":
     try:
+        if len(sys.argv) > 1:
+            sys.exit(run_command(sys.argv[1:]))
         main()
     except KeyboardInterrupt:
         print("\n[!] Program was terminated by user (Ctrl+C).")
\ No newline at end of file
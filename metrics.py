@@ -0,0 +1,294 @@
+"""
+This module is the shared metrics subsystem for the servers: counters,
+gauges and latency histograms in one process-wide registry, exported as
+Prometheus text over a small local HTTP endpoint and as periodic JSON
+snapshots on disk.
+
+It is built to stay on in hot loops:
+- Counter.inc() and Gauge.set() are a single attribute update; there is
+  no lock, so concurrent increments from several threads can very rarely
+  lose an update (the servers are single-threaded or nearly so).
+- Gauges can instead take a function that is only called when the
+  metrics are read (active connections, queue depths), which costs
+  nothing on the hot path.
+- Histograms record into histogram.LatencyHistogram (O(1), no
+  allocation) and are exported as Prometheus summaries
+  (p50/p90/p99/p999, _sum, _count).
+
+Metrics are get-or-create by name and labels, so a server can ask for its
+metrics in __init__ without coordinating with anything else:
+
+    accepted = metrics.counter("echo_accepted_total", "Accepted connections", port="5050")
+    accepted.inc()
+
+    metrics.enable(port=9100, path="logs/metrics.json")
+    curl http://127.0.0.1:9100/metrics
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from histogram import LatencyHistogram
+
+SNAPSHOT_INTERVAL = 10.0
+QUANTILES = (("0.5", 50), ("0.9", 90), ("0.99", 99), ("0.999", 99.9))
+
+
+class Counter:
+    """Monotonically increasing value."""
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """Value that goes up and down, or is computed by `fn` when read."""
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    def dec(self, amount=1):
+        self._value -= amount
+
+    @property
+    def value(self):
+        if self.fn is None:
+            return self._value
+        try:
+            return self.fn()
+        except Exception:
+            return float("nan")
+
+
+class Histogram:
+    """Latency distribution (microseconds by convention)."""
+
+    def __init__(self):
+        self.hist = LatencyHistogram()
+
+    def observe(self, value):
+        self.hist.record(value)
+
+    def observe_since(self, start: float):
+        """Records the time since perf_counter() value `start`, in microseconds."""
+        self.hist.record((time.perf_counter() - start) * 1_000_000)
+
+    @property
+    def value(self) -> dict:
+        return self.hist.summary()
+
+
+_KINDS = {Counter: "counter", Gauge: "gauge", Histogram: "summary"}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        return repr(value) if value == value else "NaN"
+    return str(value)
+
+
+class Registry:
+    """Holds every metric of the process, keyed by name and labels."""
+
+    def __init__(self):
+        self._families = {}  # name -> [kind class, help, {labels tuple: metric}]
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = [cls, help_text, {}]
+            elif family[0] is not cls:
+                raise ValueError(f"Metric {name!r} is already registered as a {_KINDS[family[0]]}")
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = cls(**kwargs)
+            elif kwargs.get("fn") is not None:
+                metric.fn = kwargs["fn"]
+            return metric
+
+    def counter(self, name, help_text="", **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text="", fn=None, **labels) -> Gauge:
+        return self._get(Gauge, name, help_text, labels, fn=fn)
+
+    def histogram(self, name, help_text="", **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels)
+
+    def _items(self):
+        with self._lock:
+            return [(name, fam[0], fam[1], list(fam[2].items()))
+                    for name, fam in sorted(self._families.items())]
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, cls, help_text, children in self._items():
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {_KINDS[cls]}")
+            for labels, metric in children:
+                if cls is Histogram:
+                    h = metric.hist
+                    for q, p in QUANTILES:
+                        lines.append(f"{name}{_label_text(labels + (('quantile', q),))} "
+                                     f"{h.percentile(p) if h.count else 'NaN'}")
+                    lines.append(f"{name}_sum{_label_text(labels)} {h.total}")
+                    lines.append(f"{name}_count{_label_text(labels)} {h.count}")
+                else:
+                    lines.append(f"{name}{_label_text(labels)} {_number(metric.value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Plain dict of every metric, e.g. {'echo_accepted_total{port="5050"}': 12}."""
+        return {f"{name}{_label_text(labels)}": metric.value
+                for name, _, _, children in self._items()
+                for labels, metric in children}
+
+
+REGISTRY = Registry()
+
+
+def _reset_after_fork():
+    # A lock held by another thread at fork() time would stay locked forever.
+    REGISTRY._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def counter(name, help_text="", **labels) -> Counter:
+    return REGISTRY.counter(name, help_text, **labels)
+
+
+def gauge(name, help_text="", fn=None, **labels) -> Gauge:
+    return REGISTRY.gauge(name, help_text, fn, **labels)
+
+
+def histogram(name, help_text="", **labels) -> Histogram:
+    return REGISTRY.histogram(name, help_text, **labels)
+
+
+# -- exporters -----------------------------------------------------------------
+
+def _handle_get(self):
+    path = self.path.split("?", 1)[0]
+    if path in ("/", "/metrics"):
+        body = self.registry.render().encode("utf-8")
+        ctype = "text/plain; version=0.0.4; charset=utf-8"
+    elif path == "/metrics.json":
+        body = json.dumps(self.registry.snapshot(), indent=2).encode("utf-8")
+        ctype = "application/json"
+    else:
+        self.send_error(404)
+        return
+    self.send_response(200)
+    self.send_header("Content-Type", ctype)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+def start_http_server(port, host="127.0.0.1", registry=REGISTRY):
+    """Serves /metrics (Prometheus text) and /metrics.json on a daemon thread."""
+    # Imported here: http.server is the slowest import of the package and
+    # most runs never export over HTTP.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handler = type("MetricsHandler", (BaseHTTPRequestHandler,), {
+        "registry": registry,
+        "do_GET": _handle_get,
+        # Scrapes are not worth a log line each.
+        "log_message": lambda self, format, *args: None,
+    })
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[Metrics] Serving http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
+
+
+class SnapshotWriter:
+    """Writes the registry to a JSON file every `interval` seconds (atomic replace)."""
+
+    def __init__(self, path, interval=SNAPSHOT_INTERVAL, registry=REGISTRY):
+        self.path = Path(path)
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def write(self):
+        data = {"ts": time.time(), "pid": os.getpid(), "metrics": self.registry.snapshot()}
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"[Metrics] Snapshot to {self.path} failed: {e}")
+
+    def close(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            try:
+                self.write()
+            except OSError:
+                pass
+
+
+def enable(port=None, path=None, interval=SNAPSHOT_INTERVAL, host="127.0.0.1"):
+    """Starts the HTTP endpoint and/or the snapshot writer; both are optional."""
+    httpd = start_http_server(port, host) if port is not None else None
+    writer = SnapshotWriter(path, interval).start() if path else None
+    return httpd, writer
+
+
+def add_arguments(ap):
+    """Adds the shared --metrics-port / --metrics-file options to a server CLI."""
+    ap.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this local HTTP port")
+    ap.add_argument("--metrics-file", help="Write a JSON metrics snapshot to this file periodically")
+    ap.add_argument("--metrics-interval", type=float, default=SNAPSHOT_INTERVAL,
+                    help="Seconds between metrics snapshots")
+
+
+def enable_from_args(args):
+    return enable(args.metrics_port, args.metrics_file, args.metrics_interval)
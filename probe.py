@@ -0,0 +1,217 @@
+"""
+This script health-checks many backends at once. It takes thousands of
+host:port targets and drives all their TCP connects concurrently through
+one selectors (epoll/kqueue) loop, using the same non-blocking connect
+steps as settings.connect_nonblocking (begin_connect / finish_connect).
+
+- Host names are resolved up front on a small thread pool, so slow DNS
+  does not serialize the probes.
+- At most `concurrency` connects are in flight; the rest wait their turn.
+- Each target records its connect latency, error class (refused, timeout,
+  gaierror, reset, unreachable, other) and the SO_RCVBUF/SO_SNDBUF values
+  the kernel actually applied.
+
+Results can be written as CSV or JSON:
+    python3 probe.py 10.0.0.1:80 10.0.0.2:443 --format csv
+    python3 probe.py --file targets.txt --concurrency 1000 --timeout 1.5 --output probe.json
+"""
+
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import selectors
+import socket
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import apply_socket_settings, begin_connect, classify_error, finish_connect
+
+FIELDS = ("target", "address", "ok", "error_class", "error", "latency_ms", "rcvbuf", "sndbuf")
+ProbeResult = namedtuple("ProbeResult", FIELDS)
+
+
+def parse_target(target: str, default_port: int = 80):
+    host, sep, port = target.strip().rpartition(":")
+    if not sep or not port.isdigit():
+        return target.strip().strip("[]"), default_port
+    return host.strip("[]"), int(port)
+
+
+def _resolve(target, default_port):
+    host, port = parse_target(target, default_port)
+    try:
+        family, type_, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+        return target, (family, type_, proto, address), None
+    except socket.gaierror as e:
+        return target, None, e
+
+
+class Prober:
+    """Runs many non-blocking connects through one selector."""
+
+    def __init__(self, concurrency=500, timeout=2.0, recvbuf=8192, sendbuf=8192, resolvers=32):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.recvbuf = recvbuf
+        self.sendbuf = sendbuf
+        self.resolvers = resolvers
+
+    def _open(self, resolved):
+        family, type_, proto, address = resolved
+        s = socket.socket(family, type_, proto)
+        apply_socket_settings(s, self.timeout, self.recvbuf, self.sendbuf, nonblocking=True)
+        return s, address
+
+    def _result(self, target, s, address, started, error=None):
+        rcvbuf = sndbuf = None
+        if s is not None:
+            try:
+                rcvbuf = s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+                sndbuf = s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+            except OSError:
+                pass
+        return ProbeResult(
+            target=target,
+            address=f"{address[0]}:{address[1]}" if address else None,
+            ok=error is None,
+            error_class=classify_error(error) if error is not None else None,
+            error=str(error) if error is not None else None,
+            latency_ms=round((time.perf_counter() - started) * 1000, 3) if started else None,
+            rcvbuf=rcvbuf,
+            sndbuf=sndbuf,
+        )
+
+    def run(self, targets, default_port=80):
+        """Probes every target; returns results in the order of `targets`."""
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.resolvers) as pool:
+            resolved = list(pool.map(lambda t: _resolve(t, default_port), targets))
+
+        pending = []
+        for target, info, error in resolved:
+            if error is not None:
+                results[target] = self._result(target, None, None, None, error)
+            else:
+                pending.append((target, info))
+        pending.reverse()
+
+        sel = selectors.DefaultSelector()
+        deadlines = []  # (deadline, seq, fileno, sock) min-heap
+        seq = itertools.count()
+        inflight = {}   # fileno -> (target, sock, address, started)
+
+        def finish(fd, error=None):
+            target, s, address, started = inflight.pop(fd)
+            sel.unregister(s)
+            results[target] = self._result(target, s, address, started, error)
+            s.close()
+
+        while pending or inflight:
+            while pending and len(inflight) < self.concurrency:
+                target, info = pending.pop()
+                s = None
+                started = time.perf_counter()
+                try:
+                    s, address = self._open(info)
+                    done = begin_connect(s, address)
+                except OSError as e:
+                    results[target] = self._result(target, s, info[3], started, e)
+                    if s is not None:
+                        s.close()
+                    continue
+                inflight[s.fileno()] = (target, s, address, started)
+                sel.register(s, selectors.EVENT_WRITE)
+                if done:
+                    finish(s.fileno())
+                else:
+                    heapq.heappush(deadlines, (started + self.timeout, next(seq), s.fileno(), s))
+
+            wait = max(0.0, deadlines[0][0] - time.perf_counter()) if deadlines else 0.1
+            for key, _ in sel.select(wait):
+                try:
+                    finish_connect(key.fileobj)
+                    finish(key.fd)
+                except OSError as e:
+                    finish(key.fd, e)
+
+            now = time.perf_counter()
+            while deadlines and deadlines[0][0] <= now:
+                _, _, fd, s = heapq.heappop(deadlines)
+                entry = inflight.get(fd)
+                if entry is not None and entry[1] is s:
+                    finish(fd, TimeoutError(f"connect timed out after {self.timeout}s"))
+
+        sel.close()
+        return [results[t] for t in targets]
+
+
+def probe(targets, **kwargs):
+    """Convenience wrapper: probes `targets` with Prober(**kwargs)."""
+    default_port = kwargs.pop("default_port", 80)
+    return Prober(**kwargs).run(list(targets), default_port)
+
+
+def write_results(results, fmt="csv", out=sys.stdout):
+    if fmt == "json":
+        json.dump([r._asdict() for r in results], out, indent=2)
+        out.write("\n")
+        return
+    writer = csv.writer(out)
+    writer.writerow(FIELDS)
+    for r in results:
+        writer.writerow(r)
+
+
+def summarize(results) -> dict:
+    summary = {"total": len(results), "ok": sum(r.ok for r in results)}
+    for r in results:
+        if not r.ok:
+            summary[r.error_class] = summary.get(r.error_class, 0) + 1
+    return summary
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Parallel TCP connection prober")
+    ap.add_argument("targets", nargs="*", help="host:port targets")
+    ap.add_argument("--file", help="File with one host:port target per line")
+    ap.add_argument("--default-port", type=int, default=80, help="Port for targets without one")
+    ap.add_argument("--concurrency", type=int, default=500, help="Max connects in flight")
+    ap.add_argument("--timeout", type=float, default=2.0, help="Connect timeout (seconds)")
+    ap.add_argument("--recvbuf", type=int, default=8192, help="SO_RCVBUF size (bytes)")
+    ap.add_argument("--sendbuf", type=int, default=8192, help="SO_SNDBUF size (bytes)")
+    ap.add_argument("--format", choices=("csv", "json"), default="csv", help="Output format")
+    ap.add_argument("--output", help="Write results to this file instead of stdout")
+    args = ap.parse_args(argv)
+
+    targets = list(args.targets)
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            targets += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not targets:
+        ap.error("no targets given")
+
+    start = time.perf_counter()
+    results = probe(
+        targets,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        recvbuf=args.recvbuf,
+        sendbuf=args.sendbuf,
+        default_port=args.default_port,
+    )
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            write_results(results, args.format, f)
+    else:
+        write_results(results, args.format)
+    print(f"[Probe] {summarize(results)} in {elapsed:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
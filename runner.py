@@ -0,0 +1,185 @@
+"""
+This module runs several servers in one process from a config file, e.g.
+an async echo server, a chat hub and an SNTP server side by side:
+
+    python3 main.py run services.toml
+
+The config is JSON, or TOML on Python 3.11+ (tomllib):
+
+    [metrics]
+    port = 9100
+
+    [[service]]
+    type = "echo"
+    port = 5050
+    tls = true              # or ["cert.pem", "key.pem"]
+    policy = { max_connections = 1000, msg_rate = 200, idle_timeout = 60 }
+
+    [[service]]
+    type = "chat"
+    port = 6060
+    max_queue = 500
+
+    [[service]]
+    type = "sntp"
+    port = 1123
+    upstream = ["pool.ntp.org"]
+
+In JSON the list is called "services". Keys other than "type" are passed
+to the server's constructor, so they match the module's own options.
+"tls" (echo, chat) is true for the local self-signed test certificate or
+a [certfile, keyfile] pair (see tls.py); "policy" (echo, chat) is a table
+of server_policy.py options (limits and timeouts).
+
+The asyncio servers (echo, chat hub) share one event loop on the main
+thread; the blocking ones (SNTP, bulk, UDP echo) each get a thread. Ctrl+C / SIGTERM
+stops every service gracefully. Server modules are imported only for the
+service types the config uses. Engines that need a terminal or a single
+client ("simple" echo and chat) and worker pools are not available here;
+run those through their own commands.
+"""
+
+import asyncio
+import json
+import signal
+import threading
+from pathlib import Path
+
+# type -> (accepted keys, runs on the event loop)
+SERVICES = {
+    "echo": (("host", "port", "backlog", "bufsize", "profile", "tls", "policy"), True),
+    "chat": (("host", "port", "max_queue", "overflow", "write_high_water",
+              "max_message_size", "history_dir", "replay", "profile", "tls",
+              "node_id", "relay_port", "peers", "policy"), True),
+    "sntp": (("host", "port", "upstream", "sync_interval"), False),
+    "bulk": (("host", "port", "root", "method"), False),
+    "udp_echo": (("host", "port", "bufsize", "batch", "gro"), False),
+}
+METRICS_KEYS = ("port", "file", "interval")
+
+
+def load_config(path) -> dict:
+    """Reads a JSON or TOML config and returns {"metrics": {...}, "services": [...]}."""
+    path = Path(path)
+    if path.suffix == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError("TOML configs need Python 3.11+ (tomllib); use JSON instead") from None
+        with open(path, "rb") as f:
+            raw = tomllib.load(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            raw = json.load(f)
+    services = raw.get("services", raw.get("service", []))
+    config = {"metrics": dict(raw.get("metrics", {})), "services": [dict(s) for s in services]}
+    validate(config)
+    return config
+
+
+def validate(config: dict):
+    """Raises ValueError naming the first bad entry."""
+    unknown = set(config.get("metrics", {})) - set(METRICS_KEYS)
+    if unknown:
+        raise ValueError(f"[metrics]: unknown key(s) {', '.join(sorted(unknown))}")
+    if not config.get("services"):
+        raise ValueError("config defines no services")
+    for i, service in enumerate(config["services"]):
+        kind = service.get("type")
+        if kind not in SERVICES:
+            raise ValueError(f"service #{i + 1}: type must be one of {', '.join(SERVICES)}, got {kind!r}")
+        unknown = set(service) - {"type"} - set(SERVICES[kind][0])
+        if unknown:
+            raise ValueError(f"service #{i + 1} ({kind}): unknown key(s) {', '.join(sorted(unknown))}")
+        tls = service.get("tls")
+        if tls is not None and not isinstance(tls, bool) and not (isinstance(tls, list) and len(tls) == 2):
+            raise ValueError(f"service #{i + 1} ({kind}): tls must be true/false or [certfile, keyfile]")
+        policy = service.get("policy")
+        if policy is not None:
+            from server_policy import OPTIONS
+            if not isinstance(policy, dict) or set(policy) - set(OPTIONS):
+                raise ValueError(f"service #{i + 1} ({kind}): policy must be a table of {', '.join(OPTIONS)}")
+
+
+def _build(service: dict):
+    """Imports the service's module and creates its server object."""
+    options = {k: v for k, v in service.items() if k != "type"}
+    kind = service["type"]
+    if isinstance(options.get("tls"), list):
+        options["tls"] = tuple(options["tls"])
+    if kind == "echo":
+        from echo_server import AsyncEchoServer
+        return AsyncEchoServer(**options)
+    if kind == "chat":
+        from chat_hub import ChatHub
+        return ChatHub(**options)
+    if kind == "sntp":
+        from sntp_server import SNTPServer, DisciplinedClock, SYNC_INTERVAL
+        clock = DisciplinedClock(options.pop("upstream", ()),
+                                 options.pop("sync_interval", SYNC_INTERVAL))
+        return SNTPServer(clock=clock, **options)
+    if kind == "udp_echo":
+        from udp_echo import UDPEchoServer
+        return UDPEchoServer(**options)
+    from bulk_server import BulkServer
+    return BulkServer(**options)
+
+
+async def _serve(looped, threaded):
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+
+    def run_thread(server):
+        try:
+            server.serve_forever()
+        except Exception as e:
+            print(f"[Runner] {type(server).__name__} failed: {e}")
+            loop.call_soon_threadsafe(stopping.set)
+
+    started, tasks, threads = [], [], []
+    try:
+        for server in looped:
+            await server.start()
+            started.append(server)
+        threads = [threading.Thread(target=run_thread, args=(s,), name=type(s).__name__, daemon=True)
+                   for s in threaded]
+        for t in threads:
+            t.start()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # e.g. Windows; Ctrl+C then arrives as KeyboardInterrupt
+        tasks = [asyncio.ensure_future(s.serve_forever()) for s in started]
+        print(f"[Runner] {len(looped) + len(threaded)} service(s) running. Press Ctrl+C to stop.")
+        await stopping.wait()
+    finally:
+        print("[Runner] Stopping services...")
+        for server in threaded:
+            server.stop()
+        for server in started:
+            server.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for t in threads:
+        t.join(timeout=5)
+
+
+def run_config(config):
+    """Runs every service of a config (dict or path) until Ctrl+C / SIGTERM."""
+    if not isinstance(config, dict):
+        config = load_config(config)
+    else:
+        validate(config)
+    m = config.get("metrics", {})
+    if m:
+        import metrics
+        metrics.enable(m.get("port"), m.get("file"), m.get("interval", metrics.SNAPSHOT_INTERVAL))
+    servers = [(_build(s), SERVICES[s["type"]][1]) for s in config["services"]]
+    looped = [s for s, on_loop in servers if on_loop]
+    threaded = [s for s, on_loop in servers if not on_loop]
+    try:
+        asyncio.run(_serve(looped, threaded))
+    except KeyboardInterrupt:
+        print("[Runner] Interrupted by user.")
+        for server in threaded:
+            server.stop()
@@ -0,0 +1,510 @@
+"""
+This module is the policy layer shared by the servers: admission
+control, per-client rate limits and idle/slowloris reaping.
+
+- Admission: at most `max_connections` admitted connections, and at most
+  `max_per_ip` per client address. What happens beyond max_connections
+  is the overflow policy: "reject" closes the new connection at once;
+  "queue" holds up to `max_pending` of them with reading paused and
+  admits them in arrival order as slots free up (and rejects beyond that).
+- Rate limits: one pair of token buckets per client address, shared by
+  all of its connections, for bytes/s and messages/s (each with a burst).
+  A client that overdraws a bucket is not disconnected: reading from it
+  pauses until the debt is repaid, so TCP flow control pushes back on
+  that client instead of it crowding out everyone else. The read that
+  overdraws the bucket is still served, so a client is at most one read
+  (one receive buffer) ahead of its rate.
+- Timeouts: `idle_timeout` closes connections that sent nothing for that
+  long; `frame_timeout` aborts connections that keep a frame unfinished
+  for that long (slowloris: trickling a byte now and then keeps a
+  connection busy forever). Both run on one timer wheel per server that
+  ticks every `tick` seconds, not on a timer per connection; noting
+  activity is a single attribute store. While reading is paused for a
+  rate limit the clocks stand still.
+
+Every rejection, throttle and reap is counted in metrics.py:
+server_rejected_total{reason}, server_throttled_total{kind},
+server_reaped_total{reason}, labelled with the server and its port.
+
+The asyncio engines (async echo, chat hub) call open() from
+connection_made, Slot.on_data() from data_received and close() from
+connection_lost. The blocking engines (simple echo and chat) read
+through guarded_recv_frames() with a socket timeout: it sleeps off a
+throttle and checks the deadlines after every read or timeout.
+
+A policy travels as a plain dict of options (see from_args), so it
+survives the trip to worker processes:
+    python3 echo_server.py --mode async --max-connections 1000 --max-per-ip 50 \\
+        --byte-rate 1M --msg-rate 500 --idle-timeout 60 --frame-timeout 10
+"""
+
+import asyncio
+import math
+import socket
+import time
+from collections import deque
+
+import metrics
+
+DEFAULT_MAX_PENDING = 128
+DEFAULT_TICK = 0.5
+WHEEL_SLOTS = 512
+SWEEP_TICKS = 120
+OPTIONS = ("max_connections", "max_per_ip", "overflow", "max_pending", "byte_rate", "byte_burst",
+           "msg_rate", "msg_burst", "idle_timeout", "frame_timeout", "tick")
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`; taking may run it into debt."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, amount: float, now: float) -> float:
+        """Takes `amount` tokens; returns the seconds until the debt is repaid (0.0 if none)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate) - amount
+        self.stamp = now
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+class TimerWheel:
+    """Hashed timer wheel for deadlines that mostly move later.
+
+    Entries have a deadline() method (absolute time, or None for no
+    deadline) and a `wheel_bucket` attribute. schedule() and cancel() are
+    O(1); advance(now) visits only the slots whose tick has passed. An
+    entry whose deadline moved later since it was scheduled is put back
+    further along instead of expiring, so pushing a deadline back never
+    touches the wheel. Deadlines more than one revolution away simply
+    come around again.
+    """
+
+    def __init__(self, tick=DEFAULT_TICK, slots=WHEEL_SLOTS, now=None):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.current = int((time.monotonic() if now is None else now) / tick)
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.slots)
+
+    def schedule(self, entry, deadline: float):
+        self.cancel(entry)
+        tick = max(math.ceil(deadline / self.tick), self.current + 1)
+        bucket = self.slots[tick % len(self.slots)]
+        bucket.add(entry)
+        entry.wheel_bucket = bucket
+
+    def cancel(self, entry):
+        if entry.wheel_bucket is not None:
+            entry.wheel_bucket.discard(entry)
+            entry.wheel_bucket = None
+
+    def advance(self, now: float) -> list:
+        """Returns the entries whose deadline has passed; reschedules the rest."""
+        target = int(now / self.tick)
+        first = max(self.current + 1, target - len(self.slots) + 1)
+        self.current = target
+        expired = []
+        for tick in range(first, target + 1):
+            index = tick % len(self.slots)
+            bucket = self.slots[index]
+            if not bucket:
+                continue
+            self.slots[index] = set()
+            for entry in bucket:
+                entry.wheel_bucket = None
+                deadline = entry.deadline()
+                if deadline is None:
+                    continue
+                if deadline <= now:
+                    expired.append(entry)
+                else:
+                    self.schedule(entry, deadline)
+        return expired
+
+
+class _Client:
+    """Per-address state: open connections and the rate buckets."""
+
+    __slots__ = ("conns", "bytes", "messages")
+
+    def __init__(self, policy, now):
+        self.conns = 0
+        self.bytes = TokenBucket(policy.byte_rate, policy.byte_burst, now) if policy.byte_rate else None
+        self.messages = TokenBucket(policy.msg_rate, policy.msg_burst, now) if policy.msg_rate else None
+
+    def idle(self, now) -> bool:
+        return (self.conns == 0 and (self.bytes is None or self.bytes.full(now))
+                and (self.messages is None or self.messages.full(now)))
+
+
+class Slot:
+    """One connection's admission, rate and timeout state."""
+
+    __slots__ = ("policy", "ip", "client", "transport", "on_admit", "admitted", "closed", "paused",
+                 "last_active", "frame_started", "wheel_bucket")
+
+    def __init__(self, policy, ip, client, transport, now, on_admit=None):
+        self.policy = policy
+        self.ip = ip
+        self.client = client
+        self.transport = transport
+        self.on_admit = on_admit
+        self.admitted = False
+        self.closed = False
+        self.paused = set()
+        self.last_active = now
+        self.frame_started = None
+        self.wheel_bucket = None
+
+    def deadline(self):
+        p = self.policy
+        deadline = self.last_active + p.idle_timeout if p.idle_timeout else None
+        if p.frame_timeout and self.frame_started is not None:
+            frame_deadline = self.frame_started + p.frame_timeout
+            deadline = frame_deadline if deadline is None else min(deadline, frame_deadline)
+        return deadline
+
+    def expired(self, now: float):
+        """Why the connection is overdue: "slowloris", "idle" or None."""
+        p = self.policy
+        if p.frame_timeout and self.frame_started is not None and now >= self.frame_started + p.frame_timeout:
+            return "slowloris"
+        if p.idle_timeout and now >= self.last_active + p.idle_timeout:
+            return "idle"
+        return None
+
+    def on_data(self, nbytes: int, frames: int, partial: bool) -> float:
+        """Notes one read of `nbytes` that completed `frames` frames (and left a
+        partial one if `partial`). Returns the seconds to stop reading for (0.0 = none)."""
+        now = time.monotonic()
+        self.last_active = now
+        if not partial:
+            self.frame_started = None
+        elif self.frame_started is None:
+            # The deadline may have moved earlier: the only case that touches the wheel.
+            self.frame_started = now
+            if self.policy.frame_timeout and self.policy.wheel is not None:
+                self.policy.wheel.schedule(self, self.deadline())
+        elif frames:
+            self.frame_started = now  # progress: the unfinished frame is a new one
+        delay = 0.0
+        client = self.client
+        if client.bytes is not None:
+            wait = client.bytes.take(nbytes, now)
+            if wait:
+                self.policy.throttled["bytes"].inc()
+                delay = wait
+        if client.messages is not None and frames:
+            wait = client.messages.take(frames, now)
+            if wait:
+                self.policy.throttled["messages"].inc()
+                delay = max(delay, wait)
+        return delay
+
+    def throttle(self, delay: float):
+        """Stops reading for `delay` seconds (asyncio engines)."""
+        self.pause_reading("rate")
+        asyncio.get_running_loop().call_later(delay, self.resume_reading, "rate")
+
+    def wait(self, delay: float):
+        """Sleeps off a throttle (blocking engines)."""
+        time.sleep(delay)
+        self._restart_clocks()
+
+    def _restart_clocks(self):
+        # The client could not send while throttled.
+        now = time.monotonic()
+        self.last_active = now
+        if self.frame_started is not None:
+            self.frame_started = now
+
+    def pause_reading(self, reason: str):
+        if not self.paused and not self.closed:
+            self.transport.pause_reading()
+        self.paused.add(reason)
+
+    def resume_reading(self, reason: str):
+        if reason not in self.paused:
+            return
+        self.paused.discard(reason)
+        if self.closed:
+            return
+        if reason == "rate":
+            self._restart_clocks()
+            if self.policy.wheel is not None and self.admitted:
+                self.policy.wheel.schedule(self, self.deadline())
+        if not self.paused:
+            self.transport.resume_reading()
+
+
+class ServerPolicy:
+    """Admission control, per-address token buckets and timer-wheel reaping for one server."""
+
+    def __init__(self, max_connections=0, max_per_ip=0, overflow="reject", max_pending=DEFAULT_MAX_PENDING,
+                 byte_rate=0, byte_burst=0, msg_rate=0, msg_burst=0, idle_timeout=0, frame_timeout=0,
+                 tick=DEFAULT_TICK, server="server", port=0):
+        if overflow not in ("reject", "queue"):
+            raise ValueError(f"Unknown admission overflow policy: {overflow!r}")
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.overflow = overflow
+        self.max_pending = max_pending
+        self.byte_rate = byte_rate
+        self.byte_burst = byte_burst or byte_rate
+        self.msg_rate = msg_rate
+        self.msg_burst = msg_burst or msg_rate
+        self.idle_timeout = idle_timeout
+        self.frame_timeout = frame_timeout
+        self.tick = tick
+        self.wheel = TimerWheel(tick) if idle_timeout or frame_timeout else None
+        self.clients = {}
+        self.active = 0
+        self.pending = deque()
+        self.waiting = 0
+        self._ticker = None
+        self._ticks = 0
+        labels = {"server": server, "port": port}
+        self.rejected = {reason: metrics.counter("server_rejected_total", "Connections refused by admission control",
+                                                 reason=reason, **labels)
+                         for reason in ("max_connections", "max_per_ip", "queue_full")}
+        self.queued = metrics.counter("server_queued_total", "Connections held until a slot was free", **labels)
+        self.throttled = {kind: metrics.counter("server_throttled_total", "Reads paused by a client's rate limit",
+                                                kind=kind, **labels)
+                          for kind in ("bytes", "messages")}
+        self.reaped = {reason: metrics.counter("server_reaped_total", "Connections closed by a timeout",
+                                               reason=reason, **labels)
+                       for reason in ("idle", "slowloris")}
+        metrics.gauge("server_admitted_connections", "Connections holding a slot", fn=lambda: self.active, **labels)
+        metrics.gauge("server_pending_connections", "Connections waiting for a slot", fn=lambda: self.waiting, **labels)
+
+    @classmethod
+    def from_spec(cls, spec, server="server", port=0):
+        """A policy from an options dict (see from_args), or None for no policy."""
+        if not spec:
+            return None
+        unknown = set(spec) - set(OPTIONS)
+        if unknown:
+            raise ValueError(f"unknown policy option(s): {', '.join(sorted(unknown))}")
+        return cls(**spec, server=server, port=port)
+
+    def describe(self) -> str:
+        parts = []
+        if self.max_connections:
+            parts.append(f"max_connections={self.max_connections} ({self.overflow})")
+        if self.max_per_ip:
+            parts.append(f"max_per_ip={self.max_per_ip}")
+        if self.byte_rate:
+            parts.append(f"byte_rate={self.byte_rate:g}/s")
+        if self.msg_rate:
+            parts.append(f"msg_rate={self.msg_rate:g}/s")
+        if self.idle_timeout:
+            parts.append(f"idle_timeout={self.idle_timeout:g}s")
+        if self.frame_timeout:
+            parts.append(f"frame_timeout={self.frame_timeout:g}s")
+        return ", ".join(parts) or "no limits"
+
+    @property
+    def socket_timeout(self):
+        """Timeout for blocking sockets, so a stuck recv() still gets checked."""
+        timeouts = [t for t in (self.idle_timeout, self.frame_timeout) if t]
+        return min(timeouts) if timeouts else None
+
+    # -- admission -----------------------------------------------------------
+
+    def open(self, ip: str, transport=None, on_admit=None):
+        """Admits (or queues) a new connection; returns its Slot, or None if it was refused.
+
+        on_admit() is called once the connection holds a slot (at once, or
+        when it leaves the queue). A refused connection's transport is
+        closed here; blocking callers (transport=None) close the socket
+        themselves and never queue.
+        """
+        now = time.monotonic()
+        client = self.clients.get(ip)
+        if client is None:
+            client = self.clients[ip] = _Client(self, now)
+        if self.max_per_ip and client.conns >= self.max_per_ip:
+            return self._refuse(ip, client, transport, "max_per_ip")
+        slot = Slot(self, ip, client, transport, now, on_admit)
+        client.conns += 1
+        if self.max_connections and self.active >= self.max_connections:
+            if self.overflow != "queue" or transport is None or self.waiting >= self.max_pending:
+                client.conns -= 1
+                return self._refuse(ip, client, transport,
+                                    "queue_full" if self.overflow == "queue" else "max_connections")
+            slot.pause_reading("admission")
+            self.pending.append(slot)
+            self.waiting += 1
+            self.queued.inc()
+            return slot
+        self._admit(slot, now)
+        return slot
+
+    def _refuse(self, ip, client, transport, reason):
+        self.rejected[reason].inc()
+        if client.idle(time.monotonic()):
+            del self.clients[ip]
+        if transport is not None:
+            transport.close()
+        return None
+
+    def _admit(self, slot, now):
+        self.active += 1
+        slot.admitted = True
+        slot.last_active = now
+        if self.wheel is not None and self.idle_timeout:
+            self.wheel.schedule(slot, slot.deadline())
+        if "admission" in slot.paused:
+            slot.resume_reading("admission")
+        if slot.on_admit is not None:
+            slot.on_admit()
+
+    def close(self, slot):
+        """Releases the connection's slot (and admits the next queued one)."""
+        if slot is None or slot.closed:
+            return
+        slot.closed = True
+        if self.wheel is not None:
+            self.wheel.cancel(slot)
+        slot.client.conns -= 1
+        if slot.client.conns == 0 and slot.client.idle(time.monotonic()):
+            self.clients.pop(slot.ip, None)
+        if not slot.admitted:
+            self.waiting -= 1
+            return
+        self.active -= 1
+        while self.pending and (not self.max_connections or self.active < self.max_connections):
+            waiting = self.pending.popleft()
+            if not waiting.closed:
+                self.waiting -= 1
+                self._admit(waiting, time.monotonic())
+
+    # -- reaping ---------------------------------------------------------------
+
+    def start(self):
+        """Starts the wheel's tick on the running loop (asyncio engines)."""
+        if self.wheel is not None and self._ticker is None:
+            self._ticker = asyncio.get_running_loop().call_later(self.tick, self._on_tick)
+
+    def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+
+    def _on_tick(self):
+        now = time.monotonic()
+        for slot in self.wheel.advance(now):
+            if slot.closed or "rate" in slot.paused:
+                continue  # resume_reading() puts throttled connections back on the wheel
+            reason = slot.expired(now) or "idle"
+            self.reaped[reason].inc()
+            if reason == "slowloris":
+                slot.transport.abort()
+            else:
+                slot.transport.close()
+        self._ticks += 1
+        if self._ticks % SWEEP_TICKS == 0:
+            self.clients = {ip: c for ip, c in self.clients.items() if not c.idle(now)}
+        self._ticker = asyncio.get_running_loop().call_later(self.tick, self._on_tick)
+
+    def count_reap(self, reason: str):
+        """Counts a reap done by a blocking engine."""
+        self.reaped[reason].inc()
+
+    def snapshot(self) -> dict:
+        return {
+            "admitted": self.active,
+            "pending": self.waiting,
+            "rejected": sum(c.value for c in self.rejected.values()),
+            "throttled": sum(c.value for c in self.throttled.values()),
+            "reaped_idle": self.reaped["idle"].value,
+            "reaped_slowloris": self.reaped["slowloris"].value,
+        }
+
+
+class Reaped(Exception):
+    """Raised by guarded_recv_frames() when a connection outlived a deadline."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"{reason} timeout")
+        self.reason = reason
+
+
+def guarded_recv_frames(sock, decoder, slot):
+    """framing.recv_frames() for blocking engines under a policy.
+
+    The socket needs a timeout (see ServerPolicy.socket_timeout), so the
+    deadlines are checked even while the peer sends nothing. Returns the
+    frames, [] when the peer closed, or raises Reaped; rate-limit debt
+    is slept off before returning.
+    """
+    frames = list(decoder.frames())
+    if frames:
+        return frames
+    while True:
+        try:
+            n = decoder.recv_into(sock)
+        except socket.timeout:
+            n = None
+        if n == 0:
+            return []
+        if n:
+            frames = list(decoder.frames())
+            delay = slot.on_data(n, len(frames), decoder.buffered > 0)
+            if delay:
+                slot.wait(delay)
+            if frames:
+                return frames
+        reason = slot.expired(time.monotonic())
+        if reason:
+            slot.policy.count_reap(reason)
+            raise Reaped(reason)
+
+
+def add_arguments(ap):
+    from bulk_server import parse_size
+
+    group = ap.add_argument_group("server policy (see server_policy.py)")
+    group.add_argument("--max-connections", type=int, default=0, help="Max admitted connections (0 = no limit)")
+    group.add_argument("--max-per-ip", type=int, default=0, help="Max connections per client address (0 = no limit)")
+    group.add_argument("--admission", choices=("reject", "queue"), default="reject",
+                       help="Beyond --max-connections: close new connections, or hold them until a slot frees")
+    group.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                       help="Connections held with --admission queue")
+    group.add_argument("--byte-rate", type=parse_size, default=0, help="Bytes/s per client address, e.g. 1M")
+    group.add_argument("--byte-burst", type=parse_size, default=0, help="Byte bucket size (default: one second)")
+    group.add_argument("--msg-rate", type=float, default=0, help="Messages/s per client address")
+    group.add_argument("--msg-burst", type=float, default=0, help="Message bucket size (default: one second)")
+    group.add_argument("--idle-timeout", type=float, default=0, help="Close connections silent this long (s)")
+    group.add_argument("--frame-timeout", type=float, default=0,
+                       help="Abort connections that leave a frame unfinished this long (s, slowloris)")
+
+
+def from_args(args):
+    """The policy options given on the command line, as a dict (None if there are none)."""
+    spec = {
+        "max_connections": args.max_connections,
+        "max_per_ip": args.max_per_ip,
+        "max_pending": args.max_pending if args.admission == "queue" else 0,
+        "byte_rate": args.byte_rate,
+        "byte_burst": args.byte_burst,
+        "msg_rate": args.msg_rate,
+        "msg_burst": args.msg_burst,
+        "idle_timeout": args.idle_timeout,
+        "frame_timeout": args.frame_timeout,
+    }
+    spec = {key: value for key, value in spec.items() if value}
+    if not spec:
+        return None
+    if args.admission == "queue":
+        spec["overflow"] = "queue"
+    return spec
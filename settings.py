@@ -6,6 +6,10 @@ and blocking vs. non-blocking connection modes.
 
 It is designed to catch and log common network errors such as timeouts,
 connection refused, and address resolution failures.
+
+Named socket profiles (buffer sizes plus TCP_NODELAY / TCP_QUICKACK /
+TCP_CORK) are stored in socket_profiles.json, usually written by the
+tuning sweep in tuning.py, and applied with apply_profile().
 This module can be run standalone using command-line arguments or
 imported by main.py.
 """
@@ -13,10 +17,15 @@ imported by main.py.
 import argparse
 import socket
 import errno
+import json
 import logging
 import select
 from pathlib import Path
 
+PROFILES_FILE = "socket_profiles.json"
+# Boolean profile keys -> TCP-level socket options (Linux-only ones may be missing).
+TCP_FLAGS = {"nodelay": "TCP_NODELAY", "quickack": "TCP_QUICKACK", "cork": "TCP_CORK"}
+
 def setup_logger(log_path: str | None):
     if not log_path:
         logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -38,23 +47,96 @@ def apply_socket_settings(s: socket.socket, timeout: float, recvbuf: int, sendbu
     s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sendbuf)
     s.setblocking(not nonblocking)
 
+def load_profiles(path=PROFILES_FILE) -> dict:
+    """Returns every saved socket profile (name -> options), {} if none were saved."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def load_profile(name: str, path=PROFILES_FILE) -> dict:
+    profiles = load_profiles(path)
+    if name not in profiles:
+        raise ValueError(f"Unknown socket profile {name!r} (saved: {', '.join(profiles) or 'none'})")
+    return profiles[name]
+
+def save_profile(name: str, profile: dict, path=PROFILES_FILE):
+    profiles = load_profiles(path)
+    profiles[name] = profile
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, indent=2)
+
+def apply_profile(s, profile, path=PROFILES_FILE, cork=False) -> dict:
+    """Applies a tuning profile (a saved name or an options dict) to a TCP socket.
+
+    rcvbuf/sndbuf of 0 keep the kernel default (and its autotuning). The
+    blocking mode is left alone: asyncio sockets must stay non-blocking, so
+    a profile's "nonblocking" entry is only used by clients that honour it.
+    TCP_QUICKACK is not sticky on Linux; it holds until the next delayed ACK.
+    TCP_CORK is skipped unless `cork` is set (only the tuning sweep does):
+    nothing uncorks a long-lived socket, so every small reply would wait
+    for the ~200 ms cork timeout.
+    Returns the options that were actually set.
+    """
+    if isinstance(profile, str):
+        profile = load_profile(profile, path)
+    applied = {}
+    for key, opt in (("rcvbuf", socket.SO_RCVBUF), ("sndbuf", socket.SO_SNDBUF)):
+        if profile.get(key):
+            s.setsockopt(socket.SOL_SOCKET, opt, profile[key])
+            applied[key] = profile[key]
+    for key, name in TCP_FLAGS.items():
+        if key == "cork" and not cork:
+            continue
+        if key in profile and hasattr(socket, name):
+            s.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), int(bool(profile[key])))
+            applied[key] = bool(profile[key])
+    return applied
+
 def connect_blocking(s: socket.socket, host: str, port: int):
     print_and_log(f"[Connect] (blocking) -> {host}:{port}")
     s.connect((host, port))
 
-def connect_nonblocking(s: socket.socket, host: str, port: int, timeout: float):
-    print_and_log(f"[Connect] (non-blocking) -> {host}:{port} with poll timeout={timeout}s")
-    err = s.connect_ex((host, port))
+def begin_connect(s: socket.socket, address) -> bool:
+    """Starts a non-blocking connect; True if it completed immediately."""
+    err = s.connect_ex(address)
     if err in (0, errno.EISCONN):
-        return
+        return True
     if err not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
         raise OSError(err, f"connect_ex failed: {errno.errorcode.get(err, err)}")
+    return False
+
+def finish_connect(s: socket.socket):
+    """Raises the pending connect error (if any) once the socket is writable."""
+    e = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if e != 0:
+        raise OSError(e, f"SO_ERROR after select: {errno.errorcode.get(e, e)}")
+
+def classify_error(e: BaseException) -> str:
+    """Maps a connect failure to a short error class used in reports."""
+    if isinstance(e, socket.gaierror):
+        return "gaierror"
+    if isinstance(e, (TimeoutError, socket.timeout)) or getattr(e, "errno", None) == errno.ETIMEDOUT:
+        return "timeout"
+    code = getattr(e, "errno", None)
+    if isinstance(e, ConnectionRefusedError) or code == errno.ECONNREFUSED:
+        return "refused"
+    if isinstance(e, ConnectionResetError) or code == errno.ECONNRESET:
+        return "reset"
+    if code in (errno.EHOSTUNREACH, errno.ENETUNREACH):
+        return "unreachable"
+    return "other"
+
+def connect_nonblocking(s: socket.socket, host: str, port: int, timeout: float):
+    print_and_log(f"[Connect] (non-blocking) -> {host}:{port} with poll timeout={timeout}s")
+    if begin_connect(s, (host, port)):
+        return
     
     r, w, x = select.select([], [s], [s], timeout)
     if s in w:
-        e = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
-        if e != 0:
-            raise OSError(e, f"SO_ERROR after select: {errno.errorcode.get(e, e)}")
+        finish_connect(s)
         return
     raise TimeoutError(f"Non-blocking connect timed out after {timeout}s")
 
@@ -113,7 +195,7 @@ def demo_socket_settings(host: str, port: int, timeout: float, recvbuf: int, sen
         finally:
             print_and_log("=== Demo finished ===")
 
-def main():
+def main(argv=None):
     ap = argparse.ArgumentParser(description="E. Error Management and Settings Module")
     ap.add_argument("--host", default="1.1.1.1", help="Target host/IP")
     ap.add_argument("--port", type=int, default=80, help="Target port")
@@ -122,7 +204,7 @@ def main():
     ap.add_argument("--sendbuf", type=int, default=8192, help="SO_SNDBUF size (bytes)")
     ap.add_argument("--nonblocking", action="store_true", help="Use non-blocking connect")
     ap.add_argument("--log", help="Optional log file path (e.g., logs/settings.log)")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     demo_socket_settings(
         host=args.host,
@@ -1,57 +1,102 @@
 """
-This script implements a multi-threaded TCP chat client.
+This script implements the terminal TCP chat client.
 It connects to a specified server and allows the user to send
-and receive messages concurrently by using two threads:
-- The main thread handles user input (sending messages).
-- A background thread handles incoming messages from the server.
+and receive messages concurrently. The networking is done by the
+asyncio client core in chat_client.py:
+- A background thread reads the user's input lines and hands them
+  to the event loop, which queues them for sending.
+- The event loop prints incoming messages, and reconnects with
+  backoff when an established connection drops. If the first connect
+  fails the client reports the error and exits, unless --hub is given
+  (then it keeps retrying until the hub comes up).
+
+With --hub (chat hub servers) the client resumes after a reconnect
+from the last message it saw. Messages travel as length-prefixed frames
+(see framing.py); with --binary a hub sends binary envelopes instead of
+text (see chat_envelope.py). A socket profile saved by tuning.py can be
+applied before connecting, and --tls connects over TLS (see tls.py).
 """
 
-import socket
+import argparse
+import asyncio
 import threading
 
-def handle_receive(sock):
-    """Thread to continuously listen for messages from the server."""
+from chat_client import ChatClient
+
+def _read_input(loop, lines):
+    """Thread that feeds the user's input lines to the event loop (None = end of input)."""
     while True:
         try:
-            data = sock.recv(1024)
-            if not data:
-                print("\n[Client] Server disconnected.")
+            line = input()
+        except (EOFError, KeyboardInterrupt):
+            line = None
+        try:
+            loop.call_soon_threadsafe(lines.put_nowait, line)
+        except RuntimeError:
+            break  # the chat already ended and closed the loop
+        if line is None:
+            break
+
+async def _chat(host, port, profile, hub, tls, binary):
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+
+    def on_message(text, seq):
+        print(f"\n[Server]: {text}")
+        print("[You]: ", end="", flush=True)
+
+    def on_status(text):
+        print(f"\n[Client] {text[0].upper()}{text[1:]}.")
+
+    client = ChatClient(host, port, on_message=on_message, on_status=on_status,
+                        resume=hub, profile=profile, tls=tls, binary=binary, fail_fast=not hub)
+    runner = asyncio.ensure_future(client.run())
+    if not hub:
+        connected = asyncio.ensure_future(client.wait_connected())
+        await asyncio.wait((runner, connected), return_when=asyncio.FIRST_COMPLETED)
+        if runner.done():
+            connected.cancel()
+            runner.result()  # raises the connect error
+    threading.Thread(target=_read_input, args=(loop, lines), daemon=True).start()
+    print("You can type 'exit' or Ctrl+C to quit.")
+    print("[You]: ", end="", flush=True)
+    try:
+        while not runner.done():
+            line = await lines.get()
+            if line is None or line.strip().lower() in ("exit", "quit"):
+                print("[Client] Chat ended.")
                 break
-            print(f"\n[Server]: {data.decode('utf-8', errors='replace')}")
+            if line.strip():
+                client.send(line.strip())
             print("[You]: ", end="", flush=True)
-        except:
-            break
+    finally:
+        await client.close()
+        await asyncio.gather(runner, return_exceptions=True)
 
-def start_client(host="127.0.0.1", port=6060):
+def start_client(host="127.0.0.1", port=6060, profile=None, hub=False, tls=None, binary=False):
     """Concurrent chat client (write and receive at the same time)."""
     try:
-        with socket.create_connection((host, port)) as s:
-            print(f"[Client] Connected to {host}:{port}")
-            print("You can type 'exit' or Ctrl+C to quit.")
-
-            t = threading.Thread(target=handle_receive, args=(s,), daemon=True)
-            t.start()
-
-            while True:
-                msg = input("[You]: ").strip()
-                if msg.lower() in ("exit", "quit"):
-                    print("[Client] Chat ended.")
-                    break
-                
-                if t.is_alive():
-                    s.sendall(msg.encode("utf-8"))
-                else:
-                    print("[Client] Server is not available. Cannot send message.")
-                    break
-
+        asyncio.run(_chat(host, port, profile, hub, tls, binary))
     except KeyboardInterrupt:
         print("\n[Client] Interrupted by user.")
     except ConnectionRefusedError:
         print(f"[Client] ERROR: Connection refused. Is the server running at {host}:{port}?")
-    except Exception as e:
+    except OSError as e:
         print(f"[Client] ERROR: {e}")
     finally:
         print("[Client] Connection closed.")
 
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="D. Simple Chat Client")
+    ap.add_argument("--host", default="127.0.0.1", help="Server host")
+    ap.add_argument("--port", type=int, default=6060, help="Server port")
+    ap.add_argument("--profile", help="Saved socket profile to apply before connecting (see tuning.py)")
+    ap.add_argument("--hub", action="store_true", help="Server is a chat hub: resume from the last message after reconnects")
+    ap.add_argument("--binary", action="store_true", help="Ask the hub for binary envelopes (see chat_envelope.py)")
+    from tls import add_client_arguments, client_from_args
+    add_client_arguments(ap)
+    args = ap.parse_args(argv)
+    start_client(args.host, args.port, args.profile, args.hub, client_from_args(args), args.binary)
+
 if __name__ == "__main__":
-    start_client()
\ No newline at end of file
+    main()
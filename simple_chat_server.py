@@ -5,77 +5,284 @@ and then allows the server operator to send and receive messages
 concurrently by using two threads:
 - The main thread handles user input (sending messages).
 - A background thread handles incoming messages from the client.
+
+Messages travel as length-prefixed frames (see framing.py), so one message
+always arrives as one message, whatever TCP does to the byte stream.
+
+In "hub" mode the server instead becomes a broadcast chat hub for any
+number of clients, with rooms and bounded per-client queues (see
+chat_hub.py).
+
+When started with workers > 1, the server is pre-forked into several
+processes sharing the port via SO_REUSEPORT (see worker_pool.py). Worker
+processes have no terminal, so each one runs headless: it accepts clients
+one after another and logs what they send.
+
+A socket profile saved by tuning.py can be applied to client connections
+with --profile, and --tls serves TLS in every mode (see tls.py). Limits and
+timeouts (--max-connections, --byte-rate, --idle-timeout, ...) apply in
+every mode too (see server_policy.py). Accepts, messages, bytes, recv/send calls and per-message
+handling latency are counted in metrics.py (--metrics-port / --metrics-file).
 """
+import argparse
 import socket
 import threading
+import time
 from datetime import datetime
 
+import metrics
+
+from chat_store import ChatStore, StoreLocked
+from framing import FrameDecoder, recv_frames, send_frame
+from log_writer import get_writer
+from server_policy import Reaped, ServerPolicy, guarded_recv_frames
+from settings import apply_profile, load_profile
+
 CHAT_LOG_FILE = "chat_history.log" 
+CHAT_LOG_MAX_BYTES = 50 * 1024 * 1024
+HISTORY_DIR = "chat_history"
+
+M_ACCEPTED = metrics.counter("chat_accepted_total", "Accepted chat connections")
+M_ACTIVE = metrics.gauge("chat_active_connections", "Open chat connections")
+M_MESSAGES_IN = metrics.counter("chat_messages_in_total", "Messages received from clients")
+M_BYTES_IN = metrics.counter("chat_bytes_in_total", "Message bytes received from clients")
+M_MESSAGES_OUT = metrics.counter("chat_messages_out_total", "Messages sent by the operator")
+M_RECV_CALLS = metrics.counter("chat_recv_calls_total", "Socket reads")
+M_SEND_CALLS = metrics.counter("chat_send_calls_total", "Socket writes")
+M_HANDLE_US = metrics.histogram("chat_message_handle_us", "Time to log and store a received batch (us)")
+
+def chat_log_writer():
+    return get_writer(CHAT_LOG_FILE, max_bytes=CHAT_LOG_MAX_BYTES, backup_count=5)
 
 def log_message(message: str):
+    """Prints the entry and hands it to the background history writer (never blocks on disk)."""
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     log_entry = f"[{timestamp}] {message}"
     
     print(log_entry)
-    
+    chat_log_writer().write(log_entry)
+
+def open_history(history_dir=HISTORY_DIR):
+    """Opens the indexed history store, or returns None if another process owns it."""
+    if not history_dir:
+        return None
     try:
-        with open(CHAT_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(log_entry + "\n")
-    except IOError as e:
-        print(f"!!! CRITICAL: Failed to write to log file {CHAT_LOG_FILE}: {e} !!!")
+        return ChatStore(history_dir)
+    except StoreLocked as e:
+        log_message(f"[Server] History store disabled: {e}")
+        return None
 
-def handle_receive(conn, addr): 
+def handle_receive(conn, addr, stats=None, stats_hook=None, prompt=True, store=None, slot=None):
+    decoder = FrameDecoder()
+    reads = 0
     while True:
         try:
-            data = conn.recv(1024)
-            if not data:
+            if slot is None:
+                frames = recv_frames(conn, decoder)
+            else:
+                frames = guarded_recv_frames(conn, decoder, slot)
+            M_RECV_CALLS.inc(decoder.recv_calls - reads)
+            reads = decoder.recv_calls
+            if not frames:
                 log_message(f"[Server] Client {addr} disconnected.")
                 break
             
-            log_message(f"[Client {addr}]: {data.decode('utf-8', errors='replace')}")
-            
-            print("[You]: ", end="", flush=True)
+            start = time.perf_counter()
+            for frame in frames:
+                text = bytes(frame).decode('utf-8', errors='replace')
+                log_message(f"[Client {addr}]: {text}")
+                if store is not None:
+                    store.append(f"{addr[0]}:{addr[1]}", text)
+            M_HANDLE_US.observe_since(start)
+            M_MESSAGES_IN.inc(len(frames))
+            M_BYTES_IN.inc(sum(len(f) for f in frames))
+            if stats is not None:
+                stats["messages_in"] += len(frames)
+                stats["bytes_in"] += sum(len(f) for f in frames)
+                if stats_hook:
+                    stats_hook(stats)
+
+            if prompt:
+                print("[You]: ", end="", flush=True)
             
+        except Reaped as e:
+            log_message(f"[Server] Closing {addr}: {e}.")
+            break
         except: 
             log_message(f"[Server] Receive thread for {addr} stopping due to error.")
             break
 
-def start_server(host="0.0.0.0", port=6060):
+def _wrap_tls(conn, ssl_context, addr):
+    conn = ssl_context.wrap_socket(conn, server_side=True)
+    log_message(f"[Server] TLS with {addr}: {conn.version()} {conn.cipher()[0]}")
+    return conn
+
+def _admit(conn, addr, policy):
+    """Returns (admitted, slot); slot is None without a policy. Refused connections are closed."""
+    if policy is None:
+        return True, None
+    slot = policy.open(addr[0])
+    if slot is None:
+        log_message(f"[Server] Refused {addr} (server policy).")
+        conn.close()
+        return False, None
+    conn.settimeout(policy.socket_timeout)
+    return True, slot
+
+def serve_headless(srv, stats_hook=None, store=None, profile=None, ssl_context=None, policy=None):
+    """Accepts clients one after another and logs their messages (no operator input)."""
+    stats = {"accepted": 0, "active": 0, "messages_in": 0, "bytes_in": 0}
+    while True:
+        conn, addr = srv.accept()
+        log_message(f"[Server] Connected by {addr}")
+        admitted, slot = _admit(conn, addr, policy)
+        if not admitted:
+            continue
+        if profile:
+            apply_profile(conn, profile)
+        if ssl_context:
+            try:
+                conn = _wrap_tls(conn, ssl_context, addr)
+            except OSError as e:
+                log_message(f"[Server] TLS handshake with {addr} failed: {e}")
+                conn.close()
+                if policy is not None:
+                    policy.close(slot)
+                continue
+        M_ACCEPTED.inc()
+        M_ACTIVE.inc()
+        stats["accepted"] += 1
+        stats["active"] = 1
+        if stats_hook:
+            stats_hook(stats)
+        with conn:
+            handle_receive(conn, addr, stats, stats_hook, prompt=False, store=store, slot=slot)
+        if policy is not None:
+            policy.close(slot)
+        M_ACTIVE.dec()
+        stats["active"] = 0
+        if stats_hook:
+            stats_hook(stats)
+
+def start_server(host="0.0.0.0", port=6060, workers=1, reuse_port=False, stats_hook=None,
+                 mode="simple", profile=None, tls=None, policy=None, **hub_options):
+    if workers > 1:
+        from worker_pool import run_worker_pool
+        run_worker_pool(
+            start_server,
+            dict(hub_options, host=host, port=port, mode=mode, profile=profile, tls=tls, policy=policy),
+            workers,
+            name="Chat Pool",
+        )
+        return
+    if mode == "hub":
+        from chat_hub import run_hub
+        run_hub(host=host, port=port, reuse_port=reuse_port, stats_hook=stats_hook,
+                profile=profile, tls=tls, policy=policy, **hub_options)
+        return
+    if mode != "simple":
+        raise ValueError(f"Unknown chat server mode: {mode!r}")
+
+    if isinstance(profile, str):
+        profile = load_profile(profile)
+    ssl_context = None
+    if tls:
+        from tls import server_context
+        ssl_context = server_context(tls)
+    store = open_history()
+    policy = ServerPolicy.from_spec(policy, "chat", port)
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
             srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             srv.bind((host, port))
             srv.listen(1)
             
             log_message(f"[Server] Listening on {host}:{port}")
+            if reuse_port:
+                serve_headless(srv, stats_hook, store, profile, ssl_context, policy)
+                return
             log_message("[Server] Waiting for a connection...")
 
             conn, addr = srv.accept()
             log_message(f"[Server] Connected by {addr}")
+            admitted, slot = _admit(conn, addr, policy)
+            if not admitted:
+                return
+            try:
+                if profile:
+                    apply_profile(conn, profile)
+                if ssl_context:
+                    conn = _wrap_tls(conn, ssl_context, addr)
+                M_ACCEPTED.inc()
+                M_ACTIVE.inc()
             
-            with conn:
-                t = threading.Thread(target=handle_receive, args=(conn, addr), daemon=True)
-                t.start()
-
-                while True:
-                    msg = input("[You]: ").strip()
-                    if msg.lower() in ("exit", "quit"):
-                        log_message("[Server] Chat ended by user.")
-                        break
+                with conn:
+                    t = threading.Thread(
+                        target=handle_receive, args=(conn, addr), kwargs={"store": store, "slot": slot}, daemon=True
+                    )
+                    t.start()
+
+                    while True:
+                        msg = input("[You]: ").strip()
+                        if msg.lower() in ("exit", "quit"):
+                            log_message("[Server] Chat ended by user.")
+                            break
                     
-                    if t.is_alive():
-                        conn.sendall(msg.encode("utf-8"))
-                        log_message(f"[Server (You)]: {msg}")
-                    else:
-                        log_message("[Server] Client is not connected. Cannot send message.")
-                        break
+                        if t.is_alive():
+                            M_SEND_CALLS.inc(send_frame(conn, msg.encode("utf-8")))
+                            M_MESSAGES_OUT.inc()
+                            log_message(f"[Server (You)]: {msg}")
+                            if store is not None:
+                                store.append("server", msg)
+                        else:
+                            log_message("[Server] Client is not connected. Cannot send message.")
+                            break
+                M_ACTIVE.dec()
+            finally:
+                if policy is not None:
+                    policy.close(slot)
 
     except KeyboardInterrupt:
         log_message("\n[Server] Interrupted by user.")
     except Exception as e:
         log_message(f"[Server] ERROR: {e}")
     finally:
+        if store is not None:
+            store.close()
         log_message("[Server] Connection closed.")
 
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="D. Simple Chat Server")
+    ap.add_argument("--host", default="0.0.0.0", help="Bind host")
+    ap.add_argument("--port", type=int, default=6060, help="Bind port")
+    ap.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port (SO_REUSEPORT)")
+    ap.add_argument("--mode", choices=("simple", "hub"), default="simple", help="One operator-paired client, or a many-client hub")
+    ap.add_argument("--max-queue", type=int, default=1000, help="Hub: max queued messages per slow client")
+    ap.add_argument("--overflow", choices=("drop", "disconnect"), default="drop", help="Hub: what to do when a client's queue is full")
+    ap.add_argument("--history-dir", default=HISTORY_DIR, help="Hub: history store directory (one per instance)")
+    ap.add_argument("--relay-port", type=int, help="Hub: accept links from other hubs on this port (see chat_relay.py)")
+    ap.add_argument("--peer", action="append", default=[], metavar="HOST:PORT", help="Hub: relay port of another hub to link to (repeatable)")
+    ap.add_argument("--node-id", help="Hub: this hub's name in the federation (default: hostname:port)")
+    ap.add_argument("--profile", help="Saved socket profile to apply to client connections (see tuning.py)")
+    from tls import add_server_arguments, server_spec
+    add_server_arguments(ap)
+    import server_policy
+    server_policy.add_arguments(ap)
+    metrics.add_arguments(ap)
+    args = ap.parse_args(argv)
+    metrics.enable_from_args(args)
+
+    hub_options = {}
+    if args.mode == "hub":
+        hub_options = {"max_queue": args.max_queue, "overflow": args.overflow, "history_dir": args.history_dir}
+        if args.relay_port is not None or args.peer:
+            if args.workers > 1:
+                ap.error("a federated hub runs as a single process (drop --workers)")
+            hub_options.update(relay_port=args.relay_port, peers=args.peer, node_id=args.node_id)
+    start_server(host=args.host, port=args.port, workers=args.workers, mode=args.mode,
+                 profile=args.profile, tls=server_spec(args), policy=server_policy.from_args(args), **hub_options)
+
 if __name__ == "__main__":
-    start_server()
+    main()
@@ -1,68 +1,82 @@
 """
-    This code retrieves the current time from an SNTP server 
-    (e.g., pool.ntp.org) using the 'ntplib' library.
+    This code retrieves the current time from SNTP servers
+    (e.g., pool.ntp.org) using the concurrent sampler in
+    sntp_sampler.py. Each server is queried several times and
+    the offset is computed from all four NTP timestamps, so the
+    round-trip delay does not bias the result.
 
-    In accordance with project requirements, 
-    this module converts the received UTC time 
-    to Turkish time (UTC+3) and compares it to the 
+    In accordance with project requirements,
+    this module converts the received UTC time
+    to Turkish time (UTC+3) and compares it to the
     local system time.
-    
+
 """
 
-import ntplib
 from datetime import datetime, timedelta
+import argparse
 import time
-import socket
 
-def get_sntp_time(server="pool.ntp.org"):
-    
-    print(f"Querying time from {server}...")
+from sntp_sampler import sample
+
+def get_sntp_time(server="pool.ntp.org", servers=None, samples=4):
+    """Prints the SNTP check and returns the sntp_sampler.SyncResult."""
+    servers = list(servers or [server])
+    print(f"Querying time from {', '.join(servers)}...")
 
-    ntp_client = ntplib.NTPClient()
-    
+    result = None
     try:
-        response = ntp_client.request(server, version=3)
-        
-        sntp_time_unix = response.tx_time
-        
+        result = sample(servers, samples=samples)
+
+        if result.offset is None:
+            for r in result.servers:
+                print(f"ERROR: {r.server}: {r.error or 'rejected as falseticker'}")
+            return result
+
         local_time_unix = time.time()
-        
+        sntp_time_unix = local_time_unix + result.offset
+
         # Convert SNTP time (which is UTC) to Python datetime object
         sntp_datetime_utc = datetime.utcfromtimestamp(sntp_time_unix)
-        
+
         # --- Turkey Time (UTC+3) Conversion ---
         # Add 3 hours to UTC time to get Turkish time
         sntp_datetime_turkey = sntp_datetime_utc + timedelta(hours=3)
         # --- End Conversion ---
 
-        local_datetime_now = datetime.now() 
+        local_datetime_now = datetime.fromtimestamp(local_time_unix)
 
         print(f"------------------------------------")
         print(f"SNTP Server Time (UTC):     {sntp_datetime_utc.strftime('%Y-%m-%d %H:%M:%S')}")
         print(f"SNTP Server Time (Turkey):  {sntp_datetime_turkey.strftime('%Y-%m-%d %H:%M:%S')} (UTC+3)")
         print(f"Local System Time:          {local_datetime_now.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-        
-        offset = sntp_time_unix - local_time_unix
+        print(f"Best server: {result.best_server} (delay {result.delay * 1000:.2f} ms, "
+              f"jitter {result.jitter * 1000:.2f} ms)")
+        if result.falsetickers:
+            print(f"Rejected falsetickers: {', '.join(result.falsetickers)}")
+
+        offset = result.offset
         print(f"Time Offset (Server - Local): {offset:+.4f} seconds")
-        
-        if abs(offset) < 0.1: 
+
+        if abs(offset) < 0.1:
             print("Result: System clock is synchronized.")
         elif offset > 0:
             print(f"Result: System clock is {abs(offset):.4f} seconds BEHIND.")
         else:
             print(f"Result: System clock is {abs(offset):.4f} seconds AHEAD.")
-            
-    except ntplib.NTPException as e:
-        print(f"ERROR: Could not retrieve time from NTP server. Details: {e}")
-    except socket.gaierror:
-        print(f"ERROR: Could not resolve server address ({server}). Check your internet connection.")
-    except socket.timeout:
-        print(f"ERROR: Connection timed out.")
+
     except Exception as e:
         print(f"ERROR: An unexpected error occurred: {e}")
     finally:
         print("------------------------------------")
+    return result
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="C. SNTP Time Check")
+    ap.add_argument("--server", action="append", default=[], help="SNTP server (repeatable) [pool.ntp.org]")
+    ap.add_argument("--samples", type=int, default=4, help="Queries per server")
+    args = ap.parse_args(argv)
+    get_sntp_time(servers=args.server or ["pool.ntp.org"], samples=args.samples)
 
 if __name__ == "__main__":
-    print("--- Testing SNTP Client Module Directly ---")
-    get_sntp_time()
\ No newline at end of file
+    main()
+
@@ -0,0 +1,78 @@
+"""
+This module encodes and decodes the 48-byte (S)NTP packet (RFC 4330)
+used by the SNTP sampler and server, so neither depends on ntplib.
+
+    LI/VN/Mode, Stratum, Poll, Precision        (4 x 1 byte)
+    Root Delay, Root Dispersion, Reference ID   (3 x 4 bytes)
+    Reference, Originate, Receive, Transmit     (4 x 8-byte timestamps)
+
+Timestamps are 64-bit fixed point (32.32) seconds since 1900-01-01.
+"""
+
+import struct
+from collections import namedtuple
+
+PACKET = struct.Struct("!BBbbIIIQQQQ")
+PACKET_SIZE = PACKET.size
+NTP_EPOCH_OFFSET = 2208988800  # seconds between 1900-01-01 and 1970-01-01
+
+MODE_CLIENT = 3
+MODE_SERVER = 4
+VERSION = 4
+
+NTPPacket = namedtuple(
+    "NTPPacket",
+    "leap version mode stratum poll precision root_delay root_dispersion "
+    "ref_id ref_time orig_time recv_time tx_time",
+)
+
+
+class PacketError(ValueError):
+    """Raised for truncated or malformed packets."""
+
+
+def to_ntp(t: float) -> int:
+    """Unix time (float seconds) -> 64-bit NTP timestamp."""
+    return int((t + NTP_EPOCH_OFFSET) * 4294967296.0) & 0xFFFFFFFFFFFFFFFF
+
+
+def from_ntp(v: int) -> float:
+    """64-bit NTP timestamp -> Unix time (float seconds)."""
+    return v / 4294967296.0 - NTP_EPOCH_OFFSET
+
+
+def to_short(seconds: float) -> int:
+    """Seconds -> 32-bit NTP short format (16.16), used for root delay/dispersion."""
+    return max(0, min(0xFFFFFFFF, int(seconds * 65536.0)))
+
+
+def from_short(v: int) -> float:
+    return v / 65536.0
+
+
+def encode_request(tx_time: float, version: int = VERSION) -> bytes:
+    """Client request; only the transmit timestamp is set (it comes back as originate)."""
+    return PACKET.pack((version << 3) | MODE_CLIENT, 0, 0, 0, 0, 0, 0, 0, 0, 0, to_ntp(tx_time))
+
+
+def decode(data) -> NTPPacket:
+    """Parses a packet. Timestamps are returned as raw 64-bit NTP values."""
+    if len(data) < PACKET_SIZE:
+        raise PacketError(f"Packet too short: {len(data)} bytes")
+    (lvm, stratum, poll, precision, root_delay, root_disp, ref_id,
+     ref_ts, orig_ts, recv_ts, tx_ts) = PACKET.unpack_from(data)
+    return NTPPacket(
+        leap=lvm >> 6,
+        version=(lvm >> 3) & 0x7,
+        mode=lvm & 0x7,
+        stratum=stratum,
+        poll=poll,
+        precision=precision,
+        root_delay=from_short(root_delay),
+        root_dispersion=from_short(root_disp),
+        ref_id=ref_id,
+        ref_time=ref_ts,
+        orig_time=orig_ts,
+        recv_time=recv_ts,
+        tx_time=tx_ts,
+    )
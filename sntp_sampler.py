@@ -0,0 +1,201 @@
+"""
+This module queries many SNTP servers in parallel and combines the
+answers into one clock offset estimate, in the spirit of NTP's clock
+filter and selection algorithms.
+
+For every sample all four timestamps are used:
+    t1 = client transmit, t2 = server receive,
+    t3 = server transmit, t4 = client receive
+    offset = ((t2 - t1) + (t3 - t4)) / 2
+    delay  = (t4 - t1) - (t3 - t2)
+
+so network latency no longer biases the offset the way reading only the
+server's transmit time does.
+
+1. Clock filter: each server is sampled several times and the sample with
+   the lowest round-trip delay is kept (it carries the least asymmetry
+   error); the spread of the other samples gives the server's jitter.
+2. Selection: each server's correctness interval is
+   offset +/- root distance (never narrower than MIN_DISPERSION / 2).
+   Marzullo's algorithm finds the largest interval shared by a majority;
+   servers outside it are falsetickers.
+3. Combine: the truechimers' offsets are averaged, weighted by
+   1 / root distance.
+
+Everything runs on one asyncio loop with plain UDP sockets and the
+packet codec in sntp_packet.py. Servers may be given as "host" or
+"host:port", which makes the sampler easy to point at a local stand-in
+server for testing.
+"""
+
+import asyncio
+import math
+import socket
+import time
+from collections import namedtuple
+
+import sntp_packet as ntp
+
+NTP_PORT = 123
+# Floor for the distance term, as in NTPv4 (MINDISP), so that servers on a
+# very fast network are not declared falsetickers over microseconds.
+MIN_DISPERSION = 0.01
+
+Sample = namedtuple("Sample", "offset delay t1 t2 t3 t4 stratum root_delay root_dispersion")
+ServerResult = namedtuple(
+    "ServerResult", "server address samples best jitter root_distance error"
+)
+SyncResult = namedtuple(
+    "SyncResult", "offset delay jitter best_server truechimers falsetickers servers"
+)
+
+
+def compute_sample(t1: float, t4: float, pkt: ntp.NTPPacket) -> Sample:
+    t2 = ntp.from_ntp(pkt.recv_time)
+    t3 = ntp.from_ntp(pkt.tx_time)
+    return Sample(
+        offset=((t2 - t1) + (t3 - t4)) / 2,
+        delay=max(0.0, (t4 - t1) - (t3 - t2)),
+        t1=t1, t2=t2, t3=t3, t4=t4,
+        stratum=pkt.stratum,
+        root_delay=pkt.root_delay,
+        root_dispersion=pkt.root_dispersion,
+    )
+
+
+class _SNTPProtocol(asyncio.DatagramProtocol):
+    """Matches replies to outstanding requests by their originate timestamp."""
+
+    def __init__(self):
+        self.pending = {}
+
+    def datagram_received(self, data, addr):
+        t4 = time.time()
+        try:
+            pkt = ntp.decode(data)
+        except ntp.PacketError:
+            return
+        fut = self.pending.pop(pkt.orig_time, None)
+        if fut is not None and not fut.done():
+            fut.set_result((t4, pkt))
+
+    def error_received(self, exc):
+        for fut in self.pending.values():
+            if not fut.done():
+                fut.set_exception(exc)
+        self.pending.clear()
+
+
+def _split_server(server: str, default_port: int):
+    host, sep, port = server.rpartition(":")
+    if sep and port.isdigit() and "]" not in port:
+        return host.strip("[]"), int(port)
+    return server, default_port
+
+
+async def _query_server(server, samples, interval, timeout, default_port) -> ServerResult:
+    loop = asyncio.get_running_loop()
+    host, port = _split_server(server, default_port)
+    try:
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+    except socket.gaierror as e:
+        return ServerResult(server, None, [], None, None, None, f"resolve failed: {e}")
+    family, _, _, _, address = infos[0]
+
+    transport, proto = await loop.create_datagram_endpoint(
+        _SNTPProtocol, remote_addr=address, family=family
+    )
+    results, errors = [], []
+    try:
+        for i in range(samples):
+            if i:
+                await asyncio.sleep(interval)
+            t1 = time.time()
+            request = ntp.encode_request(t1)
+            fut = loop.create_future()
+            proto.pending[ntp.to_ntp(t1)] = fut
+            transport.sendto(request)
+            try:
+                t4, pkt = await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                errors.append("timeout")
+                continue
+            except OSError as e:
+                errors.append(str(e))
+                continue
+            if pkt.mode != ntp.MODE_SERVER or pkt.stratum == 0 or not pkt.tx_time:
+                errors.append("invalid or kiss-o'-death reply")
+                continue
+            results.append(compute_sample(t1, t4, pkt))
+    finally:
+        transport.close()
+
+    if not results:
+        return ServerResult(server, address, [], None, None, None, errors[-1] if errors else "no reply")
+    best = min(results, key=lambda s: s.delay)
+    jitter = math.sqrt(sum((s.offset - best.offset) ** 2 for s in results) / len(results))
+    root_distance = (max(MIN_DISPERSION, best.root_delay + best.delay) / 2
+                     + best.root_dispersion + jitter)
+    return ServerResult(server, address, results, best, jitter, root_distance, None)
+
+
+def select_truechimers(servers):
+    """Marzullo's intersection: returns (truechimers, falsetickers)."""
+    n = len(servers)
+    if n <= 2:
+        return list(servers), []
+    edges = []
+    for s in servers:
+        edges.append((s.best.offset - s.root_distance, -1))
+        edges.append((s.best.offset + s.root_distance, +1))
+    edges.sort()
+    for allowed in range(0, (n - 1) // 2 + 1):
+        need = n - allowed
+        low = high = None
+        count = 0
+        for value, kind in edges:
+            count -= kind
+            if count >= need:
+                low = value
+                break
+        count = 0
+        for value, kind in reversed(edges):
+            count += kind
+            if count >= need:
+                high = value
+                break
+        if low is not None and high is not None and low <= high:
+            true = [s for s in servers
+                    if s.best.offset - s.root_distance <= high and s.best.offset + s.root_distance >= low]
+            return true, [s for s in servers if s not in true]
+    return [], list(servers)
+
+
+async def sample_servers(servers, samples=4, interval=0.25, timeout=2.0, port=NTP_PORT) -> SyncResult:
+    """Samples all servers concurrently and returns the combined estimate."""
+    per_server = await asyncio.gather(*(
+        _query_server(s, samples, interval, timeout, port) for s in servers
+    ))
+    usable = [r for r in per_server if r.best is not None]
+    truechimers, falsetickers = select_truechimers(usable)
+    if not truechimers:
+        return SyncResult(None, None, None, None, [], [r.server for r in falsetickers], list(per_server))
+
+    weights = [1.0 / max(r.root_distance, 1e-6) for r in truechimers]
+    offset = sum(w * r.best.offset for w, r in zip(weights, truechimers)) / sum(weights)
+    jitter = math.sqrt(sum((r.best.offset - offset) ** 2 for r in truechimers) / len(truechimers))
+    best = min(truechimers, key=lambda r: r.root_distance)
+    return SyncResult(
+        offset=offset,
+        delay=best.best.delay,
+        jitter=jitter,
+        best_server=best.server,
+        truechimers=[r.server for r in truechimers],
+        falsetickers=[r.server for r in falsetickers],
+        servers=list(per_server),
+    )
+
+
+def sample(servers, **kwargs) -> SyncResult:
+    """Blocking wrapper around sample_servers()."""
+    return asyncio.run(sample_servers(servers, **kwargs))
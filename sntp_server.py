@@ -0,0 +1,355 @@
+"""
+This module is the server side of the SNTP module. It answers SNTP
+requests on UDP (port 123 by default, configurable) from a locally
+disciplined clock, so a fleet of clients can sync against it instead of
+all hitting pool.ntp.org.
+
+- DisciplinedClock keeps an offset to the upstream servers. A background
+  thread refreshes it every sync interval with sntp_sampler.sample(); in
+  between, requests are answered from time.time() + offset without any
+  upstream traffic. Each sync publishes one immutable ClockState, so a
+  response never mixes fields from two syncs. Until the first successful
+  sync the leap indicator is 3 (alarm) and the stratum 16 (unsynchronized).
+- The request path is allocation-light: one preallocated receive buffer
+  filled with recvfrom_into(), and one preallocated 48-byte response whose
+  static header is rebuilt only when the clock is re-synced. Per request
+  only the three timestamps are patched in with pack_into().
+- Python has no recvmmsg(), so the socket is non-blocking and each wakeup
+  drains every queued datagram before going back to select(), which
+  batches the event-loop overhead in the same way.
+- With workers > 1 the server is pre-forked over SO_REUSEPORT
+  (see worker_pool.py) to use every core.
+- Requests, responses, errors, recv/send calls, datagrams drained per
+  wakeup and the receive-to-send latency are counted in metrics.py
+  (--metrics-port / --metrics-file).
+
+A flood benchmark is included:
+    python3 sntp_server.py serve --port 1123 --upstream pool.ntp.org
+    python3 sntp_server.py bench --port 1123 --senders 4 --duration 5
+"""
+
+import argparse
+import errno
+import ipaddress
+import multiprocessing as mp
+import select
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+import sntp_packet as ntp
+
+SYNC_INTERVAL = 64.0
+STATS_INTERVAL = 1.0
+LOCAL_STRATUM = 10
+UNSYNCED_STRATUM = 16
+BATCH_LIMIT = 256
+LI_ALARM = 0xC0  # leap indicator 3: clock not synchronized
+
+_TIMESTAMPS = struct.Struct("!QQQ")   # originate, receive, transmit (bytes 24..48)
+_HEADER = struct.Struct("!BBbbIIIQ")  # everything up to and including the reference timestamp
+
+ClockState = namedtuple("ClockState", "offset stratum root_delay root_dispersion ref_id ref_time version")
+
+
+class DisciplinedClock:
+    """Local clock corrected by a periodically refreshed upstream offset."""
+
+    def __init__(self, upstream=(), sync_interval=SYNC_INTERVAL, samples=4):
+        self.upstream = list(upstream)
+        self.sync_interval = sync_interval
+        self.samples = samples
+        # Replaced as a whole on every successful sync (version bumped), never updated in place.
+        self.state = ClockState(
+            offset=0.0,
+            stratum=LOCAL_STRATUM if not self.upstream else UNSYNCED_STRATUM,
+            root_delay=0.0,
+            root_dispersion=0.0,
+            ref_id=int.from_bytes(b"LOCL", "big"),
+            ref_time=time.time(),
+            version=0,
+        )
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def offset(self) -> float:
+        return self.state.offset
+
+    @property
+    def stratum(self) -> int:
+        return self.state.stratum
+
+    def now(self) -> float:
+        return time.time() + self.state.offset
+
+    def sync_once(self) -> bool:
+        from sntp_sampler import sample
+
+        result = sample(self.upstream, samples=self.samples)
+        if result.offset is None:
+            print(f"[SNTP Server] Upstream sync failed: "
+                  f"{'; '.join(f'{r.server}: {r.error}' for r in result.servers)}")
+            return False
+        best = next(r for r in result.servers if r.server == result.best_server)
+        try:
+            ref_id = int(ipaddress.IPv4Address(best.address[0]))
+        except ValueError:
+            ref_id = 0
+        state = ClockState(
+            offset=result.offset,
+            stratum=min(UNSYNCED_STRATUM - 1, best.best.stratum + 1),
+            root_delay=best.best.root_delay + best.best.delay,
+            root_dispersion=best.best.root_dispersion + result.jitter,
+            ref_id=ref_id,
+            ref_time=time.time() + result.offset,
+            version=self.state.version + 1,
+        )
+        self.state = state
+        print(f"[SNTP Server] Synced to {result.best_server}: offset {state.offset:+.6f}s, "
+              f"stratum {state.stratum}")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+            except Exception as e:
+                print(f"[SNTP Server] Upstream sync error: {e}")
+            self._stop.wait(self.sync_interval)
+
+    def start(self):
+        if self.upstream and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sntp-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+class SNTPServer:
+    """Answers SNTP client requests from a DisciplinedClock."""
+
+    def __init__(self, host="0.0.0.0", port=123, clock=None, reuse_port=False, stats_hook=None):
+        self.host = host
+        self.port = port
+        self.clock = clock or DisciplinedClock()
+        self.reuse_port = reuse_port
+        self.stats_hook = stats_hook
+        labels = {"port": port}
+        self.counters = {
+            key: metrics.counter(f"sntp_{key}_total", help_text, **labels)
+            for key, help_text in (
+                ("requests", "Datagrams received"),
+                ("responses", "Responses sent"),
+                ("malformed", "Datagrams that were not client requests"),
+                ("send_errors", "Responses that failed to send"),
+                ("recv_calls", "recvfrom_into() calls, including empty drains"),
+            )
+        }
+        self.batch_size = metrics.histogram("sntp_batch_size", "Datagrams drained per wakeup", **labels)
+        self.latency = metrics.histogram("sntp_response_latency_us", "Time from receive to response (us)", **labels)
+        metrics.gauge("sntp_clock_offset_seconds", "Offset applied to the local clock",
+                      fn=lambda: self.clock.offset, **labels)
+        metrics.gauge("sntp_stratum", "Stratum advertised to clients", fn=lambda: self.clock.stratum, **labels)
+        self._recv_buf = bytearray(ntp.PACKET_SIZE * 2)
+        self._recv_view = memoryview(self._recv_buf)
+        self._response = bytearray(ntp.PACKET_SIZE)
+        self._header_version = -1
+        self._running = False
+
+    @property
+    def stats(self) -> dict:
+        return {key: c.value for key, c in self.counters.items()}
+
+    def _refresh_header(self, state: ClockState, version_bits: int):
+        leap = LI_ALARM if state.stratum == UNSYNCED_STRATUM else 0
+        _HEADER.pack_into(
+            self._response, 0,
+            leap | version_bits | ntp.MODE_SERVER,
+            state.stratum,
+            4,      # poll: 16 s
+            -20,    # precision: ~1 us
+            ntp.to_short(state.root_delay),
+            ntp.to_short(state.root_dispersion),
+            state.ref_id,
+            ntp.to_ntp(state.ref_time),
+        )
+        self._header_version = (state.version, version_bits)
+
+    def _answer(self, sock, nbytes, addr, recv_time, state):
+        buf = self._recv_buf
+        if nbytes < ntp.PACKET_SIZE or buf[0] & 0x7 != ntp.MODE_CLIENT:
+            self.counters["malformed"].inc()
+            return
+        version_bits = buf[0] & 0x38
+        if self._header_version != (state.version, version_bits):
+            self._refresh_header(state, version_bits)
+        # Originate = the client's transmit timestamp, copied byte-for-byte.
+        orig = int.from_bytes(self._recv_view[40:48], "big")
+        _TIMESTAMPS.pack_into(self._response, 24, orig, recv_time, ntp.to_ntp(time.time() + state.offset))
+        try:
+            sock.sendto(self._response, addr)
+            self.counters["responses"].inc()
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.counters["send_errors"].inc()
+
+    def serve_forever(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.bind((self.host, self.port))
+            sock.setblocking(False)
+            self.port = sock.getsockname()[1]
+            self.clock.start()
+            print(f"[SNTP Server] Listening on udp://{self.host}:{self.port} "
+                  f"(upstream: {', '.join(self.clock.upstream) or 'local clock'})")
+
+            self._running = True
+            next_stats = time.monotonic() + STATS_INTERVAL
+            recv_into = sock.recvfrom_into
+            view = self._recv_view
+            requests, recv_calls = self.counters["requests"], self.counters["recv_calls"]
+            perf_counter = time.perf_counter
+            while self._running:
+                ready, _, _ = select.select([sock], [], [], 0.5)
+                if ready:
+                    # Drain everything queued before sleeping again.
+                    drained = 0
+                    for _ in range(BATCH_LIMIT):
+                        recv_calls.inc()
+                        try:
+                            nbytes, addr = recv_into(view)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        start = perf_counter()
+                        state = self.clock.state  # one snapshot per request
+                        recv_time = ntp.to_ntp(time.time() + state.offset)
+                        requests.inc()
+                        drained += 1
+                        self._answer(sock, nbytes, addr, recv_time, state)
+                        self.latency.observe_since(start)
+                    self.batch_size.observe(drained)
+                if self.stats_hook and time.monotonic() >= next_stats:
+                    self.stats_hook(self.stats)
+                    next_stats = time.monotonic() + STATS_INTERVAL
+            self.clock.stop()
+
+    def stop(self):
+        self._running = False
+
+
+def start_sntp_server(host="0.0.0.0", port=123, upstream=(), sync_interval=SYNC_INTERVAL,
+                      workers=1, reuse_port=False, stats_hook=None):
+    """Runs the SNTP server until Ctrl+C."""
+    if workers > 1:
+        from worker_pool import run_worker_pool
+        run_worker_pool(
+            start_sntp_server,
+            {"host": host, "port": port, "upstream": list(upstream), "sync_interval": sync_interval},
+            workers,
+            name="SNTP Pool",
+        )
+        return
+    server = SNTPServer(host, port, DisciplinedClock(upstream, sync_interval), reuse_port, stats_hook)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[SNTP Server] Interrupted by user.")
+    finally:
+        print(f"[SNTP Server] Stats: {server.stats}")
+
+
+# -- flood benchmark -----------------------------------------------------------
+
+def _flood_worker(host, port, duration, window, results):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect((host, port))
+    sock.setblocking(False)
+    request = bytearray(ntp.encode_request(time.time()))
+    reply = bytearray(ntp.PACKET_SIZE)
+    sent = received = lost = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        while sent - received - lost < window:
+            try:
+                sock.send(request)
+                sent += 1
+            except BlockingIOError:
+                break
+        ready, _, _ = select.select([sock], [], [], 0.05)
+        if not ready:
+            # Assume the outstanding window was lost and move on.
+            lost = sent - received
+            continue
+        while True:
+            try:
+                sock.recv_into(reply)
+                received += 1
+            except BlockingIOError:
+                break
+            except ConnectionRefusedError:
+                break
+    sock.close()
+    results.put((sent, received))
+
+
+def run_flood(host="127.0.0.1", port=123, senders=4, duration=5.0, window=64) -> dict:
+    """Floods the server from `senders` processes and returns the achieved rates."""
+    results = mp.Queue()
+    procs = [mp.Process(target=_flood_worker, args=(host, port, duration, window, results))
+             for _ in range(senders)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    totals = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+    sent = sum(s for s, _ in totals)
+    answered = sum(r for _, r in totals)
+    return {
+        "senders": senders,
+        "elapsed_sec": round(elapsed, 3),
+        "sent": sent,
+        "answered": answered,
+        "requests_per_sec": round(answered / elapsed, 1),
+        "loss_pct": round(100.0 * (sent - answered) / sent, 2) if sent else 0.0,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="C. SNTP server and flood benchmark")
+    sub = ap.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Answer SNTP requests")
+    serve.add_argument("--host", default="0.0.0.0", help="Bind host")
+    serve.add_argument("--port", type=int, default=123, help="UDP port")
+    serve.add_argument("--upstream", action="append", default=[], help="Upstream server (repeatable)")
+    serve.add_argument("--sync-interval", type=float, default=SYNC_INTERVAL, help="Seconds between upstream syncs")
+    serve.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port (SO_REUSEPORT)")
+    bench = sub.add_parser("bench", help="Flood a server with requests")
+    bench.add_argument("--host", default="127.0.0.1", help="Server host")
+    bench.add_argument("--port", type=int, default=123, help="Server UDP port")
+    bench.add_argument("--senders", type=int, default=4, help="Sending processes")
+    bench.add_argument("--duration", type=float, default=5.0, help="Run time in seconds")
+    bench.add_argument("--window", type=int, default=64, help="Outstanding requests per sender")
+    metrics.add_arguments(serve)
+    args = ap.parse_args(argv)
+
+    if args.command == "serve":
+        metrics.enable_from_args(args)
+        start_sntp_server(args.host, args.port, args.upstream, args.sync_interval, args.workers)
+    else:
+        result = run_flood(args.host, args.port, args.senders, args.duration, args.window)
+        for key, value in result.items():
+            print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import asyncio
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from echo_server import AsyncEchoServer
+from framing import FrameDecoder, encode_frame, write_frames
+
+
+class _KeepingTransport:
+    """Holds on to every buffer it is given, like a transport under backpressure."""
+
+    def __init__(self):
+        self.buffers = []
+
+    def write(self, data):
+        self.buffers.append(data)
+
+    def writelines(self, buffers):
+        self.buffers.extend(buffers)
+
+    def data(self) -> bytes:
+        return b"".join(bytes(b) for b in self.buffers)
+
+
+class WriteFramesTest(unittest.TestCase):
+    def test_queued_frames_survive_the_next_feed(self):
+        decoder = FrameDecoder(initial_size=64)
+        transport = _KeepingTransport()
+        write_frames(transport, decoder.feed(encode_frame(b"a" * 10) + encode_frame(b"b" * 10)))
+        decoder.feed(encode_frame(b"x" * 10) + encode_frame(b"y" * 10))
+        self.assertEqual(transport.data(), encode_frame(b"a" * 10) + encode_frame(b"b" * 10))
+
+
+class EchoBackpressureTest(unittest.TestCase):
+    """Echoes queued while the client is not reading must arrive intact."""
+
+    FRAMES = 5000
+    SIZE = 997
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = AsyncEchoServer("127.0.0.1", 0)
+        self.loop.run_until_complete(self.server.start())
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.server.stop)
+        asyncio.run_coroutine_threadsafe(self.server._shutdown(grace=0), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+
+    def _payload(self, i: int) -> bytes:
+        return struct.pack("!I", i) * (self.SIZE // 4) + b"!" * (self.SIZE % 4)
+
+    def test_slow_reader_gets_every_frame_intact(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8192)
+        sock.connect(("127.0.0.1", self.server.port))
+        sock.settimeout(10)
+        stream = b"".join(encode_frame(self._payload(i)) for i in range(self.FRAMES))
+        writer = threading.Thread(target=sock.sendall, args=(stream,), daemon=True)
+        writer.start()
+        time.sleep(0.5)  # let echoes pile up in the server's write buffer
+        decoder = FrameDecoder()
+        received = []
+        with sock:
+            while len(received) < self.FRAMES:
+                if not decoder.recv_into(sock):
+                    break
+                received.extend(bytes(f) for f in decoder.frames())
+        writer.join(5)
+        self.assertEqual(len(received), self.FRAMES)
+        corrupted = sum(1 for i, frame in enumerate(received) if frame != self._payload(i))
+        self.assertEqual(corrupted, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+This module provides the optional TLS layer for the echo and chat
+servers and clients.
+
+- ensure_self_signed() creates a self-signed certificate and key for
+  local tests with the openssl command line tool (EC P-256, valid for
+  "localhost" and 127.0.0.1). Clients verify against the same cert file.
+- server_context() builds the server side: TLS 1.2+, with session tickets
+  and the session cache left on so returning clients can resume.
+- client_context() returns a ResumingContext. It remembers the last TLS
+  session of each server name and offers it on the next connection, for
+  blocking sockets (wrap_socket) and asyncio (wrap_bio) alike, so
+  reconnects and new pooled connections skip the full handshake.
+  With TLS 1.3 the session ticket arrives after the handshake, so call
+  remember() once data has been read (the pool and chat client do).
+
+    python3 tls.py                  # writes certs/cert.pem and certs/key.pem
+    python3 echo_server.py --mode async --tls
+    python3 echo_client.py --tls --count 1000
+"""
+
+import argparse
+import ssl
+import subprocess
+from pathlib import Path
+
+CERT_DIR = "certs"
+CERT_FILE = "cert.pem"
+KEY_FILE = "key.pem"
+CERT_DAYS = 365
+
+
+def ensure_self_signed(cert_dir=CERT_DIR, hostname="localhost", days=CERT_DAYS, force=False):
+    """Returns (certfile, keyfile), generating a self-signed pair if needed."""
+    directory = Path(cert_dir)
+    cert, key = directory / CERT_FILE, directory / KEY_FILE
+    if cert.exists() and key.exists() and not force:
+        return str(cert), str(key)
+    directory.mkdir(parents=True, exist_ok=True)
+    try:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+             "-nodes", "-days", str(days), "-subj", f"/CN={hostname}",
+             "-addext", f"subjectAltName=DNS:{hostname},IP:127.0.0.1,IP:::1",
+             "-keyout", str(key), "-out", str(cert)],
+            check=True, capture_output=True,
+        )
+    except FileNotFoundError:
+        raise RuntimeError("The openssl command is needed to generate a test certificate") from None
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"openssl failed: {e.stderr.decode(errors='replace').strip()}") from None
+    key.chmod(0o600)
+    print(f"[TLS] Generated self-signed certificate {cert} for {hostname}")
+    return str(cert), str(key)
+
+
+def server_context(tls=True) -> ssl.SSLContext:
+    """`tls` is True (the local self-signed pair) or a (certfile, keyfile) pair."""
+    certfile, keyfile = ensure_self_signed() if tls is True else tls
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    ctx.load_cert_chain(certfile, keyfile)
+    return ctx
+
+
+class ResumingContext(ssl.SSLContext):
+    """Client context that offers each server's previous session on the next connection."""
+
+    def _session(self, server_hostname):
+        return self.__dict__.setdefault("sessions", {}).get(server_hostname)
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        return super().wrap_socket(sock, server_side, do_handshake_on_connect, suppress_ragged_eofs,
+                                   server_hostname, session or self._session(server_hostname))
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        # Used by asyncio's SSL transport, which has no way to pass a session itself.
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname,
+                                session or self._session(server_hostname))
+
+    def remember(self, ssl_object):
+        """Stores the session of an SSLSocket / SSLObject for its server name."""
+        if ssl_object is None:
+            return
+        session = ssl_object.session
+        if session is not None:
+            self.__dict__.setdefault("sessions", {})[ssl_object.server_hostname] = session
+
+    def forget(self, server_hostname=None):
+        sessions = self.__dict__.setdefault("sessions", {})
+        if server_hostname is None:
+            sessions.clear()
+        else:
+            sessions.pop(server_hostname, None)
+
+
+def client_context(cafile=None, verify=True) -> ResumingContext:
+    """TLS client context trusting `cafile` (default: the local self-signed cert)."""
+    ctx = ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    if verify:
+        ctx.load_verify_locations(cafile or ensure_self_signed()[0])
+    else:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+def add_server_arguments(ap):
+    """Adds --tls / --cert / --key to a server CLI."""
+    ap.add_argument("--tls", action="store_true", help="Serve TLS (self-signed test cert unless --cert/--key)")
+    ap.add_argument("--cert", help="TLS certificate chain (PEM)")
+    ap.add_argument("--key", help="TLS private key (PEM)")
+
+
+def server_spec(args):
+    """The `tls` argument for the servers: None or (certfile, keyfile).
+
+    The test certificate is created here, before any worker processes are
+    forked, so they do not race to generate it.
+    """
+    if args.cert or args.key:
+        if not (args.cert and args.key):
+            raise SystemExit("--cert and --key must be given together")
+        return (args.cert, args.key)
+    return ensure_self_signed() if args.tls else None
+
+
+def add_client_arguments(ap):
+    """Adds --tls / --cafile / --insecure to a client CLI."""
+    ap.add_argument("--tls", action="store_true", help="Connect with TLS")
+    ap.add_argument("--cafile", help="CA / server certificate to trust (default: the local test cert)")
+    ap.add_argument("--insecure", action="store_true", help="Skip certificate verification")
+
+
+def client_from_args(args):
+    """A ResumingContext from the client arguments, or None for plaintext."""
+    if not (args.tls or args.cafile or args.insecure):
+        return None
+    return client_context(args.cafile, verify=not args.insecure)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Generate the self-signed test certificate")
+    ap.add_argument("--dir", default=CERT_DIR, help="Output directory")
+    ap.add_argument("--hostname", default="localhost", help="Certificate name")
+    ap.add_argument("--days", type=int, default=CERT_DAYS, help="Validity in days")
+    ap.add_argument("--force", action="store_true", help="Replace an existing certificate")
+    args = ap.parse_args(argv)
+    cert, key = ensure_self_signed(args.dir, args.hostname, args.days, args.force)
+    print(f"[TLS] Certificate: {cert}\n[TLS] Key:         {key}")
+
+
+if __name__ == "__main__":
+    main()
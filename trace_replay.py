@@ -0,0 +1,455 @@
+"""
+This module records real echo/chat traffic to a compact binary trace and
+replays it as a repeatable workload for performance regression tests.
+
+record: a recording proxy sits between clients and a server. It forwards
+  bytes unchanged in both directions and appends one record per frame
+  (see framing.py) to the trace: connection id, direction, time since the
+  start of the recording and payload size, plus the payload itself with
+  --payloads. Point any client at the proxy's port.
+
+replay: every recorded connection is opened against a target server and
+  its client frames are sent again, at the recorded pace (--speed 1), N
+  times faster (--speed N) or as fast as the responses come back
+  (--speed 0, closed loop). --replicas runs that many copies of the trace
+  at once, over --processes processes. The latency of a request is the
+  time until the first of the server frames that followed it in the
+  recording arrives; this is exact for request/response traffic (echo,
+  chat commands) and approximate for chat fan-out. Without recorded
+  payloads, frames of the recorded size are synthesised.
+
+  The result can be saved as JSON (--json) and compared against a stored
+  baseline (--baseline); the run fails (exit status 1) when p99 latency
+  regressed by more than --max-regression percent.
+
+Trace format (little endian): a header "<4sBBQ" (magic b"NTRC", version,
+flags, start time in unix microseconds), then records "<BIQI" (kind,
+connection id, microseconds since start, payload size), each followed by
+the payload when the PAYLOADS flag is set and the record is a frame.
+
+Examples:
+    python3 trace_replay.py record --listen 5051 --target 127.0.0.1:5050 --out echo.trace
+    python3 echo_client.py --port 5051 --count 5000
+    python3 trace_replay.py replay echo.trace --spawn echo --speed 0 --replicas 20 --json base.json
+    python3 trace_replay.py replay echo.trace --spawn echo --speed 0 --replicas 20 --baseline base.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+from collections import deque, namedtuple
+
+from framing import FrameDecoder, FrameTooLarge, encode_frame
+from histogram import LatencyHistogram
+
+MAGIC = b"NTRC"
+VERSION = 1
+FLAG_PAYLOADS = 1
+HEADER = struct.Struct("<4sBBQ")
+RECORD = struct.Struct("<BIQI")
+OPEN, CLIENT, SERVER, CLOSE = range(4)
+READ_SIZE = 64 * 1024
+RESPONSE_TIMEOUT = 5.0
+MAX_REGRESSION = 10.0
+
+Record = namedtuple("Record", "kind conn t_us size payload")
+# One client frame to replay: when (us after the connection opened), what, and how many
+# server frames followed it in the recording.
+Step = namedtuple("Step", "t_us size payload expect")
+Session = namedtuple("Session", "conn start_us steps")
+
+
+class TraceError(ValueError):
+    """Raised for files that are not valid traces."""
+
+
+# -- trace file -------------------------------------------------------------------
+
+class TraceWriter:
+    """Appends records to a trace file (buffered; call close() to flush)."""
+
+    def __init__(self, path, payloads=False):
+        self.payloads = payloads
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._file = open(path, "wb", buffering=256 * 1024)
+        self._file.write(HEADER.pack(MAGIC, VERSION, FLAG_PAYLOADS if payloads else 0, int(self.start * 1e6)))
+        self.records = 0
+
+    def write(self, kind, conn, payload=b""):
+        t_us = int((time.perf_counter() - self._t0) * 1_000_000)
+        self._file.write(RECORD.pack(kind, conn, t_us, len(payload)))
+        if self.payloads and kind in (CLIENT, SERVER):
+            self._file.write(payload)
+        self.records += 1
+
+    def close(self):
+        self._file.close()
+
+
+def read_trace(path):
+    """Yields the header dict first, then every Record of a trace file."""
+    with open(path, "rb") as f:
+        head = f.read(HEADER.size)
+        if len(head) < HEADER.size:
+            raise TraceError(f"{path}: too short for a trace")
+        magic, version, flags, start_us = HEADER.unpack(head)
+        if magic != MAGIC or version != VERSION:
+            raise TraceError(f"{path}: not a version {VERSION} trace")
+        payloads = bool(flags & FLAG_PAYLOADS)
+        yield {"version": version, "payloads": payloads, "start": start_us / 1e6}
+        while True:
+            raw = f.read(RECORD.size)
+            if len(raw) < RECORD.size:
+                return  # a recording cut off mid-record ends here
+            kind, conn, t_us, size = RECORD.unpack(raw)
+            payload = None
+            if payloads and kind in (CLIENT, SERVER):
+                payload = f.read(size)
+                if len(payload) < size:
+                    return
+            yield Record(kind, conn, t_us, size, payload)
+
+
+def load_sessions(path):
+    """Returns (header, [Session]) with the client frames of each recorded connection."""
+    records = read_trace(path)
+    header = next(records)
+    opened, steps = {}, {}
+    for r in records:
+        if r.kind == OPEN:
+            opened[r.conn] = r.t_us
+            steps[r.conn] = []
+        elif r.conn not in opened:
+            continue  # connection opened before a truncated start
+        elif r.kind == CLIENT:
+            steps[r.conn].append(Step(r.t_us - opened[r.conn], r.size, r.payload, 0))
+        elif r.kind == SERVER and steps[r.conn]:
+            last = steps[r.conn][-1]
+            steps[r.conn][-1] = last._replace(expect=last.expect + 1)
+    sessions = [Session(conn, opened[conn], steps[conn]) for conn in sorted(opened)]
+    return header, sessions
+
+
+def describe(path) -> dict:
+    """Summary of a trace: connections, frames, bytes and duration."""
+    records = read_trace(path)
+    header = next(records)
+    stats = {"connections": 0, "client_frames": 0, "server_frames": 0,
+             "client_bytes": 0, "server_bytes": 0, "duration_sec": 0.0}
+    for r in records:
+        stats["duration_sec"] = r.t_us / 1e6
+        if r.kind == OPEN:
+            stats["connections"] += 1
+        elif r.kind == CLIENT:
+            stats["client_frames"] += 1
+            stats["client_bytes"] += r.size
+        elif r.kind == SERVER:
+            stats["server_frames"] += 1
+            stats["server_bytes"] += r.size
+    return dict(header, **stats)
+
+
+# -- recording proxy --------------------------------------------------------------
+
+class RecordingProxy:
+    """Forwards connections to a server and records every frame in a trace."""
+
+    def __init__(self, listen_host, listen_port, target_host, target_port, trace: TraceWriter):
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.target = (target_host, target_port)
+        self.trace = trace
+        self.next_conn = 0
+        self._server = None
+
+    async def _pipe(self, conn, kind, reader, writer):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                for frame in decoder.feed(data):
+                    self.trace.write(kind, conn, frame)
+                await writer.drain()
+        except (ConnectionError, FrameTooLarge):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, client_reader, client_writer):
+        conn = self.next_conn
+        self.next_conn += 1
+        try:
+            server_reader, server_writer = await asyncio.open_connection(*self.target)
+        except OSError as e:
+            print(f"[Trace] Cannot reach {self.target[0]}:{self.target[1]}: {e}")
+            client_writer.close()
+            return
+        self.trace.write(OPEN, conn)
+        await asyncio.gather(self._pipe(conn, CLIENT, client_reader, server_writer),
+                             self._pipe(conn, SERVER, server_reader, client_writer))
+        self.trace.write(CLOSE, conn)
+
+    async def serve_forever(self):
+        self._server = await asyncio.start_server(self._handle, self.listen_host, self.listen_port)
+        print(f"[Trace] Recording {self.listen_host}:{self.listen_port} -> "
+              f"{self.target[0]}:{self.target[1]} (Ctrl+C to stop)")
+        async with self._server:
+            await self._server.serve_forever()
+
+
+def record(listen_host, listen_port, target_host, target_port, path, payloads=False):
+    """Runs the recording proxy until Ctrl+C and returns the trace summary."""
+    trace = TraceWriter(path, payloads)
+    try:
+        asyncio.run(RecordingProxy(listen_host, listen_port, target_host, target_port, trace).serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        trace.close()
+    print(f"[Trace] Wrote {trace.records} records to {path}")
+    return describe(path)
+
+
+# -- replay -----------------------------------------------------------------------
+
+async def _replay_session(session, host, port, speed, timeout, t0, hist, totals):
+    loop = asyncio.get_running_loop()
+    if speed:
+        await asyncio.sleep(max(0.0, t0 + session.start_us / 1e6 / speed - loop.time()))
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        totals["errors"] += 1
+        return
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    pending = deque()       # [sent_at, frames still expected, latency recorded]
+    idle = asyncio.Event()  # set whenever nothing is pending
+    idle.set()
+
+    async def read_loop():
+        decoder = FrameDecoder()
+        while True:
+            try:
+                data = await reader.read(READ_SIZE)
+            except ConnectionError:
+                return
+            if not data:
+                return
+            now = loop.time()
+            for _ in decoder.feed(data):
+                totals["responses"] += 1
+                if not pending:
+                    totals["unsolicited"] += 1
+                    continue
+                head = pending[0]
+                if not head[2]:
+                    hist.record((now - head[0]) * 1_000_000)
+                    head[2] = True
+                head[1] -= 1
+                if head[1] == 0:
+                    pending.popleft()
+                    if not pending:
+                        idle.set()
+
+    reading = asyncio.ensure_future(read_loop())
+    opened = loop.time()
+    try:
+        for step in session.steps:
+            if speed:
+                await asyncio.sleep(max(0.0, opened + step.t_us / 1e6 / speed - loop.time()))
+            payload = step.payload if step.payload is not None else b"x" * step.size
+            writer.write(encode_frame(payload))
+            totals["requests"] += 1
+            if step.expect:
+                pending.append([loop.time(), step.expect, False])
+                idle.clear()
+            await writer.drain()
+            if not speed and step.expect:
+                await asyncio.wait_for(idle.wait(), timeout)
+        await asyncio.wait_for(idle.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    except ConnectionError:
+        totals["errors"] += 1
+    finally:
+        totals["missing"] += sum(p[1] for p in pending)
+        reading.cancel()
+        await asyncio.gather(reading, return_exceptions=True)
+        writer.close()
+
+
+async def _replay(sessions, host, port, speed, replicas, timeout):
+    hist = LatencyHistogram()
+    totals = {"requests": 0, "responses": 0, "unsolicited": 0, "missing": 0, "errors": 0}
+    t0 = asyncio.get_running_loop().time()
+    await asyncio.gather(*(_replay_session(s, host, port, speed, timeout, t0, hist, totals)
+                           for _ in range(replicas) for s in sessions))
+    return hist, totals
+
+
+def _replay_process(sessions, host, port, speed, replicas, timeout, results):
+    results.put(asyncio.run(_replay(sessions, host, port, speed, replicas, timeout)))
+
+
+def replay(path, host="127.0.0.1", port=5050, speed=1.0, replicas=1, processes=1,
+           timeout=RESPONSE_TIMEOUT) -> dict:
+    """Replays a trace against a server and returns the results (echo_bench style).
+
+    `timeout` bounds the wait for recorded responses that never come;
+    they are counted as missing.
+    """
+    _, sessions = load_sessions(path)
+    shares = [replicas // processes + (i < replicas % processes) for i in range(processes)]
+    start = time.perf_counter()
+    if processes == 1:
+        outcomes = [asyncio.run(_replay(sessions, host, port, speed, replicas, timeout))]
+    else:
+        results = mp.Queue()
+        procs = [mp.Process(target=_replay_process, args=(sessions, host, port, speed, n, timeout, results))
+                 for n in shares if n]
+        for p in procs:
+            p.start()
+        outcomes = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+    elapsed = time.perf_counter() - start
+
+    hist = LatencyHistogram()
+    totals = {}
+    for h, t in outcomes:
+        hist.merge(h)
+        for key, value in t.items():
+            totals[key] = totals.get(key, 0) + value
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"trace": str(path), "host": host, "port": port, "speed": speed,
+                   "replicas": replicas, "processes": processes, "sessions": len(sessions)},
+        "elapsed_sec": round(elapsed, 3),
+        **totals,
+        "msgs_per_sec": round(totals["requests"] / elapsed, 1) if elapsed else 0.0,
+        "latency_us": hist.to_dict(),
+    }
+
+
+def check_regression(result: dict, baseline: dict, max_regression=MAX_REGRESSION) -> bool:
+    """Prints the p99 comparison; False when p99 grew by more than max_regression percent."""
+    new = result["latency_us"]["summary"]["p99"]
+    old = baseline["latency_us"]["summary"]["p99"]
+    limit = old * (1 + max_regression / 100.0)
+    ok = new <= limit
+    print(f"[Replay] p99 {new} us vs baseline {old} us (limit {limit:.0f} us, +{max_regression}%): "
+          + ("OK" if ok else "REGRESSION"))
+    return ok
+
+
+def spawn_server(kind: str, port: int):
+    """Starts a local echo server or chat hub and waits until it accepts connections."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    if kind == "echo":
+        cmd = [os.path.join(here, "echo_server.py"), "--mode", "async"]
+    else:
+        # No history store, so replays neither read nor grow the real one.
+        cmd = [os.path.join(here, "simple_chat_server.py"), "--mode", "hub", "--history-dir", ""]
+    proc = subprocess.Popen([sys.executable, *cmd, "--host", "127.0.0.1", "--port", str(port)],
+                            stdout=subprocess.DEVNULL)
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"{kind} server did not start on port {port}")
+
+
+def print_report(result: dict):
+    lat = result["latency_us"]["summary"]
+    cfg = result["config"]
+    print("------------------------------------")
+    print(f"Trace:         {cfg['trace']} ({cfg['sessions']} connections x {cfg['replicas']} replicas)")
+    print(f"Target:        {cfg['host']}:{cfg['port']}  speed={cfg['speed'] or 'max'}")
+    print(f"Elapsed:       {result['elapsed_sec']} s")
+    print(f"Requests:      {result['requests']} ({result['msgs_per_sec']}/s), responses {result['responses']} "
+          f"(unsolicited {result['unsolicited']}, missing {result['missing']}, errors {result['errors']})")
+    print(f"Latency (us):  p50={lat['p50']} p90={lat['p90']} p99={lat['p99']} "
+          f"p999={lat['p999']} max={lat['max']}")
+    print("------------------------------------")
+
+
+def _address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Record and replay echo/chat traffic")
+    sub = ap.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Run a recording proxy in front of a server")
+    rec.add_argument("--listen", default="5051", help="Proxy [host:]port")
+    rec.add_argument("--target", default="127.0.0.1:5050", help="Server host:port")
+    rec.add_argument("--out", required=True, help="Trace file to write")
+    rec.add_argument("--payloads", action="store_true", help="Record payloads, not only sizes")
+    rep = sub.add_parser("replay", help="Replay a trace against a server")
+    rep.add_argument("trace", help="Trace file")
+    rep.add_argument("--host", default="127.0.0.1", help="Server host")
+    rep.add_argument("--port", type=int, default=5050, help="Server port")
+    rep.add_argument("--spawn", choices=("echo", "chat"), help="Start a local echo server / chat hub on --port")
+    rep.add_argument("--speed", type=float, default=1.0, help="Pace multiplier (1 = as recorded, 0 = max)")
+    rep.add_argument("--replicas", type=int, default=1, help="Copies of the trace to run at once")
+    rep.add_argument("--processes", type=int, default=1, help="Processes to spread the replicas over")
+    rep.add_argument("--timeout", type=float, default=RESPONSE_TIMEOUT,
+                     help="Seconds to wait for recorded responses before counting them missing")
+    rep.add_argument("--json", help="Write the JSON result to this file")
+    rep.add_argument("--baseline", help="JSON result of an earlier replay to compare against")
+    rep.add_argument("--max-regression", type=float, default=MAX_REGRESSION,
+                     help="Allowed p99 increase over the baseline, in percent")
+    show = sub.add_parser("show", help="Summarise a trace file")
+    show.add_argument("trace", help="Trace file")
+    args = ap.parse_args(argv)
+
+    if args.command == "show":
+        for key, value in describe(args.trace).items():
+            print(f"{key:>15}: {value}")
+        return
+    if args.command == "record":
+        listen_host, listen_port = _address(args.listen if ":" in args.listen else f"0.0.0.0:{args.listen}")
+        summary = record(listen_host, listen_port, *_address(args.target), args.out, args.payloads)
+        for key, value in summary.items():
+            print(f"{key:>15}: {value}")
+        return
+
+    server = spawn_server(args.spawn, args.port) if args.spawn else None
+    try:
+        result = replay(args.trace, args.host, args.port, args.speed, args.replicas, args.processes,
+                        args.timeout)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"[Replay] Results written to {args.json}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        from echo_bench import compare
+        compare(result, baseline)
+        if not check_regression(result, baseline, args.max_regression):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
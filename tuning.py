@@ -0,0 +1,370 @@
+"""
+This script sweeps socket options against a local echo server and reports
+the best configuration for each payload size.
+
+The matrix covers SO_RCVBUF/SO_SNDBUF sizes (0 = kernel default with
+autotuning), TCP_NODELAY, TCP_QUICKACK, TCP_CORK and blocking vs.
+non-blocking I/O. Every combination gets a fresh client connection with
+the options set before connect(), and two phases per payload size:
+
+1. Latency: one framed message at a time (ping-pong), recorded into the
+   HDR-style histogram from histogram.py.
+2. Throughput: frames are streamed for a fixed time while the echoes are
+   read back concurrently (a writer thread for blocking sockets, one
+   select() loop for non-blocking ones), so neither side stalls on a full
+   send buffer.
+
+The winner per payload size (by throughput or by p99 latency) can be saved
+as a named profile in socket_profiles.json and applied to the echo and
+chat sockets with --profile (see settings.apply_profile). Candidates with
+TCP_CORK set are measured and reported but never win: a saved profile is
+applied to long-lived sockets that nothing uncorks. Candidates whose p99
+is more than --max-p99-factor times the kernel-default p99 are rejected
+too, so a throughput win cannot hide a latency cliff.
+
+Note that the sweep tunes the client side of the connection (the spawned
+or given echo server keeps its own settings), while --profile is mostly
+used on server-side accepted sockets. Buffer sizes and TCP_NODELAY carry
+over reasonably well since echo traffic is symmetric, but the numbers are
+those of a tuned client talking to an untuned server.
+
+Examples:
+    python3 tuning.py --spawn-server --payloads 64,16384 --save fast
+    python3 tuning.py --port 5050 --buffers 0,262144 --options nodelay,cork --objective latency
+"""
+
+import argparse
+import itertools
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+from echo_bench import spawn_server
+from framing import FrameDecoder, encode_frame
+from histogram import LatencyHistogram
+from settings import PROFILES_FILE, TCP_FLAGS, apply_profile, save_profile
+
+DEFAULT_BUFFERS = (0, 64 * 1024, 256 * 1024, 1024 * 1024)
+DEFAULT_PAYLOADS = (64, 1024, 16 * 1024, 256 * 1024)
+PHASE_SECONDS = 0.2
+MAX_PINGS = 2000
+MAX_P99_FACTOR = 3.0
+RECV_CHUNK = 256 * 1024
+
+
+def supported_options(names=TCP_FLAGS):
+    """TCP flags from `names` that this platform's socket module provides."""
+    return [n for n in names if hasattr(socket, TCP_FLAGS[n])]
+
+
+def option_matrix(buffers=DEFAULT_BUFFERS, options=None, modes=(False, True)):
+    """Yields one profile dict per combination of buffer size, flags and mode."""
+    options = supported_options() if options is None else list(options)
+    for bufsize in buffers:
+        for flags in itertools.product((False, True), repeat=len(options)):
+            for nonblocking in modes:
+                profile = {"rcvbuf": bufsize, "sndbuf": bufsize}
+                profile.update(dict(zip(options, flags)))
+                profile["nonblocking"] = nonblocking
+                yield profile
+
+
+def describe(profile: dict) -> str:
+    buf = profile.get("rcvbuf") or "default"
+    flags = [k for k in TCP_FLAGS if profile.get(k)] or ["-"]
+    mode = "nonblocking" if profile.get("nonblocking") else "blocking"
+    return f"buf={buf} flags={'+'.join(flags)} {mode}"
+
+
+class _Client:
+    """One tuned client connection with blocking or non-blocking framed I/O."""
+
+    def __init__(self, host, port, profile):
+        self.profile = profile
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Buffer sizes must be set before connect() to affect window scaling.
+        apply_profile(self.sock, profile, cork=True)
+        self.sock.connect((host, port))
+        self.sock.setblocking(not profile.get("nonblocking"))
+        self.quickack = profile.get("quickack") and hasattr(socket, "TCP_QUICKACK")
+        self.decoder = FrameDecoder()
+
+    def close(self):
+        self.sock.close()
+
+    def _rearm_quickack(self):
+        # Linux clears TCP_QUICKACK again after it is used, so set it per read.
+        if self.quickack:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+    def send_all(self, data):
+        if self.sock.getblocking():
+            self.sock.sendall(data)
+            return
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[self.sock.send(view):]
+            except BlockingIOError:
+                select.select([], [self.sock], [])
+
+    def recv(self, read) -> int:
+        """Calls read() (a recv_into), waiting for data on non-blocking sockets; 0 = EOF."""
+        while True:
+            try:
+                n = read()
+                self._rearm_quickack()
+                return n
+            except BlockingIOError:
+                select.select([self.sock], [], [])
+
+    def recv_frame(self):
+        while True:
+            for frame in self.decoder.frames():
+                return frame
+            if not self.recv(lambda: self.decoder.recv_into(self.sock, RECV_CHUNK)):
+                raise ConnectionError("echo server closed the connection")
+
+    def ping_pong(self, frame, duration) -> LatencyHistogram:
+        hist = LatencyHistogram()
+        deadline = time.perf_counter() + duration
+        for _ in range(MAX_PINGS):
+            start = time.perf_counter()
+            self.send_all(frame)
+            self.recv_frame()
+            now = time.perf_counter()
+            hist.record((now - start) * 1_000_000)
+            if now >= deadline:
+                break
+        return hist
+
+    def stream(self, frame, duration) -> tuple:
+        """Streams `frame` for `duration` seconds; returns (bytes echoed, elapsed)."""
+        if self.sock.getblocking():
+            return self._stream_blocking(frame, duration)
+        return self._stream_nonblocking(frame, duration)
+
+    def _stream_blocking(self, frame, duration):
+        received = 0
+        buf = bytearray(RECV_CHUNK)
+
+        def writer():
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                self.sock.sendall(frame)
+            # The echo server closes after flushing, which ends the reader below.
+            self.sock.shutdown(socket.SHUT_WR)
+
+        start = time.perf_counter()
+        t = threading.Thread(target=writer, daemon=True)
+        t.start()
+        while True:
+            n = self.recv(lambda: self.sock.recv_into(buf))
+            if not n:
+                break
+            received += n
+        t.join()
+        return received, time.perf_counter() - start
+
+    def _stream_nonblocking(self, frame, duration):
+        sock = self.sock
+        view = memoryview(frame)
+        buf = bytearray(RECV_CHUNK)
+        sent = received = offset = 0
+        start = time.perf_counter()
+        deadline = start + duration
+        while True:
+            sending = offset or time.perf_counter() < deadline
+            if not sending and received >= sent:
+                break
+            readable, writable, _ = select.select([sock], [sock] if sending else [], [])
+            if writable:
+                try:
+                    n = sock.send(view[offset:])
+                    sent += n
+                    offset = (offset + n) % len(frame)
+                except BlockingIOError:
+                    pass
+            if readable:
+                try:
+                    n = sock.recv_into(buf)
+                except BlockingIOError:
+                    continue
+                if not n:
+                    raise ConnectionError("echo server closed the connection")
+                self._rearm_quickack()
+                received += n
+        return received, time.perf_counter() - start
+
+
+def measure(host, port, profile, payload_size, duration=PHASE_SECONDS) -> dict:
+    """Runs the latency and throughput phases for one profile and payload size."""
+    frame = encode_frame(os.urandom(payload_size))
+    client = _Client(host, port, profile)
+    try:
+        hist = client.ping_pong(frame, duration)
+        echoed, elapsed = client.stream(frame, duration)
+        applied = {
+            "rcvbuf": client.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+            "sndbuf": client.sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+        }
+    finally:
+        client.close()
+    lat = hist.summary()
+    return {
+        "profile": profile,
+        "payload": payload_size,
+        "mb_per_sec": round(echoed / elapsed / 1e6, 2) if elapsed else 0.0,
+        "p50_us": lat["p50"],
+        "p99_us": lat["p99"],
+        "pings": lat["count"],
+        "applied": applied,
+    }
+
+
+def sweep(host="127.0.0.1", port=5050, buffers=DEFAULT_BUFFERS, payloads=DEFAULT_PAYLOADS,
+          options=None, modes=(False, True), duration=PHASE_SECONDS, progress=True) -> list:
+    """Measures every profile of the matrix for every payload size."""
+    profiles = list(option_matrix(buffers, options, modes))
+    results = []
+    total = len(profiles) * len(payloads)
+    for payload in payloads:
+        for profile in profiles:
+            try:
+                result = measure(host, port, profile, payload, duration)
+            except OSError as e:
+                result = {"profile": profile, "payload": payload, "error": str(e)}
+            results.append(result)
+            if progress:
+                print(f"[Tuning] {len(results)}/{total} payload={payload}B {describe(profile)}: "
+                      + (f"{result['mb_per_sec']} MB/s, p99 {result['p99_us']} us"
+                         if "error" not in result else f"error: {result['error']}"))
+    return results
+
+
+def best_per_payload(results, objective="throughput", max_p99_factor=MAX_P99_FACTOR) -> dict:
+    """payload size -> best result, by MB/s (higher) or p99 latency (lower).
+
+    Profiles with TCP_CORK set, and profiles whose p99 is more than
+    `max_p99_factor` times the kernel-default p99 (0 = no limit), are skipped.
+    """
+    best = {}
+    baselines = {}
+    for r in results:
+        if "error" in r or r["profile"].get("cork"):
+            continue
+        if max_p99_factor:
+            if r["payload"] not in baselines:
+                baselines[r["payload"]] = _baseline(results, r["payload"])
+            base = baselines[r["payload"]]
+            if base is not None and r["p99_us"] > max_p99_factor * base["p99_us"]:
+                continue
+        current = best.get(r["payload"])
+        if current is None:
+            best[r["payload"]] = r
+        elif objective == "latency":
+            if (r["p99_us"], -r["mb_per_sec"]) < (current["p99_us"], -current["mb_per_sec"]):
+                best[r["payload"]] = r
+        elif (r["mb_per_sec"], -r["p99_us"]) > (current["mb_per_sec"], -current["p99_us"]):
+            best[r["payload"]] = r
+    return best
+
+
+def _baseline(results, payload):
+    """The kernel-default, all-flags-off, blocking result for a payload size."""
+    for r in results:
+        p = r["profile"]
+        if (r["payload"] == payload and "error" not in r and not p.get("rcvbuf")
+                and not p.get("nonblocking") and not any(p.get(k) for k in TCP_FLAGS)):
+            return r
+    return None
+
+
+def print_report(results, objective="throughput", max_p99_factor=MAX_P99_FACTOR):
+    print("------------------------------------")
+    print(f"Best socket configuration per payload size (objective: {objective})")
+    for payload, r in sorted(best_per_payload(results, objective, max_p99_factor).items()):
+        line = (f"  {payload:>8} B: {describe(r['profile'])} -> "
+                f"{r['mb_per_sec']} MB/s, p50 {r['p50_us']} us, p99 {r['p99_us']} us")
+        base = _baseline(results, payload)
+        if base is not None and base is not r and base["mb_per_sec"]:
+            line += (f" (default: {base['mb_per_sec']} MB/s, p99 {base['p99_us']} us)")
+        print(line)
+    errors = sum(1 for r in results if "error" in r)
+    if errors:
+        print(f"  ({errors} combination(s) failed)")
+    print("------------------------------------")
+
+
+def save_best(results, name, objective="throughput", path=PROFILES_FILE, max_p99_factor=MAX_P99_FACTOR) -> list:
+    """Saves the winners as profiles: `name` for one payload size, else `name-<size>`."""
+    best = best_per_payload(results, objective, max_p99_factor)
+    saved = []
+    for payload, r in sorted(best.items()):
+        profile_name = name if len(best) == 1 else f"{name}-{payload}"
+        profile = {k: v for k, v in r["profile"].items() if k != "cork"}
+        profile.update(payload=payload, objective=objective, mb_per_sec=r["mb_per_sec"], p99_us=r["p99_us"])
+        save_profile(profile_name, profile, path)
+        saved.append(profile_name)
+    return saved
+
+
+def _int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Socket option tuning sweep against an echo server")
+    ap.add_argument("--host", default="127.0.0.1", help="Echo server host")
+    ap.add_argument("--port", type=int, default=5050, help="Echo server port")
+    ap.add_argument("--spawn-server", action="store_true", help="Start a local async echo_server for the sweep")
+    ap.add_argument("--buffers", type=_int_list, default=list(DEFAULT_BUFFERS),
+                    help="Comma-separated SO_RCVBUF/SO_SNDBUF sizes (0 = kernel default)")
+    ap.add_argument("--payloads", type=_int_list, default=list(DEFAULT_PAYLOADS),
+                    help="Comma-separated payload sizes in bytes")
+    ap.add_argument("--options", default=",".join(supported_options()),
+                    help="Comma-separated TCP flags to toggle (nodelay, quickack, cork)")
+    ap.add_argument("--modes", default="blocking,nonblocking", help="I/O modes to compare")
+    ap.add_argument("--duration", type=float, default=PHASE_SECONDS, help="Seconds per phase and combination")
+    ap.add_argument("--objective", choices=("throughput", "latency"), default="throughput",
+                    help="What 'best' means")
+    ap.add_argument("--max-p99-factor", type=float, default=MAX_P99_FACTOR,
+                    help="Reject candidates whose p99 exceeds this multiple of the kernel-default p99 (0 = off)")
+    ap.add_argument("--save", metavar="NAME", help="Save the winning configuration(s) as a named profile")
+    ap.add_argument("--profiles", default=PROFILES_FILE, help="Profile file to save into")
+    ap.add_argument("--json", help="Write all measurements to this JSON file")
+    args = ap.parse_args(argv)
+
+    options = [o.strip() for o in args.options.split(",") if o.strip()]
+    unknown = [o for o in options if o not in TCP_FLAGS]
+    if unknown:
+        ap.error(f"unknown option(s): {', '.join(unknown)}")
+    missing = [o for o in options if o not in supported_options()]
+    if missing:
+        print(f"[Tuning] Not supported on this platform, skipped: {', '.join(missing)}")
+        options = [o for o in options if o not in missing]
+    modes = [m.strip() == "nonblocking" for m in args.modes.split(",") if m.strip()]
+
+    server = spawn_server("async", args.port) if args.spawn_server else None
+    try:
+        results = sweep(args.host, args.port, args.buffers, args.payloads, options, modes, args.duration)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print_report(results, args.objective, args.max_p99_factor)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[Tuning] Measurements written to {args.json}")
+    if args.save:
+        names = save_best(results, args.save, args.objective, args.profiles, args.max_p99_factor)
+        print(f"[Tuning] Saved profile(s) {', '.join(names)} to {args.profiles}")
+
+
+if __name__ == "__main__":
+    main()
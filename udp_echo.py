@@ -0,0 +1,344 @@
+"""
+This module is the UDP side of the echo module, for measuring packet
+rates and small-datagram latency, which the TCP echo cannot show.
+
+Server (echo_server.py --mode udp):
+- One preallocated 64 KiB receive buffer, filled with recvfrom_into()
+  or recvmsg_into(); echoes go out straight from a memoryview of it.
+- Python has no recvmmsg()/sendmmsg(). On Linux the server instead
+  enables UDP GRO, so the kernel can hand over a run of same-sized
+  datagrams from one sender in a single receive, and echoes such a run
+  back with one sendmsg() carrying UDP_SEGMENT (GSO), which the kernel
+  splits into the original datagrams again. Elsewhere it falls back to
+  one datagram per call.
+- Each select() wakeup drains up to `batch` receives before sleeping
+  again, like the SNTP server.
+
+Client (echo_client.py --udp):
+- Sends numbered, timestamped datagrams paced at a target rate (or as
+  fast as possible with rate 0), in batches of one GSO send where the
+  platform supports it.
+- Tracks every reply by sequence number: losses, reordered arrivals and
+  duplicates, plus a round-trip latency histogram and the achieved
+  send/receive packets per second.
+
+Examples:
+    python3 echo_server.py --mode udp --port 5050
+    python3 echo_client.py --udp --port 5050 --rate 50000 --size 64 --duration 5
+"""
+
+import multiprocessing as mp
+import select
+import socket
+import struct
+import sys
+import time
+
+import metrics
+from histogram import LatencyHistogram
+
+MAX_DATAGRAM = 65535
+DEFAULT_RCVBUF = 4 * 1024 * 1024
+BATCH_LIMIT = 256
+STATS_INTERVAL = 1.0
+# Linux UDP segmentation offload / receive coalescing; the socket module does not export these.
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)
+UDP_GRO = getattr(socket, "UDP_GRO", 104)
+MAX_SEGMENTS = 64
+
+_PROBE = struct.Struct("!QQ")  # sequence number, send time (perf_counter_ns)
+MIN_SIZE = _PROBE.size
+
+
+def _enable(sock, option, value) -> bool:
+    """Sets a SOL_UDP option; False where the platform does not support it."""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, option, value)
+        return True
+    except OSError:
+        return False
+
+
+class UDPEchoServer:
+    """Echoes every datagram back to its sender."""
+
+    def __init__(self, host="0.0.0.0", port=5050, bufsize=DEFAULT_RCVBUF, batch=BATCH_LIMIT,
+                 gro=True, reuse_port=False, stats_hook=None):
+        self.host = host
+        self.port = port
+        self.bufsize = bufsize
+        self.batch = batch
+        self.gro = gro
+        self.reuse_port = reuse_port
+        self.stats_hook = stats_hook
+        labels = {"port": port}
+        self.counters = {
+            key: metrics.counter(f"udp_echo_{key}_total", help_text, **labels)
+            for key, help_text in (
+                ("datagrams", "Datagrams echoed"),
+                ("bytes", "Bytes echoed"),
+                ("recv_calls", "Receive calls, including empty drains"),
+                ("send_calls", "Send calls (one per GSO run)"),
+                ("send_drops", "Echoes dropped because the send buffer was full"),
+                ("send_errors", "Echoes that failed to send"),
+            )
+        }
+        self.batch_size = metrics.histogram("udp_echo_batch_size", "Datagrams drained per wakeup", **labels)
+        self._buf = bytearray(MAX_DATAGRAM)
+        self._view = memoryview(self._buf)
+        self._running = False
+
+    @property
+    def stats(self) -> dict:
+        return {key: c.value for key, c in self.counters.items()}
+
+    def _send(self, sock, data, addr, segment=0):
+        try:
+            if segment:
+                sock.sendmsg([data], [(SOL_UDP, UDP_SEGMENT, segment.to_bytes(2, sys.byteorder))], 0, addr)
+            else:
+                sock.sendto(data, addr)
+            self.counters["send_calls"].inc()
+        except (BlockingIOError, InterruptedError):
+            self.counters["send_drops"].inc()
+        except OSError:
+            self.counters["send_errors"].inc()
+
+    def _drain(self, sock, gro) -> int:
+        """Receives and echoes up to `batch` times; returns the datagrams echoed."""
+        view = self._view
+        recv_calls = self.counters["recv_calls"]
+        cmsg_space = socket.CMSG_SPACE(4)
+        echoed = 0
+        for _ in range(self.batch):
+            recv_calls.inc()
+            try:
+                if gro:
+                    nbytes, ancdata, _, addr = sock.recvmsg_into([view], cmsg_space)
+                else:
+                    nbytes, addr = sock.recvfrom_into(view)
+                    ancdata = ()
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue  # e.g. ICMP port unreachable reported on the next receive
+            segment = 0
+            for level, kind, data in ancdata:
+                if level == SOL_UDP and kind == UDP_GRO:
+                    segment = int.from_bytes(data[:4], sys.byteorder)
+            count = -(-nbytes // segment) if segment and nbytes > segment else 1
+            self._send(sock, view[:nbytes], addr, segment if count > 1 else 0)
+            echoed += count
+            self.counters["bytes"].inc(nbytes)
+        self.counters["datagrams"].inc(echoed)
+        return echoed
+
+    def serve_forever(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.bufsize)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.bufsize)
+            sock.bind((self.host, self.port))
+            sock.setblocking(False)
+            self.port = sock.getsockname()[1]
+            gro = self.gro and _enable(sock, UDP_GRO, 1)
+            print(f"[Echo Server] (udp) Listening on udp://{self.host}:{self.port} "
+                  f"batch={self.batch} gro={'on' if gro else 'off'}")
+
+            self._running = True
+            next_stats = time.monotonic() + STATS_INTERVAL
+            while self._running:
+                ready, _, _ = select.select([sock], [], [], 0.5)
+                if ready:
+                    self.batch_size.observe(self._drain(sock, gro))
+                if self.stats_hook and time.monotonic() >= next_stats:
+                    self.stats_hook(self.stats)
+                    next_stats = time.monotonic() + STATS_INTERVAL
+
+    def stop(self):
+        self._running = False
+
+
+def start_udp_echo_server(host="0.0.0.0", port=5050, bufsize=DEFAULT_RCVBUF, batch=BATCH_LIMIT,
+                          reuse_port=False, stats_hook=None):
+    """Runs the UDP echo server until Ctrl+C."""
+    server = UDPEchoServer(host, port, bufsize, batch, reuse_port=reuse_port, stats_hook=stats_hook)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[Echo Server] Interrupted by user.")
+    finally:
+        print(f"[Echo Server] Stats: {server.stats}")
+
+
+# -- paced client ----------------------------------------------------------------
+
+class SequenceTracker:
+    """Loss, reordering, duplicates and latency of numbered replies."""
+
+    def __init__(self):
+        self.seen = bytearray()
+        self.highest = -1
+        self.received = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.unexpected = 0
+        self.hist = LatencyHistogram()
+
+    def record(self, seq, sent_ns, now_ns, sent):
+        if seq >= sent:
+            self.unexpected += 1  # never sent by us: corrupt or foreign datagram
+            return
+        if seq >= len(self.seen):
+            self.seen.extend(bytes(max(seq + 1, 2 * len(self.seen)) - len(self.seen)))
+        if self.seen[seq]:
+            self.duplicates += 1
+            return
+        self.seen[seq] = 1
+        self.received += 1
+        if seq < self.highest:
+            self.reordered += 1
+        else:
+            self.highest = seq
+        self.hist.record((now_ns - sent_ns) // 1000)
+
+
+def _udp_sender(host, port, rate, duration, size, batch, gso, drain):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DEFAULT_RCVBUF)
+    sock.connect((host, port))
+    sock.setblocking(False)
+    # A GSO send must fit in one datagram and stay within the segment limit.
+    gso = gso and batch > 1 and _enable(sock, UDP_SEGMENT, size)
+    if gso:
+        batch = min(batch, MAX_SEGMENTS, (MAX_DATAGRAM - 28) // size)
+    _enable(sock, UDP_GRO, 1)  # replies then arrive as runs of `size`-byte datagrams
+
+    out = bytearray(size * batch)
+    out_view = memoryview(out)
+    inbuf = bytearray(MAX_DATAGRAM)
+    in_view = memoryview(inbuf)
+    tracker = SequenceTracker()
+    counts = {"sent": 0, "send_calls": 0, "send_blocked": 0, "recv_calls": 0}
+    perf_ns = time.perf_counter_ns
+    pack = _PROBE.pack_into
+    unpack = _PROBE.unpack_from
+
+    def receive():
+        while True:
+            counts["recv_calls"] += 1
+            try:
+                nbytes = sock.recv_into(in_view)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionRefusedError:
+                continue
+            now = perf_ns()
+            for offset in range(0, nbytes - MIN_SIZE + 1, size):
+                seq, sent_ns = unpack(in_view, offset)
+                tracker.record(seq, sent_ns, now, counts["sent"])
+
+    start = time.perf_counter()
+    deadline = start + duration
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        due = batch if not rate else min(batch, int((now - start) * rate) - counts["sent"])
+        if due > 0:
+            seq = counts["sent"]
+            for i in range(due):
+                pack(out, i * size, seq + i, perf_ns())
+            try:
+                if gso:
+                    sock.send(out_view[:due * size])
+                    counts["send_calls"] += 1
+                    counts["sent"] += due
+                else:
+                    for i in range(due):
+                        sock.send(out_view[i * size:(i + 1) * size])
+                        counts["send_calls"] += 1
+                        counts["sent"] += 1
+            except (BlockingIOError, InterruptedError, ConnectionRefusedError):
+                counts["send_blocked"] += 1
+        # Wait for replies until the next datagram is due (not at all when flooding or behind).
+        timeout = 0.0
+        if rate:
+            timeout = max(0.0, min(deadline, start + (counts["sent"] + 1) / rate) - time.perf_counter())
+        ready, _, _ = select.select([sock], [], [], timeout)
+        if ready:
+            receive()
+    elapsed = time.perf_counter() - start
+
+    drain_until = time.perf_counter() + drain
+    while True:
+        left = drain_until - time.perf_counter()
+        if left <= 0 or tracker.received >= counts["sent"]:
+            break
+        ready, _, _ = select.select([sock], [], [], left)
+        if ready:
+            receive()
+    sock.close()
+
+    counts.update(received=tracker.received, reordered=tracker.reordered,
+                  duplicates=tracker.duplicates, unexpected=tracker.unexpected,
+                  gso=int(gso), elapsed=elapsed)
+    return counts, tracker.hist
+
+
+def _sender_process(args, results):
+    results.put(_udp_sender(*args))
+
+
+def run_udp_client(host="127.0.0.1", port=5050, rate=10000.0, duration=5.0, size=64,
+                   senders=1, batch=32, gso=True, drain=0.5) -> dict:
+    """Sends paced, numbered datagrams from `senders` processes and reports the results.
+
+    `rate` is the total target in datagrams per second (0 = as fast as
+    possible), shared evenly by the senders.
+    """
+    if size < MIN_SIZE:
+        raise ValueError(f"UDP payload must be at least {MIN_SIZE} bytes")
+    args = (host, port, rate / senders, duration, size, batch, gso, drain)
+    if senders == 1:
+        outcomes = [_udp_sender(*args)]
+    else:
+        results = mp.Queue()
+        procs = [mp.Process(target=_sender_process, args=(args, results)) for _ in range(senders)]
+        for p in procs:
+            p.start()
+        outcomes = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+
+    hist = LatencyHistogram()
+    totals = {}
+    for counts, h in outcomes:
+        hist.merge(h)
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+    elapsed = max(counts["elapsed"] for counts, _ in outcomes)
+    sent, received = totals["sent"], totals["received"]
+    return {
+        "senders": senders,
+        "size": size,
+        "target_pps": rate or "max",
+        "gso": totals["gso"] == senders,
+        "elapsed_sec": round(elapsed, 3),
+        "sent": sent,
+        "received": received,
+        "lost": sent - received,
+        "loss_pct": round(100.0 * (sent - received) / sent, 3) if sent else 0.0,
+        "reordered": totals["reordered"],
+        "duplicates": totals["duplicates"],
+        "send_blocked": totals["send_blocked"],
+        "send_pps": round(sent / elapsed, 1) if elapsed else 0.0,
+        "recv_pps": round(received / elapsed, 1) if elapsed else 0.0,
+        "sends_per_call": round(sent / max(1, totals["send_calls"]), 2),
+        "latency_us": hist.summary(),
+    }
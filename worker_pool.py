@@ -0,0 +1,177 @@
+"""
+This module implements a pre-fork worker pool for the echo and chat
+servers. N worker processes each bind the same host:port with
+SO_REUSEPORT, so the kernel balances incoming connections across them
+and accept throughput scales with the number of cores.
+
+A supervisor process:
+- starts the workers and restarts any worker that dies,
+- collects the statistics each worker reports over a queue,
+- prints a per-worker summary at a fixed interval,
+- exports each worker's latest numbers as metrics.py gauges labelled with
+  the worker index (e.g. echo_pool_bytes_in{worker="2"}),
+- stops all workers on Ctrl+C / SIGTERM.
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import signal
+import socket
+import time
+
+import metrics
+
+REPORT_INTERVAL = 5.0
+RESTART_BACKOFF = 0.5
+
+
+def reuseport_supported() -> bool:
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def make_stats_hook(stats_queue, index):
+    """Returns a callable that a server uses to publish its counters."""
+    def hook(stats: dict):
+        stats = dict(stats, worker=index, pid=os.getpid(), ts=time.time())
+        try:
+            stats_queue.put_nowait(stats)
+        except queue.Full:
+            pass
+    return hook
+
+
+def _worker_main(target, kwargs, index, stats_queue):
+    # The supervisor handles SIGINT for the whole group; workers stop on SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Never block process exit on flushing stats the supervisor may not read.
+    stats_queue.cancel_join_thread()
+    kwargs = dict(kwargs, reuse_port=True, stats_hook=make_stats_hook(stats_queue, index))
+    try:
+        target(**kwargs)
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerPool:
+    """Supervises N server processes sharing one port via SO_REUSEPORT."""
+
+    def __init__(self, target, kwargs: dict, workers: int, name="Pool",
+                 report_interval=REPORT_INTERVAL):
+        if not reuseport_supported():
+            raise OSError("SO_REUSEPORT is not supported on this platform")
+        self.target = target
+        self.kwargs = kwargs
+        self.workers = max(1, int(workers))
+        self.name = name
+        self.report_interval = report_interval
+        self.stats_queue = mp.Queue(maxsize=10000)
+        self.procs = {}
+        self.restarts = {}
+        self.latest = {}
+        self.metric_prefix = "_".join(name.lower().split())
+        self._stopping = False
+
+    def _spawn(self, index):
+        p = mp.Process(
+            target=_worker_main,
+            args=(self.target, self.kwargs, index, self.stats_queue),
+            name=f"{self.name}-worker-{index}",
+            daemon=True,
+        )
+        p.start()
+        self.procs[index] = p
+        print(f"[{self.name}] Worker {index} started (pid={p.pid})")
+
+    def _drain_stats(self):
+        while True:
+            try:
+                stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.latest[stats["worker"]] = stats
+            for key, value in stats.items():
+                if key not in ("worker", "pid", "ts") and isinstance(value, (int, float)):
+                    metrics.gauge(f"{self.metric_prefix}_{key}", f"Latest {key} reported by each worker",
+                                  worker=stats["worker"]).set(value)
+
+    def _check_workers(self):
+        for index, p in list(self.procs.items()):
+            if p.is_alive() or self._stopping:
+                continue
+            self.restarts[index] = self.restarts.get(index, 0) + 1
+            print(f"[{self.name}] Worker {index} (pid={p.pid}) exited with code "
+                  f"{p.exitcode}; restarting (restart #{self.restarts[index]})")
+            time.sleep(RESTART_BACKOFF)
+            self._spawn(index)
+
+    def snapshot(self) -> dict:
+        """Latest stats per worker plus totals across the pool."""
+        self._drain_stats()
+        totals = {}
+        for stats in self.latest.values():
+            for key, value in stats.items():
+                if key in ("worker", "pid", "ts"):
+                    continue
+                if isinstance(value, (int, float)):
+                    totals[key] = totals.get(key, 0) + value
+        return {
+            "workers": {i: dict(s, restarts=self.restarts.get(i, 0)) for i, s in self.latest.items()},
+            "totals": totals,
+        }
+
+    def report(self):
+        snap = self.snapshot()
+        print(f"[{self.name}] --- worker stats ---")
+        for index in sorted(self.procs):
+            stats = snap["workers"].get(index, {})
+            fields = ", ".join(f"{k}={v}" for k, v in stats.items() if k not in ("worker", "ts"))
+            print(f"  worker {index}: {fields or 'no stats yet'}")
+        if snap["totals"]:
+            print("  total: " + ", ".join(f"{k}={v}" for k, v in snap["totals"].items()))
+
+    def stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        """Starts the workers and supervises them until stopped."""
+        previous = signal.signal(signal.SIGTERM, self.stop)
+        print(f"[{self.name}] Starting {self.workers} worker(s) with SO_REUSEPORT")
+        for index in range(self.workers):
+            self._spawn(index)
+
+        next_report = time.monotonic() + self.report_interval
+        try:
+            while not self._stopping:
+                time.sleep(0.2)
+                self._drain_stats()
+                self._check_workers()
+                if time.monotonic() >= next_report:
+                    self.report()
+                    next_report = time.monotonic() + self.report_interval
+        except KeyboardInterrupt:
+            print(f"\n[{self.name}] Interrupted by user.")
+        finally:
+            self._stopping = True
+            # A second Ctrl+C must not abort the shutdown half-way.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            self._shutdown()
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, previous)
+
+    def _shutdown(self, grace=3.0):
+        for p in self.procs.values():
+            if p.is_alive():
+                p.terminate()
+        deadline = time.monotonic() + grace
+        for p in self.procs.values():
+            p.join(max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                p.kill()
+        self.report()
+        print(f"[{self.name}] All workers stopped.")
+
+
+def run_worker_pool(target, kwargs: dict, workers: int, name="Pool"):
+    """Runs `target(**kwargs)` in `workers` processes sharing one port."""
+    WorkerPool(target, kwargs, workers, name=name).run()